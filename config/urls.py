@@ -12,6 +12,7 @@ urlpatterns = [
     path('accounts/', include('allauth.urls')),
     path('accounts/profile/', TemplateView.as_view(template_name='account/profile.html'), name='account_profile'),
     path('admin/', admin.site.urls),
+    path('documents/', include('documents.urls', namespace='documents')),
     path('contact/', TemplateView.as_view(template_name='account/profile.html'), name='contact'),
     path('banking/', include('bank_transactions.urls', namespace='bank_transactions')),
     path('banking/reconciliation/', include('bank_reconciliation.urls', namespace='bank_reconciliation')),
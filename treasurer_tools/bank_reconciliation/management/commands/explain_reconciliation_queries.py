@@ -0,0 +1,52 @@
+"""Command to show the query plans of the reconciliation queries"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from bank_reconciliation.utils import get_reconciliation_querysets
+
+
+class Command(BaseCommand):
+    """Prints the database query plan for each reconciliation query"""
+    help = "Shows the query plans (and optionally timings) of the reconciliation queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date-start",
+            help="Start of the date range (yyyy-mm-dd); defaults to one year ago",
+        )
+        parser.add_argument(
+            "--date-end",
+            help="End of the date range (yyyy-mm-dd); defaults to today",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Run the queries to include actual timings (PostgreSQL only)",
+        )
+
+    def handle(self, *args, **options):
+        date_end = parse_date(options["date_end"]) if options["date_end"] else timezone.now().date()
+        date_start = (
+            parse_date(options["date_start"]) if options["date_start"]
+            else date_end - timedelta(days=365)
+        )
+
+        if not date_start or not date_end:
+            raise CommandError("Dates must be in the format yyyy-mm-dd.")
+
+        explain_options = {}
+
+        if options["analyze"]:
+            if connection.vendor != "postgresql":
+                raise CommandError("--analyze is only supported on PostgreSQL.")
+
+            explain_options = {"analyze": True, "buffers": True}
+
+        for name, queryset in get_reconciliation_querysets(date_start, date_end).items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name.title()))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write("")
@@ -1,11 +1,27 @@
 """Test cases for the bank_reconciliation app views"""
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from simple_history.models import HistoricalRecords
 
 from bank_reconciliation.models import ReconciliationGroup
-from bank_reconciliation.utils import return_transactions_as_json, BankReconciliation
+from bank_reconciliation.utils import (
+    return_transactions_as_json, return_matches_as_json, find_match_candidates,
+    get_reconciliation_querysets, unmatch_reconciliation_groups, BankReconciliation,
+)
+from bank_transactions.models import BankTransaction
 from financial_transactions.models import FinancialTransaction
+from investments.models import Investment, InvestmentDetail
 
-from .utils import create_bank_transactions, create_financial_transactions
+from .utils import create_bank_statement, create_bank_transactions, create_financial_transactions
 
 
 class ReturnTransactionsAsJSONTest(TestCase):
@@ -353,6 +369,99 @@ class BankReconciliationObjectTest(TestCase):
             self.valid_data["financial_ids"][0]
         )
 
+    def test_match_creates_history_records(self):
+        """Checks that matching adds a history record for each entry"""
+        # Count the current history records
+        financial_history = FinancialTransaction.history.count()
+        bank_history = BankTransaction.history.count()
+
+        # Match the IDs
+        reconciliation = BankReconciliation("")
+        reconciliation.json_data = self.valid_data
+        reconciliation.create_matches()
+
+        # Check for the new history records
+        self.assertEqual(FinancialTransaction.history.count(), financial_history + 1)
+        self.assertEqual(BankTransaction.history.count(), bank_history + 1)
+
+        # Check that the history records the reconciliation group
+        self.assertEqual(
+            FinancialTransaction.history.first().reconciled_id,
+            ReconciliationGroup.objects.last().id
+        )
+
+    def test_match_rolls_back_on_reconciled_entry(self):
+        """Checks that no changes are saved if an entry is already reconciled"""
+        # Reconcile one of the bank IDs outside of the reconciliation object
+        group = ReconciliationGroup.objects.create()
+        self.bank_transactions[0].reconciled = group
+        self.bank_transactions[0].save()
+
+        total_matches = ReconciliationGroup.objects.count()
+
+        # Attempt to match the transactions
+        reconciliation = BankReconciliation("")
+        reconciliation.json_data = self.valid_data
+        reconciliation.create_matches()
+
+        # Check that nothing was matched
+        self.assertEqual(ReconciliationGroup.objects.count(), total_matches)
+        self.assertIsNone(
+            FinancialTransaction.objects.get(id=self.financial_transactions[0].id).reconciled
+        )
+        self.assertEqual(reconciliation.success["financial_id"], [])
+        self.assertEqual(
+            reconciliation.errors["bank_id"][0],
+            (
+                "One or more selected transactions have already been "
+                "reconciled. Refresh the page and try again."
+            )
+        )
+
+    def test_validation_query_count_independent_of_ids(self):
+        """Checks that validation does not query each ID individually"""
+        # Count queries to validate a single ID of each type
+        reconciliation = BankReconciliation("")
+        reconciliation.json_data = self.valid_data
+
+        with CaptureQueriesContext(connection) as single_queries:
+            reconciliation.is_valid()
+
+        # Count queries to validate all the IDs
+        reconciliation = BankReconciliation("")
+        reconciliation.json_data = {
+            "bank_ids": [transaction.id for transaction in self.bank_transactions],
+            "investment_ids": [],
+            "financial_ids": [transaction.id for transaction in self.financial_transactions],
+        }
+
+        with CaptureQueriesContext(connection) as multiple_queries:
+            self.assertTrue(reconciliation.is_valid())
+
+        self.assertEqual(len(single_queries), len(multiple_queries))
+
+    def test_match_query_count_independent_of_ids(self):
+        """Checks that matching does not query each ID individually"""
+        # Count queries to match a single ID of each type
+        reconciliation = BankReconciliation("")
+        reconciliation.json_data = self.valid_data
+
+        with CaptureQueriesContext(connection) as single_queries:
+            reconciliation.create_matches()
+
+        # Count queries to match all the remaining IDs
+        reconciliation = BankReconciliation("")
+        reconciliation.json_data = {
+            "bank_ids": [transaction.id for transaction in self.bank_transactions[1:]],
+            "investment_ids": [],
+            "financial_ids": [transaction.id for transaction in self.financial_transactions[1:]],
+        }
+
+        with CaptureQueriesContext(connection) as multiple_queries:
+            reconciliation.create_matches()
+
+        self.assertEqual(len(single_queries), len(multiple_queries))
+
     def test_error_on_invalid_raw_data(self):
         """Checks error response for invalid raw data"""
         # Setup the reconciliation object
@@ -554,3 +663,329 @@ class BankReconciliationObjectTest(TestCase):
                 "reconciled. Unmatch the transaction before reassigning it."
             )
         )
+
+class FindMatchCandidatesTest(TestCase):
+    """Tests the find_match_candidates function"""
+
+    def setUp(self):
+        self.financial = create_financial_transactions()
+        statement = create_bank_statement()
+
+        # Matches the $1000.00 revenue transaction on 2017-01-01
+        self.exact_deposit = BankTransaction.objects.create(
+            statement=statement,
+            date_transaction="2017-01-03",
+            description_bank="DEP1000",
+            amount_credit=1000.00,
+        )
+
+        # Matches the $105.00 and $137.29 expense transactions
+        self.combined_withdrawal = BankTransaction.objects.create(
+            statement=statement,
+            date_transaction="2017-06-06",
+            description_bank="WITHDRAWAL",
+            amount_debit=242.29,
+        )
+
+        # The $500.00 revenue transaction is outside the date tolerance
+        self.late_deposit = BankTransaction.objects.create(
+            statement=statement,
+            date_transaction="2017-03-01",
+            description_bank="DEP0500",
+            amount_credit=500.00,
+        )
+
+    def test_exact_and_subset_matches(self):
+        """Tests that exact and one-to-many matches are proposed"""
+        proposals = find_match_candidates(date(2017, 1, 1), date(2017, 12, 31))
+
+        self.assertEqual(len(proposals), 2)
+
+        self.assertEqual(proposals[0]["match_type"], "exact")
+        self.assertEqual(proposals[0]["bank_ids"], [self.exact_deposit.id])
+        self.assertEqual(proposals[0]["financial_ids"], [self.financial[1].id])
+        self.assertEqual(proposals[0]["total"], Decimal("1000.00"))
+
+        self.assertEqual(proposals[1]["match_type"], "subset")
+        self.assertEqual(proposals[1]["bank_ids"], [self.combined_withdrawal.id])
+        self.assertCountEqual(
+            proposals[1]["financial_ids"], [self.financial[0].id, self.financial[3].id]
+        )
+        self.assertEqual(proposals[1]["total"], Decimal("-242.29"))
+
+    def test_date_tolerance(self):
+        """Tests that a larger tolerance allows more distant matches"""
+        proposals = find_match_candidates(date(2017, 3, 1), date(2017, 3, 1), date_tolerance=60)
+
+        self.assertEqual(len(proposals), 1)
+        self.assertEqual(proposals[0]["bank_ids"], [self.late_deposit.id])
+        self.assertEqual(proposals[0]["financial_ids"], [self.financial[2].id])
+
+    def test_reconciled_entries_ignored(self):
+        """Tests that reconciled transactions are not proposed"""
+        group = ReconciliationGroup.objects.create()
+        FinancialTransaction.objects.filter(id=self.financial[1].id).update(reconciled=group)
+
+        proposals = find_match_candidates(date(2017, 1, 1), date(2017, 1, 31))
+
+        self.assertEqual(proposals, [])
+
+    def test_investment_matches(self):
+        """Tests that investment details are matched by their direction"""
+        investment = Investment.objects.create(name="GIC", rate="2%")
+        detail = InvestmentDetail.objects.create(
+            investment=investment,
+            date_investment="2017-06-06",
+            detail_status="v",
+            amount=242.29,
+        )
+
+        proposals = find_match_candidates(date(2017, 6, 1), date(2017, 6, 30))
+
+        self.assertEqual(proposals[0]["investment_ids"], [detail.id])
+        self.assertEqual(proposals[0]["financial_ids"], [])
+
+    def test_query_count(self):
+        """Tests that the number of queries does not depend on the data"""
+        with CaptureQueriesContext(connection) as queries:
+            find_match_candidates(date(2017, 1, 1), date(2017, 12, 31))
+
+        self.assertEqual(len(queries), 3)
+
+class ReturnMatchesAsJSONTest(TestCase):
+    """Tests the return_matches_as_json function"""
+
+    def setUp(self):
+        self.bank_transactions = create_bank_transactions()
+        self.financial_transactions = create_financial_transactions()
+
+        investment = Investment.objects.create(name="GIC", rate="2%")
+        self.investment_details = [
+            InvestmentDetail.objects.create(
+                investment=investment,
+                date_investment="2017-01-15",
+                detail_status="v",
+                amount=100.00,
+            ),
+            InvestmentDetail.objects.create(
+                investment=investment,
+                date_investment="2019-01-15",
+                detail_status="m",
+                amount=100.00,
+            ),
+        ]
+
+        self.request = RequestFactory().get(
+            "banking/reconciliation/retrieve-matches/",
+            {
+                "financial_date_start": "2017-01-01",
+                "financial_date_end": "2017-12-31",
+                "bank_date_start": "2017-01-01",
+                "bank_date_end": "2017-12-31",
+            },
+        )
+
+    def create_group(self, index):
+        """Reconciles the transactions at the provided index together"""
+        group = ReconciliationGroup.objects.create()
+
+        BankTransaction.objects.filter(
+            id=self.bank_transactions[index].id
+        ).update(reconciled=group)
+        FinancialTransaction.objects.filter(
+            id=self.financial_transactions[index].id
+        ).update(reconciled=group)
+
+        return group
+
+    def test_group_data(self):
+        """Tests that the group transactions are returned"""
+        group = self.create_group(1)
+
+        json_data = return_matches_as_json(self.request)
+
+        self.assertEqual(json_data["errors"], [])
+        self.assertEqual(len(json_data["data"]), 1)
+        self.assertEqual(json_data["data"][0]["id"], group.id)
+        self.assertEqual(
+            json_data["data"][0]["financial_transactions"][0]["total"],
+            self.financial_transactions[1].total
+        )
+        self.assertEqual(
+            json_data["data"][0]["bank_transactions"][0]["description"],
+            "Cheque #0002"
+        )
+
+    def test_investment_date_range(self):
+        """Tests that investment details after the end date are excluded"""
+        group = ReconciliationGroup.objects.create()
+        InvestmentDetail.objects.filter(
+            id=self.investment_details[1].id
+        ).update(reconciled=group)
+
+        json_data = return_matches_as_json(self.request)
+
+        self.assertEqual(json_data["data"], [])
+
+    def test_query_count(self):
+        """Tests that the number of queries does not depend on the groups"""
+        self.create_group(0)
+
+        with CaptureQueriesContext(connection) as single_group:
+            return_matches_as_json(self.request)
+
+        self.create_group(1)
+        self.create_group(2)
+        self.create_group(3)
+
+        with CaptureQueriesContext(connection) as many_groups:
+            json_data = return_matches_as_json(self.request)
+
+        self.assertEqual(len(json_data["data"]), 4)
+        self.assertEqual(len(single_group), len(many_groups))
+
+class ReconciliationQueryPlanTest(TestCase):
+    """Tests the query plans of the reconciliation queries"""
+
+    @skipUnless(connection.vendor == "sqlite", "Query plan format is database specific")
+    def test_queries_use_indexes(self):
+        """Tests that no reconciliation query scans a whole table"""
+        querysets = get_reconciliation_querysets(date(2017, 1, 1), date(2017, 12, 31))
+
+        for name, queryset in querysets.items():
+            plan = queryset.explain()
+
+            self.assertIn("INDEX", plan, name)
+            self.assertNotIn("SCAN", plan, name)
+
+    def test_explain_command(self):
+        """Tests that the command prints a plan for each query"""
+        output = StringIO()
+
+        call_command(
+            "explain_reconciliation_queries",
+            date_start="2017-01-01",
+            date_end="2017-12-31",
+            stdout=output,
+        )
+
+        self.assertIn("Unreconciled Bank Transactions", output.getvalue())
+        self.assertIn("Reconciled Investment Details", output.getvalue())
+
+class UnmatchReconciliationGroupsTest(TestCase):
+    """Tests the unmatch_reconciliation_groups function"""
+
+    def setUp(self):
+        self.bank_transactions = create_bank_transactions()
+        self.financial_transactions = create_financial_transactions()
+
+        investment = Investment.objects.create(name="GIC", rate="2%")
+        self.investment_detail = InvestmentDetail.objects.create(
+            investment=investment,
+            date_investment="2017-01-15",
+            detail_status="v",
+            amount=100.00,
+        )
+
+        self.groups = []
+
+        for index in range(4):
+            group = ReconciliationGroup.objects.create()
+
+            BankTransaction.objects.filter(
+                id=self.bank_transactions[index].id
+            ).update(reconciled=group)
+            FinancialTransaction.objects.filter(
+                id=self.financial_transactions[index].id
+            ).update(reconciled=group)
+
+            self.groups.append(group)
+
+        InvestmentDetail.objects.filter(id=self.investment_detail.id).update(
+            reconciled=self.groups[0]
+        )
+
+    def test_unmatch_groups(self):
+        """Tests that the groups are deleted and transactions unreconciled"""
+        errors = unmatch_reconciliation_groups([self.groups[0].id, self.groups[1].id])
+
+        self.assertEqual(errors, [])
+        self.assertEqual(ReconciliationGroup.objects.count(), 2)
+        self.assertEqual(BankTransaction.objects.filter(reconciled=None).count(), 2)
+        self.assertEqual(FinancialTransaction.objects.filter(reconciled=None).count(), 2)
+        self.assertEqual(InvestmentDetail.objects.filter(reconciled=None).count(), 1)
+
+    def test_unmatch_history(self):
+        """Tests that history is recorded for the groups and transactions"""
+        unmatch_reconciliation_groups([self.groups[0].id])
+
+        self.assertEqual(
+            ReconciliationGroup.history.filter(id=self.groups[0].id, history_type="-").count(),
+            1
+        )
+        self.assertIsNone(
+            BankTransaction.history.filter(
+                id=self.bank_transactions[0].id
+            ).latest().reconciled_id
+        )
+        self.assertIsNone(
+            FinancialTransaction.history.filter(
+                id=self.financial_transactions[0].id
+            ).latest().reconciled_id
+        )
+
+    def test_unmatch_history_user(self):
+        """Tests that the history records the user of the request"""
+        user = get_user_model().objects.create(username="treasurer", email="treasurer@email.com")
+        request = RequestFactory().post("/")
+        request.user = user
+        HistoricalRecords.context.request = request
+        self.addCleanup(delattr, HistoricalRecords.context, "request")
+
+        unmatch_reconciliation_groups([self.groups[0].id])
+
+        self.assertEqual(
+            ReconciliationGroup.history.get(id=self.groups[0].id, history_type="-").history_user,
+            user
+        )
+        self.assertEqual(
+            BankTransaction.history.filter(
+                id=self.bank_transactions[0].id
+            ).latest().history_user,
+            user
+        )
+
+    def test_unmatch_errors(self):
+        """Tests that each invalid ID is reported in order"""
+        errors = unmatch_reconciliation_groups(
+            ["x", self.groups[0].id, 999999, self.groups[0].id]
+        )
+
+        self.assertEqual(
+            errors,
+            [
+                {"ids": "Provided ID (x) is on wrong format"},
+                {"ids": "Provided ID (999999) does not exist"},
+                {"ids": "Provided ID ({}) does not exist".format(self.groups[0].id)},
+            ]
+        )
+        self.assertEqual(ReconciliationGroup.objects.count(), 3)
+
+    def test_query_count(self):
+        """Tests that only the group history adds a query per group"""
+        # Give the later groups an investment detail as well
+        InvestmentDetail.objects.create(
+            investment=self.investment_detail.investment,
+            date_investment="2017-01-20",
+            detail_status="m",
+            amount=100.00,
+            reconciled=self.groups[1],
+        )
+
+        with CaptureQueriesContext(connection) as single_group:
+            unmatch_reconciliation_groups([self.groups[0].id])
+
+        with CaptureQueriesContext(connection) as many_groups:
+            unmatch_reconciliation_groups([group.id for group in self.groups[1:]])
+
+        self.assertEqual(len(many_groups) - len(single_group), 2)
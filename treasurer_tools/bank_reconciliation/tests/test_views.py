@@ -269,3 +269,70 @@ class ReconciliationUnmatchTest(TestCase):
         json_response = str(response.content, encoding="UTF-8")
 
         self.assertTrue("errors" in json_response)
+
+class ReconciliationMatchCandidatesTest(TestCase):
+    """Tests the retrieve match candidates view"""
+
+    def setUp(self):
+        create_user()
+
+        self.correct_url = "/banking/reconciliation/retrieve-match-candidates/"
+
+    def test_redirect_if_not_logged_in(self):
+        """Checks redirect to login page if user is not logged in"""
+        response = self.client.get(self.correct_url)
+
+        self.assertRedirects(
+            response,
+            "/accounts/login/?next=/banking/reconciliation/retrieve-match-candidates/"
+        )
+
+    def test_for_response_on_valid_data(self):
+        """Checks that a JSON response is received on valid data"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(
+            self.correct_url,
+            {"date_start": "2017-01-01", "date_end": "2017-12-31", "date_tolerance": 3},
+        )
+        json_response = str(response.content, encoding="UTF-8")
+
+        self.assertJSONEqual(json_response, {"data": [], "errors": []})
+
+    def test_for_response_on_invalid_data(self):
+        """Checks that a JSON response is received on invalid data"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(
+            self.correct_url,
+            {"date_start": "2017-01-01", "date_end": "a", "date_tolerance": "-1"},
+        )
+        json_response = str(response.content, encoding="UTF-8")
+
+        self.assertJSONEqual(
+            json_response,
+            {
+                "data": [],
+                "errors": [
+                    {"date_end": "Must specify valid end date ('yyyy-mm-dd')."},
+                    {"date_tolerance": "Date tolerance must be a positive number of days."},
+                ]
+            }
+        )
+
+    def test_for_response_on_large_date_tolerance(self):
+        """Checks that a large date tolerance returns an error"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(
+            self.correct_url,
+            {"date_start": "2017-01-01", "date_end": "2017-12-31", "date_tolerance": 10 ** 9},
+        )
+        json_response = str(response.content, encoding="UTF-8")
+
+        self.assertJSONEqual(
+            json_response,
+            {
+                "data": [],
+                "errors": [
+                    {"date_tolerance": "Date tolerance must not exceed 366 days."},
+                ]
+            }
+        )
@@ -2,7 +2,8 @@
 from django.urls import path
 
 from .views import (
-    dashboard, retrieve_transactions, retrieve_matches, match_transactions, unmatch_transactions
+    dashboard, retrieve_transactions, retrieve_matches, retrieve_match_candidates,
+    match_transactions, unmatch_transactions,
 )
 
 app_name = "bank_reconciliation"
@@ -10,6 +11,7 @@ app_name = "bank_reconciliation"
 urlpatterns = [
     path('retrieve-transactions/', retrieve_transactions),
     path('retrieve-matches/', retrieve_matches),
+    path('retrieve-match-candidates/', retrieve_match_candidates),
     path('match-transactions/', match_transactions),
     path('unmatch-transactions/', unmatch_transactions),
     path('', dashboard, name="dashboard"),
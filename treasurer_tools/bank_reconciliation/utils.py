@@ -1,9 +1,16 @@
 """Objects and functions supporting bank_transactions app"""
 import json
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
 
 from django.core.exceptions import ValidationError
-from django.db.models import Q
+from django.db.transaction import atomic, set_rollback
+from django.db.models import Prefetch, Q
+from django.utils.dateparse import parse_date
 
+from simple_history.models import HistoricalRecords
 
 from bank_reconciliation.models import ReconciliationGroup
 from bank_transactions.models import BankTransaction
@@ -11,6 +18,65 @@ from financial_transactions.models import FinancialTransaction
 from investments.models import InvestmentDetail
 
 
+# Days a bank transaction may differ from its financial transactions
+MATCH_DATE_TOLERANCE = 7
+
+# Largest date tolerance (in days) accepted from a request
+MATCH_DATE_TOLERANCE_MAX = 366
+
+# Maximum financial entries searched for a one-to-many match
+MATCH_SUBSET_CANDIDATES = 16
+
+def get_unreconciled_bank_transactions(date_start, date_end):
+    """Returns the unreconciled bank transactions in a date range"""
+    return BankTransaction.objects.filter(
+        Q(date_transaction__gte=date_start)
+        & Q(date_transaction__lte=date_end)
+        & Q(reconciled=None)
+    ).order_by("-date_transaction")
+
+def get_unreconciled_financial_transactions(date_start, date_end):
+    """Returns the unreconciled financial transactions (with totals) in a date range"""
+    return FinancialTransaction.objects.with_totals().select_related(
+        "payee_payer"
+    ).filter(
+        Q(date_submitted__gte=date_start)
+        & Q(date_submitted__lte=date_end)
+        & Q(reconciled=None)
+    )
+
+def get_unreconciled_investment_details(date_start, date_end):
+    """Returns the unreconciled investment details in a date range"""
+    return InvestmentDetail.objects.filter(
+        Q(date_investment__gte=date_start)
+        & Q(date_investment__lte=date_end)
+        & Q(reconciled=None)
+    )
+
+def get_reconciled_group_ids(financial_date_start, financial_date_end, bank_date_start, bank_date_end):
+    """Returns the reconciliation group IDs of each transaction type
+
+        Financial transactions and investment details are searched in
+        the financial date range; bank transactions in the bank range.
+    """
+    return {
+        "financial transactions": FinancialTransaction.objects.filter(
+            Q(date_submitted__gte=financial_date_start)
+            & Q(date_submitted__lte=financial_date_end)
+            & Q(reconciled__isnull=False)
+        ).values_list("reconciled", flat=True),
+        "investment details": InvestmentDetail.objects.filter(
+            Q(date_investment__gte=financial_date_start)
+            & Q(date_investment__lte=financial_date_end)
+            & Q(reconciled__isnull=False)
+        ).values_list("reconciled", flat=True),
+        "bank transactions": BankTransaction.objects.filter(
+            Q(date_transaction__gte=bank_date_start)
+            & Q(date_transaction__lte=bank_date_end)
+            & Q(reconciled__isnull=False)
+        ).values_list("reconciled", flat=True),
+    }
+
 def return_transactions_as_json(request):
     """Returns bank, financial, and investment transactions as JSON data"""
     # The blank json_data variable to return
@@ -48,17 +114,8 @@ def return_transactions_as_json(request):
     # Retrieves all unreconciled financial transactions between the specified dates
     if transaction_type == "financial":
         try:
-            transactions = FinancialTransaction.objects.filter(
-                Q(date_submitted__gte=date_start)
-                & Q(date_submitted__lte=date_end)
-                & Q(reconciled=None)
-            )
-
-            investments = InvestmentDetail.objects.filter(
-                Q(date_investment__gte=date_start)
-                & Q(date_investment__lte=date_end)
-                & Q(reconciled=None)
-            )
+            transactions = list(get_unreconciled_financial_transactions(date_start, date_end))
+            investments = list(get_unreconciled_investment_details(date_start, date_end))
         except ValidationError:
             json_data["errors"] = {
                 "date_start": "Provided date(s) not in valid format ('yyyy-mm-dd').",
@@ -95,11 +152,7 @@ def return_transactions_as_json(request):
     # Retrieve all unreconciled bank transactions between the specified dates
     elif transaction_type == "bank":
         try:
-            transactions = BankTransaction.objects.filter(
-                Q(date_transaction__gte=date_start)
-                & Q(date_transaction__lte=date_end)
-                & Q(reconciled=None)
-            ).order_by("-date_transaction")
+            transactions = list(get_unreconciled_bank_transactions(date_start, date_end))
         except ValidationError:
             json_data["errors"] = {
                 "date_start": "Provided date(s) not in valid format ('yyyy-mm-dd').",
@@ -156,29 +209,29 @@ def return_matches_as_json(request):
 
     # Retrieve all the matches transactions that meet either date range
     try:
-        # Get all the financial transactions in the specified date range
-        financial_transactions = list(FinancialTransaction.objects.filter(
-            Q(date_submitted__gte=financial_date_start)
-            & Q(date_submitted__lte=financial_date_end)
-        ).values_list("reconciled", flat=True))
-
-        # Get all the financial transactions in the specified date range
-        investment_details = list(InvestmentDetail.objects.filter(
-            Q(date_investment__gte=financial_date_start)
-            & Q(date_investment__gte=financial_date_end)
-        ).values_list("reconciled", flat=True))
-
-        # Get all the bank transactions in the specified date range
-        bank_transactions = list(BankTransaction.objects.filter(
-            Q(date_transaction__gte=bank_date_start)
-            & Q(date_transaction__lte=bank_date_end)
-        ).values_list("reconciled", flat=True))
-
-        # Get a unique list of the IDs
-        group_id_list = set(financial_transactions + investment_details + bank_transactions)
-
-        # Get all the Match Groups containing above transactions
-        groups = ReconciliationGroup.objects.filter(id__in=group_id_list)
+        # Get a unique list of the group IDs in the specified date ranges
+        group_id_list = set()
+
+        for group_ids in get_reconciled_group_ids(
+                financial_date_start, financial_date_end, bank_date_start, bank_date_end
+        ).values():
+            group_id_list.update(group_ids)
+
+        group_id_list.discard(None)
+
+        # Get all the Match Groups containing above transactions (with
+        # all their transactions retrieved in one query per type)
+        groups = ReconciliationGroup.objects.filter(id__in=group_id_list).prefetch_related(
+            Prefetch(
+                "financialtransactions",
+                queryset=FinancialTransaction.objects.with_totals().select_related("payee_payer"),
+            ),
+            Prefetch(
+                "investmentdetails",
+                queryset=InvestmentDetail.objects.select_related("investment"),
+            ),
+            "banktransactions",
+        )
 
     except ValidationError:
         json_data["errors"].append({"dates": "Provided date(s) not in valid format ('yyyy-mm-dd')."})
@@ -235,6 +288,315 @@ def return_matches_as_json(request):
 
     return json_data
 
+def get_reconciliation_querysets(date_start, date_end):
+    """Returns the frequently run reconciliation queries for a date range
+
+        Uses the same querysets as the views, so the query plans of
+        the reconciliation indexes can be reviewed.
+    """
+    querysets = {
+        "unreconciled bank transactions": get_unreconciled_bank_transactions(date_start, date_end),
+        "unreconciled financial transactions": get_unreconciled_financial_transactions(
+            date_start, date_end
+        ),
+        "unreconciled investment details": get_unreconciled_investment_details(
+            date_start, date_end
+        ),
+    }
+
+    for name, queryset in get_reconciled_group_ids(
+            date_start, date_end, date_start, date_end
+    ).items():
+        querysets["reconciled {}".format(name)] = queryset
+
+    return querysets
+
+def get_history_user():
+    """Returns the user of the current request for bulk history records"""
+    request = getattr(HistoricalRecords.context, "request", None)
+    user = getattr(request, "user", None)
+
+    return user if user is not None and user.is_authenticated else None
+
+def to_cents(amount):
+    """Converts a dollar amount into integer cents"""
+    return int((Decimal(amount) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+def get_bank_match_entries(date_start, date_end):
+    """Retrieves the unreconciled bank transactions as matching entries
+
+        Amounts are signed cents, where deposits are positive.
+    """
+    bank_transactions = get_unreconciled_bank_transactions(date_start, date_end).values_list(
+        "id", "date_transaction", "amount_debit", "amount_credit"
+    )
+
+    return [
+        {"id": values[0], "date": values[1], "cents": to_cents(values[3]) - to_cents(values[2])}
+        for values in bank_transactions
+    ]
+
+def get_financial_match_entries(date_start, date_end):
+    """Retrieves unreconciled financial transactions and investment details
+
+        Amounts are signed cents, where money deposited into the bank
+        (revenue and investment returns) is positive.
+    """
+    entries = []
+
+    financial_transactions = get_unreconciled_financial_transactions(
+        date_start, date_end
+    ).values_list("id", "date_submitted", "transaction_type", "annotated_total")
+
+    for transaction_id, date, transaction_type, total in financial_transactions:
+        cents = to_cents(total)
+
+        entries.append({
+            "key": "financial_ids",
+            "id": transaction_id,
+            "date": date,
+            "cents": cents if transaction_type == "r" else -cents,
+        })
+
+    investment_details = get_unreconciled_investment_details(date_start, date_end).values_list(
+        "id", "date_investment", "detail_status", "amount"
+    )
+
+    for detail_id, date, detail_status, amount in investment_details:
+        cents = to_cents(amount)
+
+        entries.append({
+            "key": "investment_ids",
+            "id": detail_id,
+            "date": date,
+            "cents": -cents if detail_status == "v" else cents,
+        })
+
+    # Sort by date to allow date window searches
+    entries.sort(key=lambda entry: (entry["date"], entry["key"], entry["id"]))
+
+    return entries
+
+def get_subset_sums(entries):
+    """Returns a dictionary of each possible subset total to its indices"""
+    sums = {0: ()}
+
+    for index, entry in enumerate(entries):
+        for total, subset in list(sums.items()):
+            sums.setdefault(total + entry["cents"], subset + (index,))
+
+    return sums
+
+def find_subset_match(target, candidates):
+    """Finds two or more candidates that total the target amount
+
+        Uses a meet-in-the-middle search: the subset totals of each half
+        of the candidates are stored in hash maps keyed by cents, so each
+        half only needs to be enumerated once.
+    """
+    half = len(candidates) // 2
+    first_sums = get_subset_sums(candidates[:half])
+    second_sums = get_subset_sums(candidates[half:])
+
+    for total, second_subset in second_sums.items():
+        first_subset = first_sums.get(target - total)
+
+        if first_subset is not None and len(first_subset) + len(second_subset) >= 2:
+            return (
+                [candidates[index] for index in first_subset]
+                + [candidates[half + index] for index in second_subset]
+            )
+
+    return None
+
+def create_match_proposal(match_type, bank_entry, entries):
+    """Creates a proposed group in the format used to match transactions"""
+    proposal = {
+        "match_type": match_type,
+        "total": Decimal(bank_entry["cents"]) / 100,
+        "financial_ids": [],
+        "investment_ids": [],
+        "bank_ids": [bank_entry["id"]],
+    }
+
+    for entry in entries:
+        proposal[entry["key"]].append(entry["id"])
+
+    return proposal
+
+def find_match_candidates(date_start, date_end, date_tolerance=MATCH_DATE_TOLERANCE):
+    """Proposes reconciliation groups for unreconciled bank transactions
+
+        Each bank transaction between the dates is first matched to a
+        single financial transaction or investment detail with the same
+        amount within the date tolerance (closest date first). Remaining
+        bank transactions are then matched to a subset of entries that
+        add up to the bank amount (e.g. one deposit for many cheques).
+    """
+    tolerance = timedelta(days=date_tolerance)
+
+    bank_entries = get_bank_match_entries(date_start, date_end)
+    entries = get_financial_match_entries(date_start - tolerance, date_end + tolerance)
+    entry_dates = [entry["date"] for entry in entries]
+
+    # Index the entries by their amount in cents
+    entries_by_cents = defaultdict(list)
+
+    for entry in entries:
+        entries_by_cents[entry["cents"]].append(entry)
+
+    used = set()
+    proposals = []
+    unmatched_bank_entries = []
+
+    # Find exact amount matches
+    for bank_entry in sorted(bank_entries, key=lambda entry: (entry["date"], entry["id"])):
+        if bank_entry["cents"] == 0:
+            continue
+
+        candidates = [
+            entry for entry in entries_by_cents.get(bank_entry["cents"], [])
+            if (entry["key"], entry["id"]) not in used
+            and abs(entry["date"] - bank_entry["date"]) <= tolerance
+        ]
+
+        if candidates:
+            match = min(candidates, key=lambda entry: abs(entry["date"] - bank_entry["date"]))
+            used.add((match["key"], match["id"]))
+            proposals.append(create_match_proposal("exact", bank_entry, [match]))
+        else:
+            unmatched_bank_entries.append(bank_entry)
+
+    # Find subset matches for the remaining bank transactions
+    for bank_entry in unmatched_bank_entries:
+        target = bank_entry["cents"]
+        start = bisect_left(entry_dates, bank_entry["date"] - tolerance)
+        end = bisect_right(entry_dates, bank_entry["date"] + tolerance)
+
+        candidates = [
+            entry for entry in entries[start:end]
+            if (entry["key"], entry["id"]) not in used
+            and entry["cents"] * target > 0
+            and abs(entry["cents"]) <= abs(target)
+        ]
+
+        # Limit the search to the closest dated candidates
+        candidates.sort(key=lambda entry: abs(entry["date"] - bank_entry["date"]))
+        match = find_subset_match(target, candidates[:MATCH_SUBSET_CANDIDATES])
+
+        if match:
+            used.update((entry["key"], entry["id"]) for entry in match)
+            proposals.append(create_match_proposal("subset", bank_entry, match))
+
+    return proposals
+
+def return_match_candidates_as_json(request):
+    """Returns proposed reconciliation groups as JSON data"""
+    # The blank json_data variable to return
+    json_data = {
+        "data": [],
+        "errors": [],
+    }
+
+    # Collect the variables from the GET request
+    try:
+        date_start = parse_date(request.GET.get("date_start", ""))
+        date_end = parse_date(request.GET.get("date_end", ""))
+    except ValueError:
+        date_start = None
+        date_end = None
+
+    try:
+        date_tolerance = int(request.GET.get("date_tolerance", MATCH_DATE_TOLERANCE))
+    except ValueError:
+        date_tolerance = -1
+
+    # Checks that valid dates and tolerance were provided
+    if not date_start:
+        json_data["errors"].append({"date_start": "Must specify valid start date ('yyyy-mm-dd')."})
+
+    if not date_end:
+        json_data["errors"].append({"date_end": "Must specify valid end date ('yyyy-mm-dd')."})
+
+    if date_tolerance < 0:
+        json_data["errors"].append({"date_tolerance": "Date tolerance must be a positive number of days."})
+    elif date_tolerance > MATCH_DATE_TOLERANCE_MAX:
+        json_data["errors"].append({
+            "date_tolerance": "Date tolerance must not exceed {} days.".format(MATCH_DATE_TOLERANCE_MAX)
+        })
+
+    if json_data["errors"]:
+        return json_data
+
+    json_data["data"] = find_match_candidates(date_start, date_end, date_tolerance)
+
+    return json_data
+
+def unmatch_reconciliation_groups(group_ids):
+    """Deletes the provided reconciliation groups in bulk
+
+        All groups are validated with one query. The transactions of
+        each type are then unreconciled with one UPDATE and the groups
+        are deleted. The transaction history is recorded in bulk and
+        the group history by the regular delete signals.
+
+        Returns a list of errors for any invalid IDs.
+    """
+    errors = []
+    valid_ids = set()
+
+    # Convert the IDs to integers (where possible)
+    parsed_ids = []
+
+    for group_id in group_ids:
+        try:
+            parsed_ids.append(int(group_id))
+        except (TypeError, ValueError):
+            parsed_ids.append(None)
+
+    history_user = get_history_user()
+
+    with atomic():
+        groups = ReconciliationGroup.objects.select_for_update().in_bulk(
+            [group_id for group_id in parsed_ids if group_id is not None]
+        )
+
+        # Report errors in the order the IDs were submitted
+        for group_id, parsed_id in zip(group_ids, parsed_ids):
+            if parsed_id is None:
+                errors.append({"ids": "Provided ID ({}) is on wrong format".format(group_id)})
+            elif parsed_id not in groups or parsed_id in valid_ids:
+                errors.append({"ids": "Provided ID ({}) does not exist".format(group_id)})
+            else:
+                valid_ids.add(parsed_id)
+
+        if not valid_ids:
+            return errors
+
+        # Remove the groups from the transactions (one query per type)
+        for model in [FinancialTransaction, InvestmentDetail, BankTransaction]:
+            unmatched_ids = list(
+                model.objects.filter(reconciled__in=valid_ids).values_list("id", flat=True)
+            )
+
+            if not unmatched_ids:
+                continue
+
+            model.objects.filter(id__in=unmatched_ids).update(reconciled=None)
+
+            # Record the change in the model history (if tracked)
+            if hasattr(model, "history"):
+                model.history.bulk_history_create(
+                    model.objects.filter(id__in=unmatched_ids),
+                    update=True,
+                    default_user=history_user,
+                )
+
+        # Delete the groups (the transactions are already unreconciled)
+        ReconciliationGroup.objects.filter(id__in=valid_ids).delete()
+
+    return errors
+
 class BankReconciliation(object):
     """Object to process bank transaction reconciliation"""
 
@@ -249,107 +611,80 @@ class BankReconciliation(object):
 
         return json_data
 
-    def __is_valid_financial_ids(self, financial_ids):
-        """Checks that provided financial_ids are valid"""
+    def __is_valid_ids(self, queryset, submitted_ids, error_key, id_description):
+        """Checks that provided IDs exist and are unreconciled
+
+            All IDs are retrieved in a single query. The retrieved rows
+            are locked until the surrounding transaction finishes so that
+            another user cannot reconcile them before this match is saved.
+        """
         valid = True
 
-        for financial_id in financial_ids:
-            # Checks that financial ID exists
+        # Convert the submitted IDs to integers (None if invalid format)
+        parsed_ids = []
+
+        for submitted_id in submitted_ids:
             try:
-                financial_transaction = FinancialTransaction.objects.get(id=financial_id)
-            except FinancialTransaction.DoesNotExist:
-                financial_transaction = False
-            except ValueError:
-                financial_transaction = False
+                parsed_ids.append((submitted_id, int(submitted_id)))
+            except (TypeError, ValueError):
+                parsed_ids.append((submitted_id, None))
+
+        # Retrieve and lock all the matching entries
+        with atomic():
+            instances = queryset.select_for_update(of=("self",)).in_bulk(
+                [parsed_id for _, parsed_id in parsed_ids if parsed_id is not None]
+            )
 
-            if financial_transaction:
+        for submitted_id, parsed_id in parsed_ids:
+            instance = instances.get(parsed_id)
+
+            if instance:
                 # Checks if this entry has already been reconciled
-                if financial_transaction.reconciled:
+                if instance.reconciled_id:
                     valid = False
-                    self.errors["financial_id"].append(
+                    self.errors[error_key].append(
                         (
                             "{} is already reconciled. "
                             "Unmatch the transaction before reassigning it."
-                        ).format(str(financial_transaction))
+                        ).format(str(instance))
                     )
             else:
                 valid = False
-                self.errors["financial_id"].append(
+                self.errors[error_key].append(
                     (
-                        "{} is not a valid financial transaction ID. "
+                        "{} is not a valid {} ID. "
                         "Please make a valid selection."
-                    ).format(financial_id)
+                    ).format(submitted_id, id_description)
                 )
 
         return valid
 
-    def __is_valid_investment_ids(self, investment_ids):
+    def __is_valid_financial_ids(self, financial_ids):
         """Checks that provided financial_ids are valid"""
-        valid = True
-
-        for detail_id in investment_ids:
-            # Checks that investment ID exists
-            try:
-                detail = InvestmentDetail.objects.get(id=detail_id)
-            except FinancialTransaction.DoesNotExist:
-                detail = False
-            except ValueError:
-                detail = False
+        return self.__is_valid_ids(
+            FinancialTransaction.objects.select_related("payee_payer"),
+            financial_ids,
+            "financial_id",
+            "financial transaction",
+        )
 
-            if detail:
-                # Checks if this entry has already been reconciled
-                if detail.reconciled:
-                    valid = False
-                    self.errors["investment_id"].append(
-                        (
-                            "{} is already reconciled. "
-                            "Unmatch the transaction before reassigning it."
-                        ).format(str(detail))
-                    )
-            else:
-                valid = False
-                self.errors["detail_id"].append(
-                    (
-                        "{} is not a valid financial transaction ID. "
-                        "Please make a valid selection."
-                    ).format(detail_id)
-                )
-
-        return valid
+    def __is_valid_investment_ids(self, investment_ids):
+        """Checks that provided investment_ids are valid"""
+        return self.__is_valid_ids(
+            InvestmentDetail.objects.select_related("investment"),
+            investment_ids,
+            "investment_id",
+            "investment",
+        )
 
     def __is_valid_bank_ids(self, bank_ids):
         """Checks that provided bank_ids are valid"""
-        valid = True
-
-        for bank_id in bank_ids:
-            # Checks that financial ID exists
-            try:
-                bank_transaction = BankTransaction.objects.get(id=bank_id)
-            except BankTransaction.DoesNotExist:
-                bank_transaction = False
-            except ValueError:
-                bank_transaction = False
-
-            # Check that the bank ID exists
-            if bank_transaction:
-                if bank_transaction.reconciled:
-                    valid = False
-                    self.errors["bank_id"].append(
-                        (
-                            "{} is already reconciled. "
-                            "Unmatch the transaction before reassigning it."
-                        ).format(str(bank_transaction))
-                    )
-            else:
-                valid = False
-                self.errors["bank_id"].append(
-                    (
-                        "{} is not a valid bank transaction ID. "
-                        "Please make a valid selection."
-                    ).format(bank_id)
-                )
-
-        return valid
+        return self.__is_valid_ids(
+            BankTransaction.objects.all(),
+            bank_ids,
+            "bank_id",
+            "bank transaction",
+        )
 
     def is_valid(self):
         """Checks that provided transaction & banking data is valid"""
@@ -360,7 +695,7 @@ class BankReconciliation(object):
             financial_ids = self.json_data["financial_ids"]
             investment_ids = self.json_data["investment_ids"]
 
-            if len(financial_ids) is 0 and len(investment_ids) is 0:
+            if len(financial_ids) == 0 and len(investment_ids) == 0:
                 valid = False
                 self.errors["financial_id"].append("Please select at least one financial transaction.")
         except KeyError:
@@ -374,7 +709,7 @@ class BankReconciliation(object):
         try:
             bank_ids = self.json_data["bank_ids"]
 
-            if len(bank_ids) is 0:
+            if len(bank_ids) == 0:
                 valid = False
                 self.errors["bank_id"].append("Please select at least one bank transaction.")
 
@@ -409,26 +744,45 @@ class BankReconciliation(object):
 
     def create_matches(self):
         """Matches provided financial and bank transactions"""
-        # Create a reconcilation group
-        group = ReconciliationGroup.objects.create()
-
-        # Add the new group to each financial transaction
-        for financial_id in self.json_data["financial_ids"]:
-            financial_transaction = FinancialTransaction.objects.get(id=financial_id)
-            financial_transaction.reconciled = group
-            financial_transaction.save()
-
-        # Add the new group to each investment detail
-        for detail_id in self.json_data["investment_ids"]:
-            detail = InvestmentDetail.objects.get(id=detail_id)
-            detail.reconciled = group
-            detail.save()
-
-        # Add the new group to each bank transaction
-        for bank_id in self.json_data["bank_ids"]:
-            bank_transaction = BankTransaction.objects.get(id=bank_id)
-            bank_transaction.reconciled = group
-            bank_transaction.save()
+        match_details = [
+            ("financial_id", FinancialTransaction, self.json_data["financial_ids"]),
+            ("investment_id", InvestmentDetail, self.json_data["investment_ids"]),
+            ("bank_id", BankTransaction, self.json_data["bank_ids"]),
+        ]
+
+        with atomic():
+            # Create a reconcilation group
+            group = ReconciliationGroup.objects.create()
+
+            for error_key, model, ids in match_details:
+                unique_ids = {int(model_id) for model_id in ids}
+
+                if not unique_ids:
+                    continue
+
+                # Add the new group to all the entries in a single query
+                # (only unreconciled entries are updated)
+                matched = model.objects.filter(
+                    id__in=unique_ids, reconciled=None
+                ).update(reconciled=group)
+
+                # Another request reconciled one of these entries
+                if matched != len(unique_ids):
+                    set_rollback(True)
+                    self.errors[error_key].append(
+                        "One or more selected transactions have already been "
+                        "reconciled. Refresh the page and try again."
+                    )
+
+                    return
+
+                # Record the change in the model history (if tracked)
+                if hasattr(model, "history"):
+                    model.history.bulk_history_create(
+                        model.objects.filter(reconciled=group),
+                        update=True,
+                        default_user=get_history_user(),
+                    )
 
         # Return the ids that were successfully matched
         self.success["financial_id"] = self.json_data["financial_ids"]
@@ -436,6 +790,6 @@ class BankReconciliation(object):
         self.success["bank_id"] = self.json_data["bank_ids"]
 
     def __init__(self, raw_data):
-        self.success = {"financial_id": [], "bank_id": [],}
-        self.errors = {"post_data": [], "financial_id": [], "bank_id": [],}
+        self.success = {"financial_id": [], "investment_id": [], "bank_id": [],}
+        self.errors = {"post_data": [], "financial_id": [], "investment_id": [], "bank_id": [],}
         self.json_data = self.create_json_data(raw_data)
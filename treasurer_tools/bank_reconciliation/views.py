@@ -5,8 +5,10 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.shortcuts import render
 
-from .models import ReconciliationGroup
-from .utils import return_transactions_as_json, return_matches_as_json, BankReconciliation
+from .utils import (
+    return_transactions_as_json, return_matches_as_json, return_match_candidates_as_json,
+    unmatch_reconciliation_groups, BankReconciliation,
+)
 
 
 @login_required
@@ -48,6 +50,13 @@ def retrieve_matches(request):
 
     return JsonResponse(json_data)
 
+@login_required
+def retrieve_match_candidates(request):
+    """Retrieves and returns proposed reconciliation groups"""
+    json_data = return_match_candidates_as_json(request)
+
+    return JsonResponse(json_data)
+
 @login_required
 def unmatch_transactions(request):
     """Unmatches financial and banking transactions (if valid)"""
@@ -62,15 +71,8 @@ def unmatch_transactions(request):
         errors.append({"post_data": "Invalid data submitted to server: {}".format(e)})
         ids = []
 
-    # Get each provided ID and delete the repesctive group
-    for group_id in ids:
-        try:
-            group = ReconciliationGroup.objects.get(id=group_id)
-            group.delete()
-        except ReconciliationGroup.DoesNotExist:
-            errors.append({"ids": "Provided ID ({}) does not exist".format(group_id)})
-        except ValueError:
-            errors.append({"ids": "Provided ID ({}) is on wrong format".format(group_id)})
+    # Delete the provided groups and collect any invalid IDs
+    errors.extend(unmatch_reconciliation_groups(ids))
 
     return JsonResponse({
         "errors": errors,
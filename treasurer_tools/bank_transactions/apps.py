@@ -6,3 +6,8 @@ class BankTransactionsConfig(AppConfig):
     """Configuration for BankTransactions app"""
 
     name = 'bank_transactions'
+
+    def ready(self):
+        """Registers the daily balance signals"""
+        # pylint: disable=import-outside-toplevel, unused-import
+        from bank_transactions import signals
@@ -40,6 +40,25 @@ class StatementForm(forms.ModelForm):
 
         return form_data
 
+class StatementImportForm(StatementForm):
+    """Form to add a statement from a CSV or OFX/QFX file"""
+    statement_file = forms.FileField(
+        help_text=(
+            "A CSV file (with date, description, and debit/credit or amount "
+            "columns) or an OFX/QFX file downloaded from the bank"
+        ),
+        label="statement file",
+    )
+
+    def clean_statement_file(self):
+        """Confirms the file is a supported format"""
+        statement_file = self.cleaned_data["statement_file"]
+
+        if not statement_file.name.lower().endswith((".csv", ".ofx", ".qfx")):
+            raise ValidationError("Please upload a CSV, OFX, or QFX file.")
+
+        return statement_file
+
 class BankTransactionForm(forms.ModelForm):
     """Form for adding and editing bank transactions"""
     class Meta:
@@ -0,0 +1,19 @@
+"""Command to rebuild the daily account balances"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bank_transactions.models import DailyBalance
+from bank_transactions.utils import rebuild_daily_balances
+
+
+class Command(BaseCommand):
+    """Rebuilds all the DailyBalance entries from the bank transactions"""
+    help = "Rebuilds the daily account balance ledger from the bank transactions"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_daily_balances()
+
+        self.stdout.write(
+            "Rebuilt {} daily balances.".format(DailyBalance.objects.count())
+        )
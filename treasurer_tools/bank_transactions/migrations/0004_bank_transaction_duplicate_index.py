@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_reconciliation', '0002_alter_historicalreconciliationgroup_options_and_more'),
+        ('bank_transactions', '0003_alter_historicalbanktransaction_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(fields=['date_transaction', 'amount_debit', 'amount_credit', 'description_bank'], name='bank_transaction_duplicate'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_reconciliation', '0002_alter_historicalreconciliationgroup_options_and_more'),
+        ('bank_transactions', '0004_bank_transaction_duplicate_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(condition=models.Q(('reconciled__isnull', True)), fields=['date_transaction'], name='bank_transaction_unreconciled'),
+        ),
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(fields=['reconciled', 'date_transaction'], name='bank_transaction_reconciled'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+"""Migrations to add the daily account balance ledger."""
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_daily_balances(apps, schema_editor):
+    """Calculates the daily balances for all existing bank transactions."""
+    # pylint: disable=unused-argument
+    BankTransaction = apps.get_model('bank_transactions', 'BankTransaction')
+    DailyBalance = apps.get_model('bank_transactions', 'DailyBalance')
+
+    daily_changes = BankTransaction.objects.values(
+        'statement__account_id', 'date_transaction'
+    ).annotate(
+        debit=Sum('amount_debit'),
+        credit=Sum('amount_credit'),
+    ).order_by('statement__account_id', 'date_transaction')
+
+    new_balances = []
+    running_balances = {}
+
+    for daily_change in daily_changes:
+        change = daily_change['credit'] - daily_change['debit']
+
+        if not change:
+            continue
+
+        account_id = daily_change['statement__account_id']
+        balance = running_balances.get(account_id, Decimal('0')) + change
+        running_balances[account_id] = balance
+
+        new_balances.append(DailyBalance(
+            account_id=account_id,
+            date=daily_change['date_transaction'],
+            change=change,
+            balance=balance,
+        ))
+
+    DailyBalance.objects.bulk_create(new_balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    """Migrations for the DailyBalance model."""
+
+    dependencies = [
+        ('bank_institutions', '0003_alter_historicalaccount_options_and_more'),
+        ('bank_transactions', '0005_reconciliation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='The date of the transactions')),
+                ('change', models.DecimalField(decimal_places=2, default=0, help_text='The total credits less debits on this date', max_digits=15)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, help_text='The account balance at the end of this date', max_digits=15)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='bank_institutions.account')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='unique_account_date')],
+            },
+        ),
+        migrations.RunPython(populate_daily_balances, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,8 @@
 from decimal import Decimal
 
 from django.db import models
-from django.db.models import Sum
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce
 
 from simple_history.models import HistoricalRecords
 
@@ -11,6 +12,39 @@ from bank_institutions.models import Account
 from bank_reconciliation.models import ReconciliationGroup
 
 
+class StatementQuerySet(models.QuerySet):
+    """Custom queryset methods for the Statement model"""
+    def with_totals(self):
+        """Annotates the transaction totals and count onto each statement
+
+            The annotations are used by the total_debit, total_credit,
+            total, and transaction_count properties in place of querying
+            the transactions.
+        """
+        output_field = models.DecimalField(max_digits=12, decimal_places=2)
+
+        return self.annotate(
+            annotated_total_debit=Coalesce(
+                Sum("banktransaction__amount_debit", output_field=output_field),
+                Value(0),
+                output_field=output_field,
+            ),
+            annotated_total_credit=Coalesce(
+                Sum("banktransaction__amount_credit", output_field=output_field),
+                Value(0),
+                output_field=output_field,
+            ),
+            annotated_total=Coalesce(
+                Sum(
+                    F("banktransaction__amount_credit") - F("banktransaction__amount_debit"),
+                    output_field=output_field,
+                ),
+                Value(0),
+                output_field=output_field,
+            ),
+            annotated_transaction_count=Count("banktransaction"),
+        )
+
 class Statement(models.Model):
     """Details on a single bank account statement"""
     account = models.ForeignKey(
@@ -28,12 +62,17 @@ class Statement(models.Model):
     )
     history = HistoricalRecords()
 
+    objects = StatementQuerySet.as_manager()
+
     def __str__(self):
         return "{} to {} statement".format(self.date_start, self.date_end)
 
     @property
     def total_debit(self):
         """Calculates a statements debit total"""
+        if hasattr(self, "annotated_total_debit"):
+            return Decimal(self.annotated_total_debit)
+
         debit_total = self.banktransaction_set.all().aggregate(total=Sum("amount_debit"))
 
         return Decimal(debit_total["total"])
@@ -41,6 +80,9 @@ class Statement(models.Model):
     @property
     def total_credit(self):
         """Calculates a statements credit total"""
+        if hasattr(self, "annotated_total_credit"):
+            return Decimal(self.annotated_total_credit)
+
         credit_total = self.banktransaction_set.all().aggregate(total=Sum("amount_credit"))
 
         return Decimal(credit_total["total"])
@@ -48,6 +90,9 @@ class Statement(models.Model):
     @property
     def total(self):
         """Calculates a statements total"""
+        if hasattr(self, "annotated_total"):
+            return Decimal(self.annotated_total)
+
         total = self.banktransaction_set.all().aggregate(
             debit_total=Sum("amount_debit"),
             credit_total=Sum("amount_credit")
@@ -55,6 +100,14 @@ class Statement(models.Model):
 
         return Decimal(total["credit_total"] - total["debit_total"])
 
+    @property
+    def transaction_count(self):
+        """Counts the transactions on a statement"""
+        if hasattr(self, "annotated_transaction_count"):
+            return self.annotated_transaction_count
+
+        return self.banktransaction_set.count()
+
 class BankTransaction(models.Model):
     """Details on a single bank transactions"""
     statement = models.ForeignKey(
@@ -102,6 +155,25 @@ class BankTransaction(models.Model):
     )
     history = HistoricalRecords()
 
+    class Meta:
+        indexes = [
+            # Supports duplicate detection when importing statements
+            models.Index(
+                fields=["date_transaction", "amount_debit", "amount_credit", "description_bank"],
+                name="bank_transaction_duplicate",
+            ),
+            # Supports the reconciliation queries for unreconciled transactions
+            models.Index(
+                fields=["date_transaction"],
+                condition=models.Q(reconciled__isnull=True),
+                name="bank_transaction_unreconciled",
+            ),
+            models.Index(
+                fields=["reconciled", "date_transaction"],
+                name="bank_transaction_reconciled",
+            ),
+        ]
+
     def __str__(self):
         if self.description_user:
             return_str = "{} - {}".format(
@@ -113,3 +185,37 @@ class BankTransaction(models.Model):
             )
 
         return return_str
+
+class DailyBalance(models.Model):
+    """The closing balance of an account on a day with transactions"""
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name="daily_balances",
+    )
+    date = models.DateField(
+        help_text="The date of the transactions",
+    )
+    change = models.DecimalField(
+        decimal_places=2,
+        default=0,
+        help_text="The total credits less debits on this date",
+        max_digits=15,
+    )
+    balance = models.DecimalField(
+        decimal_places=2,
+        default=0,
+        help_text="The account balance at the end of this date",
+        max_digits=15,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "date"],
+                name="unique_account_date",
+            ),
+        ]
+
+    def __str__(self):
+        return "{} - {} - ${}".format(self.account, self.date, self.balance)
@@ -0,0 +1,127 @@
+"""Signals to maintain the daily account balances"""
+import threading
+from contextlib import contextmanager
+
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Statement, BankTransaction
+from .utils import apply_balance_change, get_transaction_change, rebuild_daily_balances
+
+
+# Whether bank transaction deletes in this thread skip the ledger
+BALANCE_UPDATES = threading.local()
+
+
+@contextmanager
+def suspend_balance_updates():
+    """Context manager that stops bank transaction deletes updating the ledger
+
+        Used by callers that apply the deleted amounts to the ledger
+        themselves (e.g. save_bank_transaction_formset).
+    """
+    previous = getattr(BALANCE_UPDATES, "suspended", False)
+    BALANCE_UPDATES.suspended = True
+
+    try:
+        yield
+    finally:
+        BALANCE_UPDATES.suspended = previous
+
+def get_statement_account_id(statement_id):
+    """Returns the account ID of a statement"""
+    return Statement.objects.filter(id=statement_id).values_list("account_id", flat=True).first()
+
+def is_ledger_updated_elsewhere(origin):
+    """Whether the ledger of a bank transaction delete is updated elsewhere
+
+        Transactions deleted with their statement (or account) are
+        rebuilt once after the statement is deleted. Deletes within
+        suspend_balance_updates are applied by the caller.
+    """
+    if getattr(BALANCE_UPDATES, "suspended", False):
+        return True
+
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+
+    return origin is not None and origin_model is not BankTransaction
+
+@receiver(pre_save, sender=BankTransaction)
+def store_original_bank_transaction(sender, instance, raw, **kwargs):
+    """Records the original ledger entry of an edited bank transaction"""
+    # pylint: disable=unused-argument
+    instance.original_balance_entry = None
+
+    if instance.pk and not raw:
+        original = BankTransaction.objects.filter(id=instance.pk).values(
+            "statement__account_id", "date_transaction", "amount_debit", "amount_credit"
+        ).first()
+
+        if original:
+            instance.original_balance_entry = (
+                original["statement__account_id"],
+                original["date_transaction"],
+                get_transaction_change(original["amount_debit"], original["amount_credit"]),
+            )
+
+@receiver(post_save, sender=BankTransaction)
+def update_bank_transaction_balances(sender, instance, raw, **kwargs):
+    """Applies a saved bank transaction to the account ledger"""
+    # pylint: disable=unused-argument
+    if raw:
+        return
+
+    # Dates may be strings when the instance was created directly
+    date_transaction = BankTransaction._meta.get_field("date_transaction").to_python(
+        instance.date_transaction
+    )
+    account_id = get_statement_account_id(instance.statement_id)
+    change = get_transaction_change(instance.amount_debit, instance.amount_credit)
+
+    original = getattr(instance, "original_balance_entry", None)
+
+    if original and original[:2] == (account_id, date_transaction):
+        apply_balance_change(account_id, date_transaction, change - original[2])
+    else:
+        if original:
+            apply_balance_change(original[0], original[1], -original[2])
+
+        apply_balance_change(account_id, date_transaction, change)
+
+@receiver(post_delete, sender=BankTransaction)
+def remove_bank_transaction_balances(sender, instance, origin=None, **kwargs):
+    """Removes a deleted bank transaction from the account ledger"""
+    # pylint: disable=unused-argument
+    if is_ledger_updated_elsewhere(origin):
+        return
+
+    apply_balance_change(
+        get_statement_account_id(instance.statement_id),
+        BankTransaction._meta.get_field("date_transaction").to_python(instance.date_transaction),
+        -get_transaction_change(instance.amount_debit, instance.amount_credit),
+    )
+
+@receiver(pre_save, sender=Statement)
+def store_original_statement_account(sender, instance, raw, **kwargs):
+    """Records the original account of an edited statement"""
+    # pylint: disable=unused-argument
+    instance.original_account_id = None
+
+    if instance.pk and not raw:
+        instance.original_account_id = get_statement_account_id(instance.pk)
+
+@receiver(post_save, sender=Statement)
+def update_statement_balances(sender, instance, raw, **kwargs):
+    """Moves the ledger entries of a statement moved to another account"""
+    # pylint: disable=unused-argument
+    original_account_id = getattr(instance, "original_account_id", None)
+
+    if not raw and original_account_id and original_account_id != instance.account_id:
+        rebuild_daily_balances([original_account_id, instance.account_id])
+
+@receiver(post_delete, sender=Statement)
+def finish_statement_delete(sender, instance, **kwargs):
+    """Rebuilds the ledger of a deleted statement's account once"""
+    # pylint: disable=unused-argument
+    rebuild_daily_balances([instance.account_id])
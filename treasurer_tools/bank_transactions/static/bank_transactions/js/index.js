@@ -0,0 +1,41 @@
+// Accounts with a page of statements currently loading
+const loadingAccounts = {};
+
+function loadMoreStatements() {
+  // Only load once the end of a list is close to being visible
+  const windowBottom = $(window).scrollTop() + $(window).height();
+
+  $('.statements .load-more').each((index, loadMore) => {
+    const $loadMore = $(loadMore);
+    const url = $loadMore.attr('data-url');
+
+    // Skip if a page is already loading for this account
+    if (loadingAccounts[url] || $loadMore.offset().top > windowBottom + 500) {
+      return;
+    }
+
+    loadingAccounts[url] = true;
+
+    const parameters = '?'
+      + `last_date=${encodeURIComponent($loadMore.attr('data-last-date'))}`
+      + `&last_id=${encodeURIComponent($loadMore.attr('data-last-id'))}`;
+
+    $.get(url + parameters).done((html) => {
+      loadingAccounts[url] = false;
+      $loadMore.replaceWith(html);
+
+      // Continue loading if the list still ends within view
+      loadMoreStatements();
+    }).fail(() => {
+      loadingAccounts[url] = false;
+    });
+  });
+}
+
+$(document).ready(() => {
+  loadMoreStatements();
+
+  $(window).on('scroll', () => {
+    loadMoreStatements();
+  });
+});
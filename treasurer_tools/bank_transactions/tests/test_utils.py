@@ -0,0 +1,495 @@
+"""Test cases for the bank_transactions app utility functions"""
+
+import io
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from bank_transactions.forms import StatementForm, BankTransactionFormSet
+from bank_institutions.models import Account
+from bank_transactions.models import Statement, BankTransaction, DailyBalance
+from bank_transactions.utils import (
+    import_statement, parse_csv, parse_ofx, apply_balance_change, get_account_balance,
+    rebuild_daily_balances, save_bank_transaction_formset,
+)
+
+from .utils import create_bank_account, create_bank_transactions
+
+
+OFX_FILE = """OFXHEADER:100
+DATA:OFXSGML
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20170105120000[-7:MST]
+<TRNAMT>-45.50
+<NAME>COFFEE SHOP
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20170110
+<TRNAMT>1,000.00
+<MEMO>PAYROLL DEPOSIT
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+class ParseStatementTest(TestCase):
+    """Tests for the CSV and OFX statement parsers"""
+
+    def test_parse_csv_debit_credit_columns(self):
+        """Tests parsing a CSV with separate debit and credit columns"""
+        csv_file = io.StringIO(
+            "Date,Description,Debit,Credit\n"
+            "2017-01-05,CHQ#0001,\"$1,200.00\",\n"
+            "\n"
+            "2017-01-06,DEPOSIT,,50.25\n"
+        )
+
+        self.assertEqual(
+            list(parse_csv(csv_file)),
+            [
+                {
+                    "date_transaction": "2017-01-05",
+                    "description_bank": "CHQ#0001",
+                    "amount_debit": Decimal("1200.00"),
+                    "amount_credit": 0,
+                },
+                {
+                    "date_transaction": "2017-01-06",
+                    "description_bank": "DEPOSIT",
+                    "amount_debit": 0,
+                    "amount_credit": Decimal("50.25"),
+                },
+            ]
+        )
+
+    def test_parse_csv_amount_column(self):
+        """Tests parsing a CSV with a single signed amount column"""
+        csv_file = io.StringIO(
+            "Date,Description,Amount\n"
+            "2017-01-05,FEE,(2.50)\n"
+            "2017-01-06,INTEREST,0.10\n"
+        )
+
+        rows = list(parse_csv(csv_file))
+
+        self.assertEqual(rows[0]["amount_debit"], Decimal("2.50"))
+        self.assertEqual(rows[0]["amount_credit"], Decimal("0"))
+        self.assertEqual(rows[1]["amount_debit"], Decimal("0"))
+        self.assertEqual(rows[1]["amount_credit"], Decimal("0.10"))
+
+    def test_parse_ofx(self):
+        """Tests parsing the transactions of an OFX file"""
+        self.assertEqual(
+            list(parse_ofx(io.StringIO(OFX_FILE))),
+            [
+                {
+                    "date_transaction": "2017-01-05",
+                    "description_bank": "COFFEE SHOP",
+                    "amount_debit": Decimal("45.50"),
+                    "amount_credit": Decimal("0"),
+                },
+                {
+                    "date_transaction": "2017-01-10",
+                    "description_bank": "PAYROLL DEPOSIT",
+                    "amount_debit": Decimal("0"),
+                    "amount_credit": Decimal("1000.00"),
+                },
+            ]
+        )
+
+class ImportStatementTest(TestCase):
+    """Tests for the bulk statement import"""
+
+    def setUp(self):
+        self.account = create_bank_account()
+
+    def get_statement_form(self):
+        """Returns a valid statement form"""
+        form = StatementForm(data={
+            "account": self.account.id,
+            "date_start": "2017-01-01",
+            "date_end": "2017-12-31",
+        })
+        form.is_valid()
+
+        return form
+
+    def get_rows(self, total):
+        """Returns rows of valid bank transaction data"""
+        return [
+            {
+                "date_transaction": "2017-01-{:02d}".format(index % 28 + 1),
+                "description_bank": "TRANSACTION {}".format(index),
+                "amount_debit": "1.00",
+                "amount_credit": "0.00",
+            } for index in range(total)
+        ]
+
+    def test_import_creates_transactions(self):
+        """Tests that all rows are added to one statement"""
+        results = import_statement(self.get_statement_form(), self.get_rows(5))
+
+        self.assertEqual(results["errors"], [])
+        self.assertEqual(results["imported"], 5)
+        self.assertEqual(results["statement"].banktransaction_set.count(), 5)
+
+    def test_import_creates_history(self):
+        """Tests that history records are made for the transactions"""
+        import_statement(self.get_statement_form(), self.get_rows(5))
+
+        self.assertEqual(BankTransaction.history.count(), 5)
+
+    def test_import_skips_duplicates(self):
+        """Tests that transactions already on the account are skipped"""
+        import_statement(self.get_statement_form(), self.get_rows(3))
+
+        results = import_statement(self.get_statement_form(), self.get_rows(5))
+
+        self.assertEqual(results["imported"], 2)
+        self.assertEqual(results["duplicates"], 3)
+        self.assertEqual(BankTransaction.objects.count(), 5)
+
+    def test_import_keeps_repeated_rows_in_file(self):
+        """Tests that identical rows within one file are all imported"""
+        rows = self.get_rows(1) * 3
+
+        results = import_statement(self.get_statement_form(), rows, chunk_size=2)
+
+        self.assertEqual(results["imported"], 3)
+        self.assertEqual(results["duplicates"], 0)
+
+    def test_import_rolls_back_on_invalid_row(self):
+        """Tests that nothing is saved when a row is invalid"""
+        rows = self.get_rows(3)
+        rows[1]["amount_debit"] = "0.00"
+
+        results = import_statement(self.get_statement_form(), rows)
+
+        self.assertEqual(
+            results["errors"], ["Row 2 - amount debit: Please enter a debit or credit value."]
+        )
+        self.assertIsNone(results["statement"])
+        self.assertEqual(Statement.objects.count(), 0)
+        self.assertEqual(BankTransaction.objects.count(), 0)
+
+    def test_import_query_count(self):
+        """Tests that the number of queries depends on chunks, not rows"""
+        with CaptureQueriesContext(connection) as small_import:
+            import_statement(self.get_statement_form(), self.get_rows(2), chunk_size=100)
+
+        BankTransaction.objects.all().delete()
+
+        with CaptureQueriesContext(connection) as large_import:
+            import_statement(self.get_statement_form(), self.get_rows(50), chunk_size=100)
+
+        self.assertEqual(len(small_import), len(large_import))
+
+class SaveBankTransactionFormsetTest(TestCase):
+    """Tests for the bulk save of the bank transaction formset"""
+
+    def setUp(self):
+        self.transactions = create_bank_transactions()
+        self.statement = self.transactions[0].statement
+
+    def add_transactions(self, number):
+        """Adds additional transactions to the statement"""
+        for i in range(number):
+            BankTransaction.objects.create(
+                statement=self.statement,
+                date_transaction="2017-01-{:02d}".format(i % 28 + 1),
+                description_bank="EXTRA{}".format(i),
+                amount_debit=1.00,
+                amount_credit=0.00,
+            )
+
+    def get_formset_data(self):
+        """Returns the POST data for the unchanged statement transactions"""
+        transactions = BankTransaction.objects.filter(statement=self.statement).order_by("id")
+        data = {
+            "banktransaction_set-TOTAL_FORMS": str(len(transactions)),
+            "banktransaction_set-INITIAL_FORMS": str(len(transactions)),
+            "banktransaction_set-MIN_NUM_FORMS": "0",
+            "banktransaction_set-MAX_NUM_FORMS": "1000",
+        }
+
+        for i, transaction in enumerate(transactions):
+            prefix = "banktransaction_set-{}-".format(i)
+            data[prefix + "id"] = transaction.id
+            data[prefix + "statement"] = self.statement.id
+            data[prefix + "date_transaction"] = str(transaction.date_transaction)
+            data[prefix + "description_bank"] = transaction.description_bank
+            data[prefix + "description_user"] = transaction.description_user
+            data[prefix + "amount_debit"] = str(transaction.amount_debit)
+            data[prefix + "amount_credit"] = str(transaction.amount_credit)
+
+        return data
+
+    def save_formset(self, data):
+        """Validates and saves the formset data"""
+        formset = BankTransactionFormSet(data, instance=self.statement)
+        self.assertTrue(formset.is_valid(), formset.errors)
+
+        return save_bank_transaction_formset(formset, self.statement)
+
+    def test_untouched_rows_are_skipped(self):
+        """Tests that unchanged forms are not saved"""
+        history_total = BankTransaction.history.count()
+
+        results = self.save_formset(self.get_formset_data())
+
+        self.assertEqual(results, {"created": 0, "updated": 0, "deleted": 0})
+        self.assertEqual(BankTransaction.history.count(), history_total)
+
+    def test_create_update_and_delete(self):
+        """Tests that new, edited and deleted rows are saved with history"""
+        data = self.get_formset_data()
+        data["banktransaction_set-0-description_user"] = "Edited cheque"
+        data["banktransaction_set-1-amount_debit"] = "250.00"
+        data["banktransaction_set-3-DELETE"] = "on"
+        data["banktransaction_set-TOTAL_FORMS"] = "5"
+        data["banktransaction_set-4-date_transaction"] = "2017-01-05"
+        data["banktransaction_set-4-description_bank"] = "NEW"
+        data["banktransaction_set-4-amount_debit"] = "0.00"
+        data["banktransaction_set-4-amount_credit"] = "50.00"
+
+        history_total = BankTransaction.history.count()
+
+        results = self.save_formset(data)
+
+        self.assertEqual(results, {"created": 1, "updated": 2, "deleted": 1})
+        self.assertEqual(BankTransaction.history.count(), history_total + 4)
+        self.assertEqual(
+            BankTransaction.objects.get(id=self.transactions[0].id).description_user,
+            "Edited cheque"
+        )
+        self.assertFalse(BankTransaction.objects.filter(id=self.transactions[3].id).exists())
+        self.assertTrue(BankTransaction.objects.filter(description_bank="NEW").exists())
+
+        # Check that the ledger includes the bulk saved changes
+        self.assertEqual(
+            get_account_balance(self.statement.account_id, date(2017, 1, 2)),
+            Decimal("-350.00")
+        )
+        self.assertEqual(
+            get_account_balance(self.statement.account_id, date(2017, 1, 31)),
+            Decimal("0.00")
+        )
+
+    def test_ledger_updated_with_daily_changes(self):
+        """Tests that the ledger is updated without a full rebuild"""
+        data = self.get_formset_data()
+        data["banktransaction_set-0-date_transaction"] = "2017-01-04"
+        data["banktransaction_set-2-DELETE"] = "on"
+        data["banktransaction_set-TOTAL_FORMS"] = "5"
+        data["banktransaction_set-4-date_transaction"] = "2017-01-02"
+        data["banktransaction_set-4-description_bank"] = "NEW"
+        data["banktransaction_set-4-amount_debit"] = "0.00"
+        data["banktransaction_set-4-amount_credit"] = "50.00"
+
+        with mock.patch("bank_transactions.utils.rebuild_daily_balances") as rebuild:
+            self.save_formset(data)
+
+        rebuild.assert_not_called()
+
+        balances = list(DailyBalance.objects.order_by("date").values_list("date", "balance"))
+        rebuild_daily_balances()
+
+        self.assertEqual(
+            balances, list(DailyBalance.objects.order_by("date").values_list("date", "balance"))
+        )
+
+    def test_ledger_updates_resume_after_save(self):
+        """Tests that later deletes update the ledger after a formset delete"""
+        data = self.get_formset_data()
+        data["banktransaction_set-2-DELETE"] = "on"
+
+        self.save_formset(data)
+        self.transactions[0].delete()
+
+        balances = list(DailyBalance.objects.order_by("date").values_list("date", "balance"))
+        rebuild_daily_balances()
+
+        self.assertEqual(
+            balances, list(DailyBalance.objects.order_by("date").values_list("date", "balance"))
+        )
+
+    def test_query_count_does_not_scale_with_rows(self):
+        """Tests that editing a large statement uses the same queries"""
+        def count_queries(description):
+            data = self.get_formset_data()
+            data["banktransaction_set-0-description_user"] = description
+            data["banktransaction_set-1-description_user"] = description
+            formset = BankTransactionFormSet(data, instance=self.statement)
+            self.assertTrue(formset.is_valid())
+
+            with CaptureQueriesContext(connection) as queries:
+                save_bank_transaction_formset(formset, self.statement)
+
+            return len(queries)
+
+        small_count = count_queries("First edit")
+        self.add_transactions(60)
+        large_count = count_queries("Second edit")
+
+        self.assertEqual(small_count, large_count)
+
+class DailyBalanceTest(TestCase):
+    """Tests for the daily account balance ledger"""
+
+    def setUp(self):
+        self.transactions = create_bank_transactions()
+        self.statement = self.transactions[0].statement
+        self.account = self.statement.account
+
+    def get_balances(self, account=None):
+        """Returns the (date, balance) pairs of an account ledger"""
+        return [
+            (str(date), balance) for date, balance in DailyBalance.objects.filter(
+                account=account or self.account
+            ).order_by("date").values_list("date", "balance")
+        ]
+
+    def assert_matches_rebuild(self):
+        """Checks that the ledger matches one rebuilt from scratch"""
+        balances = self.get_balances()
+        rebuild_daily_balances()
+
+        self.assertEqual(balances, self.get_balances())
+
+    def test_balances_on_create(self):
+        """Tests that new transactions are added to the ledger"""
+        self.assertEqual(
+            self.get_balances(),
+            [
+                ("2017-01-01", Decimal("-100.00")),
+                ("2017-01-02", Decimal("-300.00")),
+                ("2017-01-03", Decimal("0.00")),
+                ("2017-01-04", Decimal("400.00")),
+            ]
+        )
+
+    def test_account_balance(self):
+        """Tests the balance as of and before a date"""
+        self.assertEqual(get_account_balance(self.account.id, date(2016, 12, 31)), 0)
+        self.assertEqual(get_account_balance(self.account.id, date(2017, 1, 2)), Decimal("-300"))
+        self.assertEqual(
+            get_account_balance(self.account.id, date(2017, 1, 2), inclusive=False),
+            Decimal("-100")
+        )
+        self.assertEqual(get_account_balance(self.account.id, date(2018, 1, 1)), Decimal("400"))
+
+    def test_balances_on_edit(self):
+        """Tests that amount and date changes shift the later balances"""
+        transaction = self.transactions[1]
+        transaction.amount_debit = Decimal("250.00")
+        transaction.date_transaction = date(2017, 1, 5)
+        transaction.save()
+
+        self.assertEqual(
+            self.get_balances(),
+            [
+                ("2017-01-01", Decimal("-100.00")),
+                ("2017-01-03", Decimal("200.00")),
+                ("2017-01-04", Decimal("600.00")),
+                ("2017-01-05", Decimal("350.00")),
+            ]
+        )
+        self.assert_matches_rebuild()
+
+    def test_balances_on_delete(self):
+        """Tests that deleted transactions are removed from the ledger"""
+        self.transactions[0].delete()
+
+        self.assertEqual(get_account_balance(self.account.id, date(2017, 1, 4)), Decimal("500"))
+        self.assert_matches_rebuild()
+
+    def test_balances_on_statement_account_change(self):
+        """Tests that a statement moved to another account moves its balances"""
+        new_account = Account.objects.create(
+            institution=self.account.institution, name="Savings Account", status="a",
+        )
+
+        self.statement.account = new_account
+        self.statement.save()
+
+        self.assertEqual(self.get_balances(), [])
+        self.assertEqual(len(self.get_balances(new_account)), 4)
+
+    def test_balances_on_statement_delete(self):
+        """Tests that deleting a statement removes its balances"""
+        self.statement.delete()
+
+        self.assertEqual(self.get_balances(), [])
+
+    def test_balances_on_statement_queryset_delete(self):
+        """Tests that deleting statements in bulk removes their balances"""
+        Statement.objects.filter(id=self.statement.id).delete()
+
+        self.assertEqual(self.get_balances(), [])
+
+        # Later transaction deletes still update the ledger
+        transactions = create_bank_transactions()
+        transactions[0].delete()
+
+        self.assertEqual(
+            get_account_balance(transactions[0].statement.account_id, date(2017, 1, 4)),
+            Decimal("500")
+        )
+        self.assert_matches_rebuild()
+
+    def test_balance_created_by_another_request(self):
+        """Tests that a balance created concurrently is updated"""
+        DailyBalance.objects.create(
+            account=self.account, date="2017-02-01", change=Decimal("50"), balance=Decimal("450")
+        )
+        update = QuerySet.update
+
+        # Miss the balance on the first update, as if it was created just after
+        def update_after_create(queryset, **kwargs):
+            if update_after_create.calls == 0:
+                update_after_create.calls += 1
+
+                return 0
+
+            return update(queryset, **kwargs)
+
+        update_after_create.calls = 0
+
+        with mock.patch.object(
+                QuerySet, "update", autospec=True, side_effect=update_after_create
+        ):
+            apply_balance_change(self.account.id, date(2017, 2, 1), Decimal("100"))
+
+        self.assertEqual(
+            DailyBalance.objects.filter(account=self.account, date="2017-02-01").values_list(
+                "change", "balance"
+            ).get(),
+            (Decimal("150.00"), Decimal("550.00"))
+        )
+
+    def test_balances_on_import(self):
+        """Tests that imported transactions are added to the ledger"""
+        form = StatementForm(data={
+            "account": self.account.id,
+            "date_start": "2017-02-01",
+            "date_end": "2017-02-28",
+        })
+        form.is_valid()
+
+        import_statement(form, [{
+            "date_transaction": "2017-02-01",
+            "description_bank": "DEPOSIT",
+            "amount_debit": "0.00",
+            "amount_credit": "100.00",
+        }])
+
+        self.assertEqual(get_account_balance(self.account.id, date(2017, 2, 1)), Decimal("500"))
@@ -1,12 +1,16 @@
 """Test cases for the bank_transactions app views"""
 
 import tempfile
+from decimal import Decimal
 
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile
+from django.db import connection
 from django.urls import reverse
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from bank_transactions.models import Statement, BankTransaction
+from bank_transactions.views import STATEMENTS_PAGE_SIZE
 from documents.models import Attachment, BankStatementMatch
 
 from .utils import (
@@ -60,6 +64,122 @@ class BankDashboardTest(TestCase):
         # Check for proper template
         self.assertTemplateUsed(response, "bank_transactions/index.html")
 
+    def test_dashboard_statement_balances(self):
+        """Checks that statements include the ledger balances"""
+        transactions = create_bank_transactions()
+
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(reverse("bank_transactions:dashboard"))
+
+        statement = response.context["accounts"][0].statement_page["statements"][0]
+
+        self.assertEqual(statement.id, transactions[0].statement.id)
+        self.assertEqual(statement.opening_balance, 0)
+        self.assertEqual(statement.closing_balance, Decimal("400"))
+        self.assertEqual(statement.total_debit, Decimal("300"))
+        self.assertEqual(statement.total_credit, Decimal("700"))
+        self.assertEqual(statement.total, Decimal("400"))
+        self.assertEqual(statement.transaction_count, 4)
+
+    def test_dashboard_query_count(self):
+        """Checks that the queries do not depend on the number of statements"""
+        transactions = create_bank_transactions()
+        account = transactions[0].statement.account
+
+        self.client.login(username="user", password="abcd123456")
+
+        with CaptureQueriesContext(connection) as single_statement:
+            self.client.get(reverse("bank_transactions:dashboard"))
+
+        for month in range(2, 5):
+            statement = Statement.objects.create(
+                account=account,
+                date_start="2017-{:02d}-01".format(month),
+                date_end="2017-{:02d}-28".format(month),
+            )
+            BankTransaction.objects.create(
+                statement=statement,
+                date_transaction="2017-{:02d}-01".format(month),
+                description_bank="DEPOSIT",
+                amount_credit=10.00,
+            )
+            create_bank_statement_match(statement)
+
+        with CaptureQueriesContext(connection) as many_statements:
+            self.client.get(reverse("bank_transactions:dashboard"))
+
+        self.assertEqual(len(single_statement), len(many_statements))
+
+class StatementListTest(TestCase):
+    """Tests for the statement list (dashboard pagination) view"""
+
+    def setUp(self):
+        create_user()
+        self.account = create_bank_account()
+
+        self.statements = []
+
+        for month in range(1, 13):
+            self.statements.append(Statement.objects.create(
+                account=self.account,
+                date_start="2017-{:02d}-01".format(month),
+                date_end="2017-{:02d}-28".format(month),
+            ))
+
+        self.url = reverse("bank_transactions:statements", args=[self.account.id])
+
+    def test_statement_list_redirect_if_not_logged_in(self):
+        """Checks user is redirected if not logged in"""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_dashboard_first_page(self):
+        """Checks that the dashboard only shows the newest statements"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(reverse("bank_transactions:dashboard"))
+
+        page = response.context["accounts"][0].statement_page
+
+        self.assertEqual(
+            [statement.id for statement in page["statements"]],
+            [statement.id for statement in reversed(self.statements[-STATEMENTS_PAGE_SIZE:])]
+        )
+        self.assertTrue(page["has_more"])
+
+    def test_statement_list_next_page(self):
+        """Checks that the next page continues after the last statement"""
+        last_statement = self.statements[-STATEMENTS_PAGE_SIZE]
+
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(
+            self.url, {"last_date": "2017-08-28", "last_id": last_statement.id}
+        )
+
+        self.assertTemplateUsed(response, "bank_transactions/statements.html")
+        self.assertEqual(
+            [statement.id for statement in response.context["statements"]],
+            [statement.id for statement in reversed(self.statements[2:7])]
+        )
+        self.assertTrue(response.context["has_more"])
+
+    def test_statement_list_last_page(self):
+        """Checks that the final page does not offer more statements"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(
+            self.url, {"last_date": "2017-03-28", "last_id": self.statements[2].id}
+        )
+
+        self.assertEqual(len(response.context["statements"]), 2)
+        self.assertFalse(response.context["has_more"])
+
+    def test_statement_list_html404_on_invalid_account(self):
+        """Checks that an invalid account returns a 404 response"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(reverse("bank_transactions:statements", args=[999999]))
+
+        self.assertEqual(response.status_code, 404)
+
 class StatementAddTest(TestCase):
     """Tests for the add statement view"""
     # Setup a temporary media_root folder to hold any attachments
@@ -724,3 +844,101 @@ class StatementDeleteTest(TestCase):
 
         # Checks that the attachment match was deleted
         self.assertEqual(BankStatementMatch.objects.count(), attachment_match_total - 1)
+
+class StatementImportTest(TestCase):
+    """Tests for the import statement view"""
+
+    def setUp(self):
+        create_user()
+        account = create_bank_account()
+
+        self.valid_data = {
+            "account": account.id,
+            "date_start": "2017-01-01",
+            "date_end": "2017-01-31",
+        }
+
+    def get_csv_file(self, content):
+        """Returns an uploaded CSV file with the provided content"""
+        return SimpleUploadedFile("statement.csv", content.encode("utf-8"), "text/csv")
+
+    def test_statement_import_redirect_if_not_logged_in(self):
+        """Checks user is redirected if not logged in"""
+        response = self.client.get(reverse("bank_transactions:import"))
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_statement_import_template(self):
+        """Checks that correct template is being used"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(reverse("bank_transactions:import"))
+
+        # Check for proper template
+        self.assertTemplateUsed(response, "bank_transactions/import.html")
+
+    def test_statement_import_adds_transactions(self):
+        """Checks that the file transactions are added to a new statement"""
+        import_data = self.valid_data
+        import_data["statement_file"] = self.get_csv_file(
+            "Date,Description,Debit,Credit\n"
+            "2017-01-05,CHQ#0001,100.00,0.00\n"
+            "2017-01-06,DEPOSIT,0.00,50.00\n"
+        )
+
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.post(
+            reverse("bank_transactions:import"),
+            import_data,
+            follow=True,
+        )
+
+        # Check that redirection was successful
+        self.assertRedirects(response, reverse("bank_transactions:dashboard"))
+
+        # Check that the statement and transactions were added
+        self.assertEqual(Statement.objects.count(), 1)
+        self.assertEqual(BankTransaction.objects.count(), 2)
+
+    def test_statement_import_invalid_row(self):
+        """Checks that row errors are returned and nothing is saved"""
+        import_data = self.valid_data
+        import_data["statement_file"] = self.get_csv_file(
+            "Date,Description,Debit,Credit\n"
+            "2017-01-05,CHQ#0001,100.00,50.00\n"
+        )
+
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.post(
+            reverse("bank_transactions:import"),
+            import_data,
+        )
+
+        # Check that page was not redirected to dashboard
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            response.context["import_errors"],
+            [
+                "Row 1 - amount credit: A single transaction cannot have both "
+                "debit and credit amounts entered."
+            ]
+        )
+        self.assertEqual(Statement.objects.count(), 0)
+
+    def test_statement_import_invalid_file_type(self):
+        """Checks that unsupported file types are rejected"""
+        import_data = self.valid_data
+        import_data["statement_file"] = SimpleUploadedFile(
+            "statement.pdf", b"%PDF-1.4", "application/pdf"
+        )
+
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.post(
+            reverse("bank_transactions:import"),
+            import_data,
+        )
+
+        self.assertEqual(
+            response.context["statement_form"].errors["statement_file"],
+            ["Please upload a CSV, OFX, or QFX file."]
+        )
@@ -2,14 +2,17 @@
 from django.urls import path
 
 from .views import (
-    dashboard, statement_add, statement_edit, statement_delete
+    dashboard, statement_list, statement_add, statement_import, statement_edit,
+    statement_delete,
 )
 
 app_name = "bank_transactions"
 
 urlpatterns = [
     path('statement/add/', statement_add, name="add"),
+    path('statement/import/', statement_import, name="import"),
     path('statement/edit/<int:statement_id>', statement_edit, name="edit"),
     path('statement/delete/<int:statement_id>', statement_delete, name="delete"),
+    path('statements/<int:account_id>/', statement_list, name="statements"),
     path('', dashboard, name="dashboard"),
 ]
@@ -0,0 +1,462 @@
+"""Objects and functions supporting the bank_transactions app"""
+import csv
+import io
+import re
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db.models import DecimalField, F, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.transaction import atomic, set_rollback
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from .forms import BankTransactionForm
+from .models import BankTransaction, DailyBalance
+
+
+IMPORT_CHUNK_SIZE = 500
+DESCRIPTION_MAX_LENGTH = BankTransaction._meta.get_field("description_bank").max_length
+
+# Accepted CSV headers (lowercase) for each bank transaction value
+CSV_HEADERS = {
+    "date_transaction": ["date", "transaction date", "date posted"],
+    "description_bank": ["description", "bank description", "name", "memo"],
+    "amount_debit": ["debit", "withdrawal", "withdrawals"],
+    "amount_credit": ["credit", "deposit", "deposits"],
+    "amount": ["amount"],
+}
+
+# OFX/QFX transactions are SGML blocks of <TAG>value lines
+OFX_TAG = re.compile(r"<(/?)([A-Z0-9.]+)>([^<\r\n]*)")
+
+def clean_amount(value):
+    """Converts a bank amount string into a Decimal
+
+        Returns None for blank values and the original string for
+        invalid values (so form validation can report them).
+    """
+    value = (value or "").strip().replace("$", "").replace(",", "")
+
+    # Accounting format uses brackets for negative values
+    if value.startswith("(") and value.endswith(")"):
+        value = "-{}".format(value[1:-1])
+
+    if not value:
+        return None
+
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return value
+
+def split_amount(amount):
+    """Splits a signed amount into debit and credit amounts"""
+    if not isinstance(amount, Decimal):
+        return amount, Decimal("0")
+
+    if amount < 0:
+        return -amount, Decimal("0")
+
+    return Decimal("0"), amount
+
+def format_amount(amount):
+    """Returns a positive amount (or invalid value) for form data"""
+    if amount is None:
+        return 0
+
+    if isinstance(amount, Decimal):
+        return abs(amount)
+
+    return amount
+
+def parse_csv(file):
+    """Generator that yields bank transaction data from a CSV file
+
+        The first row must be a header row. Amounts may be in separate
+        debit and credit columns or in a single signed amount column.
+    """
+    reader = csv.reader(file)
+
+    try:
+        header = [column.strip().lower() for column in next(reader)]
+    except StopIteration:
+        return
+
+    columns = {}
+
+    for key, names in CSV_HEADERS.items():
+        for name in names:
+            if name in header:
+                columns[key] = header.index(name)
+                break
+
+    for row in reader:
+        # Skip blank lines
+        if not any(value.strip() for value in row):
+            continue
+
+        def get_value(key):
+            index = columns.get(key)
+
+            if index is None or index >= len(row):
+                return ""
+
+            return row[index].strip()
+
+        if "amount" in columns:
+            amount_debit, amount_credit = split_amount(clean_amount(get_value("amount")))
+        else:
+            amount_debit = clean_amount(get_value("amount_debit"))
+            amount_credit = clean_amount(get_value("amount_credit"))
+
+        yield {
+            "date_transaction": get_value("date_transaction"),
+            "description_bank": get_value("description_bank")[:DESCRIPTION_MAX_LENGTH],
+            "amount_debit": format_amount(amount_debit),
+            "amount_credit": format_amount(amount_credit),
+        }
+
+def parse_ofx(file):
+    """Generator that yields bank transaction data from an OFX/QFX file
+
+        Handles both SGML (OFX 1.x) and XML (OFX 2.x) files by reading
+        the tags of each STMTTRN block line by line.
+    """
+    transaction = None
+
+    for line in file:
+        for closing, tag, value in OFX_TAG.findall(line):
+            if tag == "STMTTRN":
+                if closing:
+                    if transaction is not None:
+                        yield build_ofx_transaction(transaction)
+
+                    transaction = None
+                else:
+                    transaction = {}
+            elif transaction is not None and not closing:
+                transaction[tag] = value.strip()
+
+def build_ofx_transaction(transaction):
+    """Converts the tags of an OFX transaction into bank transaction data"""
+    date_posted = transaction.get("DTPOSTED", "")
+
+    # OFX dates are formatted as YYYYMMDD[HHMMSS[.XXX][TZ]]
+    if len(date_posted) >= 8:
+        date_posted = "{}-{}-{}".format(date_posted[0:4], date_posted[4:6], date_posted[6:8])
+
+    amount_debit, amount_credit = split_amount(clean_amount(transaction.get("TRNAMT")))
+
+    description = transaction.get("NAME") or transaction.get("MEMO") or ""
+
+    return {
+        "date_transaction": date_posted,
+        "description_bank": description[:DESCRIPTION_MAX_LENGTH],
+        "amount_debit": format_amount(amount_debit),
+        "amount_credit": format_amount(amount_credit),
+    }
+
+def parse_statement_file(uploaded_file):
+    """Returns a generator of bank transaction data for an uploaded file"""
+    text_file = io.TextIOWrapper(uploaded_file, encoding="utf-8-sig", errors="replace", newline="")
+
+    if uploaded_file.name.lower().endswith(".csv"):
+        return parse_csv(text_file)
+
+    return parse_ofx(text_file)
+
+def chunk_rows(rows, size=IMPORT_CHUNK_SIZE):
+    """Generator that yields lists of at most size rows"""
+    rows = iter(rows)
+
+    while True:
+        chunk = list(islice(rows, size))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+def get_duplicate_key(date_transaction, amount_debit, amount_credit, description_bank):
+    """Returns the key used to detect duplicate bank transactions"""
+    return (date_transaction, Decimal(amount_debit), Decimal(amount_credit), description_bank)
+
+def get_existing_transaction_counts(statement, transactions):
+    """Counts the existing account transactions matching the new ones
+
+        Uses a single query (limited to the dates of the transactions)
+        against the duplicate detection index. Transactions already
+        imported to this statement are ignored so that repeated
+        transactions within one file are kept.
+    """
+    dates = {transaction.date_transaction for transaction in transactions}
+
+    existing = BankTransaction.objects.filter(
+        statement__account=statement.account_id, date_transaction__in=dates
+    ).exclude(statement=statement).values_list(
+        "date_transaction", "amount_debit", "amount_credit", "description_bank"
+    )
+
+    return Counter(get_duplicate_key(*values) for values in existing)
+
+def import_statement(statement_form, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """Creates a statement and bulk creates its bank transactions
+
+        Rows are validated in chunks with the BankTransactionForm.
+        Transactions that already exist for the account (same date,
+        amounts and bank description) are skipped. If any row is
+        invalid, nothing is saved.
+
+        Returns a dictionary with the statement, the number of
+        imported and duplicate transactions, and any row errors.
+    """
+    results = {
+        "statement": None,
+        "imported": 0,
+        "duplicates": 0,
+        "errors": [],
+    }
+
+    with atomic():
+        statement = statement_form.save()
+        row_number = 0
+
+        for chunk in chunk_rows(rows, chunk_size):
+            transactions = []
+
+            # Validate each row with the same rules as manual entry
+            for row in chunk:
+                row_number += 1
+                form = BankTransactionForm(data=row)
+
+                if form.is_valid():
+                    transaction = form.save(commit=False)
+                    transaction.statement = statement
+                    transactions.append(transaction)
+                else:
+                    for field, field_errors in form.errors.items():
+                        results["errors"].append("Row {} - {}: {}".format(
+                            row_number, field.replace("_", " "), " ".join(field_errors)
+                        ))
+
+            if results["errors"]:
+                continue
+
+            # Skip transactions already recorded for this account
+            existing_counts = get_existing_transaction_counts(statement, transactions)
+            new_transactions = []
+
+            for transaction in transactions:
+                key = get_duplicate_key(
+                    transaction.date_transaction,
+                    transaction.amount_debit,
+                    transaction.amount_credit,
+                    transaction.description_bank,
+                )
+
+                if existing_counts[key]:
+                    existing_counts[key] -= 1
+                    results["duplicates"] += 1
+                else:
+                    new_transactions.append(transaction)
+
+            created = BankTransaction.objects.bulk_create(new_transactions)
+            BankTransaction.history.bulk_history_create(created)
+
+            results["imported"] += len(created)
+
+        # Bulk created transactions do not send signals
+        rebuild_daily_balances([statement.account_id])
+
+        if results["errors"]:
+            set_rollback(True)
+
+            return results
+
+    results["statement"] = statement
+
+    return results
+
+def save_bank_transaction_formset(formset, statement):
+    """Saves the changed forms of a bank transaction formset in bulk
+
+        Untouched forms are skipped; new, edited and deleted
+        transactions are each saved with a single bulk query (plus
+        their history records). The ledger is updated with the net
+        change of each affected date. Returns the number of created,
+        updated and deleted transactions.
+    """
+    new_transactions = []
+    changed_transactions = []
+    deleted_ids = []
+
+    for form in formset:
+        # Ignore empty forms
+        if not form.cleaned_data:
+            continue
+
+        # Add forms do not have a DELETE field
+        if form.cleaned_data.get("DELETE"):
+            if form.instance.pk:
+                deleted_ids.append(form.instance.pk)
+        elif form.instance.pk is None:
+            transaction = form.save(commit=False)
+            transaction.statement = statement
+            new_transactions.append(transaction)
+        elif form.has_changed():
+            changed_transactions.append(form.save(commit=False))
+
+    # Remove the saved amounts of the edited and deleted transactions
+    daily_changes = defaultdict(Decimal)
+    original_ids = [transaction.pk for transaction in changed_transactions] + deleted_ids
+
+    if original_ids:
+        for date, amount_debit, amount_credit in BankTransaction.objects.filter(
+                id__in=original_ids
+        ).values_list("date_transaction", "amount_debit", "amount_credit"):
+            daily_changes[date] -= get_transaction_change(amount_debit, amount_credit)
+
+    # Deletions send signals to record history (the ledger is updated below)
+    if deleted_ids:
+        # pylint: disable=import-outside-toplevel
+        from .signals import suspend_balance_updates
+
+        with suspend_balance_updates():
+            BankTransaction.objects.filter(id__in=deleted_ids).delete()
+
+    if new_transactions:
+        bulk_create_with_history(new_transactions, BankTransaction)
+
+    if changed_transactions:
+        bulk_update_with_history(
+            changed_transactions, BankTransaction, BankTransactionForm._meta.fields
+        )
+
+    # Add the new amounts and apply the net change of each date
+    for transaction in new_transactions + changed_transactions:
+        daily_changes[transaction.date_transaction] += get_transaction_change(
+            transaction.amount_debit, transaction.amount_credit
+        )
+
+    for date, change in sorted(daily_changes.items()):
+        apply_balance_change(statement.account_id, date, change)
+
+    return {
+        "created": len(new_transactions),
+        "updated": len(changed_transactions),
+        "deleted": len(deleted_ids),
+    }
+
+def get_transaction_change(amount_debit, amount_credit):
+    """Returns the change to an account balance from a bank transaction"""
+    # Convert through strings so float amounts keep their cents exactly
+    return Decimal(str(amount_credit)) - Decimal(str(amount_debit))
+
+def apply_balance_change(account_id, date, change):
+    """Applies a balance change on a date to the account ledger
+
+        The daily balance for the date is updated (or created from the
+        prior balance) and all later balances are shifted by the change.
+    """
+    if not change:
+        return
+
+    updated = DailyBalance.objects.filter(account_id=account_id, date=date).update(
+        change=F("change") + change,
+        balance=F("balance") + change,
+    )
+
+    if not updated:
+        _, created = DailyBalance.objects.get_or_create(
+            account_id=account_id,
+            date=date,
+            defaults={
+                "change": change,
+                "balance": lambda: get_account_balance(account_id, date, inclusive=False) + change,
+            },
+        )
+
+        # Another request created the balance first
+        if not created:
+            DailyBalance.objects.filter(account_id=account_id, date=date).update(
+                change=F("change") + change,
+                balance=F("balance") + change,
+            )
+
+    DailyBalance.objects.filter(account_id=account_id, date__gt=date).update(
+        balance=F("balance") + change
+    )
+
+    # Dates without a net change do not need an entry
+    DailyBalance.objects.filter(account_id=account_id, date=date, change=0).delete()
+
+def rebuild_daily_balances(account_ids=None):
+    """Recreates the daily balances from the bank transactions
+
+        Rebuilds the provided accounts (or all accounts if none are
+        provided) with one aggregate query.
+    """
+    output_field = DecimalField(max_digits=15, decimal_places=2)
+
+    transactions = BankTransaction.objects.all()
+    balances = DailyBalance.objects.all()
+
+    if account_ids is not None:
+        transactions = transactions.filter(statement__account__in=account_ids)
+        balances = balances.filter(account__in=account_ids)
+
+    daily_changes = transactions.values("statement__account", "date_transaction").annotate(
+        change=Coalesce(Sum("amount_credit"), Value(0), output_field=output_field)
+        - Coalesce(Sum("amount_debit"), Value(0), output_field=output_field),
+    ).order_by("statement__account", "date_transaction")
+
+    new_balances = []
+    running_balances = {}
+
+    for daily_change in daily_changes:
+        if not daily_change["change"]:
+            continue
+
+        account_id = daily_change["statement__account"]
+        balance = running_balances.get(account_id, Decimal("0")) + daily_change["change"]
+        running_balances[account_id] = balance
+
+        new_balances.append(DailyBalance(
+            account_id=account_id,
+            date=daily_change["date_transaction"],
+            change=daily_change["change"],
+            balance=balance,
+        ))
+
+    balances.delete()
+    DailyBalance.objects.bulk_create(new_balances)
+
+def get_balance_subquery(account, date, inclusive=True):
+    """Returns an expression for an account balance as of a date
+
+        The account and date may be values or expressions (e.g. an
+        OuterRef to annotate balances onto a queryset). The balance
+        includes the transactions on the date when inclusive is True.
+    """
+    date_lookup = "date__lte" if inclusive else "date__lt"
+
+    return Coalesce(
+        Subquery(
+            DailyBalance.objects.filter(
+                account=account, **{date_lookup: date}
+            ).order_by("-date").values("balance")[:1]
+        ),
+        Value(0),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+def get_account_balance(account_id, date, inclusive=True):
+    """Returns the balance of an account as of (or before) a date"""
+    date_lookup = "date__lte" if inclusive else "date__lt"
+
+    balance = DailyBalance.objects.filter(
+        account_id=account_id, **{date_lookup: date}
+    ).order_by("-date").values_list("balance", flat=True).first()
+
+    return balance if balance is not None else Decimal("0")
@@ -2,20 +2,72 @@
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db.models import OuterRef, Prefetch, Q
 from django.http import HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
+from django.utils.dateparse import parse_date
 
 from documents.models import Attachment, BankStatementMatch
 from bank_institutions.models import Account
 from .models import Statement
-from .forms import StatementForm, BankTransactionFormSet, AttachmentMatchFormSet, NewAttachmentForm
-
+from .forms import (
+    StatementForm, StatementImportForm, BankTransactionFormSet, AttachmentMatchFormSet,
+    NewAttachmentForm,
+)
+from .utils import (
+    get_balance_subquery, import_statement, parse_statement_file, save_bank_transaction_formset,
+)
+
+
+STATEMENTS_PAGE_SIZE = 5
+
+def get_dashboard_statements():
+    """Returns statements with the data the dashboard displays
+
+        Includes the transaction totals, the opening and closing
+        balances from the account ledger, and the transactions and
+        attachments of each statement.
+    """
+    return Statement.objects.with_totals().annotate(
+        opening_balance=get_balance_subquery(
+            OuterRef("account"), OuterRef("date_start"), inclusive=False
+        ),
+        closing_balance=get_balance_subquery(OuterRef("account"), OuterRef("date_end")),
+    ).prefetch_related(
+        "banktransaction_set",
+        Prefetch(
+            "bankstatementmatch_set",
+            queryset=BankStatementMatch.objects.select_related("attachment"),
+        ),
+    ).order_by("-date_end", "-id")
+
+def split_statement_page(statements):
+    """Splits a page retrieved with one extra statement"""
+    has_more = len(statements) > STATEMENTS_PAGE_SIZE
+    statements = statements[:STATEMENTS_PAGE_SIZE]
+
+    return {
+        "statements": statements,
+        "has_more": has_more,
+        "last_statement": statements[-1] if statements else None,
+    }
 
 @login_required
 def dashboard(request):
     """Main dashboard to display banking functions"""
-    accounts = Account.objects.all()
+    # Retrieve the first page of statements for every account (one
+    # extra statement is retrieved to check for another page)
+    accounts = Account.objects.prefetch_related(
+        Prefetch(
+            "statement_set",
+            queryset=get_dashboard_statements()[:STATEMENTS_PAGE_SIZE + 1],
+            to_attr="statement_page",
+        )
+    )
+
+    for account in accounts:
+        account.statement_page = split_statement_page(account.statement_page)
 
     return render(
         request,
@@ -25,6 +77,40 @@ def dashboard(request):
         },
     )
 
+@login_required
+def statement_list(request, account_id):
+    """Retrieves the next page of statements for an account (newest first)
+
+        Pages are retrieved with a keyset on (date_end, id). The
+        last_date and last_id parameters are the values of the final
+        statement of the previous page.
+    """
+    account = get_object_or_404(Account, id=account_id)
+    statements = get_dashboard_statements().filter(account=account)
+
+    # Continue from the end of the previous page (if provided)
+    try:
+        last_date = parse_date(request.GET.get("last_date", ""))
+        last_id = int(request.GET.get("last_id", ""))
+    except ValueError:
+        last_date = None
+        last_id = None
+
+    if last_date and last_id:
+        statements = statements.filter(
+            Q(date_end__lt=last_date)
+            | (Q(date_end=last_date) & Q(id__lt=last_id))
+        )
+
+    context = split_statement_page(list(statements[:STATEMENTS_PAGE_SIZE + 1]))
+    context["account"] = account
+
+    return render(
+        request,
+        "bank_transactions/statements.html",
+        context=context,
+    )
+
 @login_required
 def statement_add(request):
     """Generates and processes form to add new bank statement"""
@@ -38,39 +124,35 @@ def statement_add(request):
         bank_transaction_formsets.can_delete = False
 
         # Create new attachment form
-        new_attachment_form = NewAttachmentForm(request.POST, request.FILES)
+        new_attachment_form = NewAttachmentForm(request.POST, request.FILES, user=request.user)
 
         # Check if forms are valid
         if statement_form.is_valid() and bank_transaction_formsets.is_valid() and new_attachment_form.is_valid():
             # Save new statement instance
             saved_statement = statement_form.save()
 
-            # Cycle through each transaction formset
-            for transaction_formset in bank_transaction_formsets:
-                # Ignore empty forms
-                if transaction_formset.cleaned_data:
-                    # Create the transaction instance
-                    saved_transaction = transaction_formset.save(commit=False)
-
-                    # Update transaction instance with statement reference
-                    saved_transaction.statement = saved_statement
-
-                    # Save the transaction with new reference
-                    saved_transaction.save()
+            # Save the new transactions in bulk
+            save_bank_transaction_formset(bank_transaction_formsets, saved_statement)
 
             # Cycle through each new attachment
             for file in new_attachment_form.cleaned_data["files"]:
-                # Create a new attachment instance
-                saved_attachment = Attachment.objects.create(
-                    location=file,
-                )
+                # Create a new attachment instance (or reuse a matching one)
+                saved_attachment, _ = Attachment.objects.get_or_create_from_file(file)
 
                 # Create the attachment match
-                BankStatementMatch.objects.create(
+                BankStatementMatch.objects.get_or_create(
                     statement=saved_statement,
                     attachment=saved_attachment,
                 )
 
+            # Match the attachments uploaded in chunks
+            for upload in new_attachment_form.cleaned_data["tokens"]:
+                BankStatementMatch.objects.get_or_create(
+                    statement=saved_statement,
+                    attachment=upload.attachment,
+                )
+                upload.delete()
+
             messages.success(request, "Statement successfully added")
 
             return HttpResponseRedirect(reverse("bank_transactions:dashboard"))
@@ -95,6 +177,50 @@ def statement_add(request):
         },
     )
 
+@login_required
+def statement_import(request):
+    """Generates and processes form to import a bank statement file"""
+    import_errors = []
+
+    # If this is a POST request then process the Form data
+    if request.method == "POST":
+        # Create statement import form
+        statement_form = StatementImportForm(request.POST, request.FILES)
+
+        if statement_form.is_valid():
+            # Stream the file rows into the new statement
+            results = import_statement(
+                statement_form,
+                parse_statement_file(statement_form.cleaned_data["statement_file"]),
+            )
+
+            if results["errors"]:
+                import_errors = results["errors"]
+            else:
+                messages.success(
+                    request,
+                    "Statement successfully imported ({} transactions added, {} duplicates skipped)".format(
+                        results["imported"], results["duplicates"]
+                    )
+                )
+
+                return HttpResponseRedirect(reverse("bank_transactions:dashboard"))
+
+    # If this is a GET (or any other method) create the default form.
+    else:
+        statement_form = StatementImportForm()
+
+    return render(
+        request,
+        "bank_transactions/import.html",
+        {
+            "statement_form": statement_form,
+            "import_errors": import_errors,
+            "page_name": "Import Bank Statement",
+            "submit_button": "Import bank statement",
+        },
+    )
+
 @login_required
 def statement_edit(request, statement_id):
     """Generate and processes form to edit a financial system"""
@@ -119,7 +245,7 @@ def statement_edit(request, statement_id):
         )
 
         # Create new attachment form
-        new_attachment_form = NewAttachmentForm(request.POST, request.FILES)
+        new_attachment_form = NewAttachmentForm(request.POST, request.FILES, user=request.user)
 
         # Check if forms are valid
         if (
@@ -129,48 +255,35 @@ def statement_edit(request, statement_id):
             # Save new statement instance
             saved_statement = statement_form.save()
 
-            # Cycle through each transaction formset
-            for transaction_formset in bank_transaction_formsets:
-                # Ignore emtpy forms
-                if transaction_formset.cleaned_data:
-                    # Delete any formset marked for deletion
-                    if transaction_formset.cleaned_data["DELETE"]:
-                        transaction_formset.cleaned_data["id"].delete()
-                    else:
-                        # Create the transaction instance
-                        saved_transaction = transaction_formset.save(commit=False)
-
-                        # Update transaction instance with statement reference
-                        saved_transaction.statement = saved_statement
-
-                        # Save the transaction with new reference
-                        saved_transaction.save()
+            # Save the new, changed and deleted transactions in bulk
+            save_bank_transaction_formset(bank_transaction_formsets, saved_statement)
 
             # Delete any old attachments
             for attachment_match_formset in attachment_match_formsets:
                 if attachment_match_formset.cleaned_data["DELETE"]:
-                    # Get the match object
-                    attachment_match = attachment_match_formset.cleaned_data["id"]
-
-                    # Delete the attachment
-                    attachment_match.attachment.delete()
-
-                    # Delete the attachment match
-                    attachment_match.delete()
+                    # Delete the attachment match (the attachment is deleted
+                    # once no other transaction or statement references it)
+                    attachment_match_formset.cleaned_data["id"].delete()
 
             # Cycle through each new attachment
             for file in new_attachment_form.cleaned_data["files"]:
-                # Create a new attachment instance
-                saved_attachment = Attachment.objects.create(
-                    location=file,
-                )
+                # Create a new attachment instance (or reuse a matching one)
+                saved_attachment, _ = Attachment.objects.get_or_create_from_file(file)
 
                 # Create the attachment match
-                BankStatementMatch.objects.create(
+                BankStatementMatch.objects.get_or_create(
                     statement=saved_statement,
                     attachment=saved_attachment,
                 )
 
+            # Match the attachments uploaded in chunks
+            for upload in new_attachment_form.cleaned_data["tokens"]:
+                BankStatementMatch.objects.get_or_create(
+                    statement=saved_statement,
+                    attachment=upload.attachment,
+                )
+                upload.delete()
+
             messages.success(request, "Statement successfully updated")
 
             return HttpResponseRedirect(reverse("bank_transactions:dashboard"))
@@ -5,3 +5,8 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     """Configuration for the documents app"""
     name = 'documents'
+
+    def ready(self):
+        """Registers the attachment reference signals"""
+        # pylint: disable=import-outside-toplevel, unused-import
+        from documents import signals
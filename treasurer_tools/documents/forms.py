@@ -1,16 +1,70 @@
 """Forms for the documents app"""
+import uuid
 
 from custom_multiupload.widgets import MultiFileField
 
 from django import forms
+from django.core.exceptions import ValidationError
 
-class NewAttachmentForm(forms.Form):
+from .models import AttachmentUpload
+
+class AttachmentTokenField(forms.CharField):
+    """Field for the comma separated tokens of chunked uploads
+
+        Cleans to a list of the completed AttachmentUpload instances.
+        Only the uploads of user (set by the form) are accepted.
+    """
+    widget = forms.HiddenInput
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("required", False)
+        super(AttachmentTokenField, self).__init__(*args, **kwargs)
+        self.user = None
+
+    def to_python(self, value):
+        value = super(AttachmentTokenField, self).to_python(value)
+
+        try:
+            tokens = {uuid.UUID(token.strip()) for token in value.split(",") if token.strip()}
+        except ValueError:
+            raise ValidationError("Invalid attachment upload submitted.")
+
+        if not tokens:
+            return []
+
+        uploads = list(AttachmentUpload.objects.filter(
+            token__in=tokens, user=self.user, attachment__isnull=False
+        ).select_related("attachment"))
+
+        if len(uploads) != len(tokens):
+            raise ValidationError("One or more attachments did not finish uploading.")
+
+        return uploads
+
+class AttachmentTokenFormMixin():
+    """Form mixin that limits its upload tokens to the submitting user
+
+        The form takes a user keyword argument, which is set on every
+        AttachmentTokenField of the form.
+    """
+    def __init__(self, *args, **kwargs):
+        # Get the user submitting the upload tokens
+        user = kwargs.pop("user", None)
+
+        super(AttachmentTokenFormMixin, self).__init__(*args, **kwargs)
+
+        for field in self.fields.values():
+            if isinstance(field, AttachmentTokenField):
+                field.user = user
+
+class NewAttachmentForm(AttachmentTokenFormMixin, forms.Form):
     """Form to handle file attachments"""
     files = MultiFileField(
         max_file_size=1024*1024*10,
         max_num=10,
         required=False,
     )
+    tokens = AttachmentTokenField()
 
     class Meta:
         abstract = True
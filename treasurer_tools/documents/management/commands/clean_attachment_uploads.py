@@ -0,0 +1,29 @@
+"""Command to delete abandoned chunked attachment uploads"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from documents.models import AttachmentUpload
+
+
+class Command(BaseCommand):
+    """Deletes the uploads (and parts) that were never submitted with a form"""
+    help = "Deletes chunked attachment uploads older than the provided number of hours"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            default=24,
+            type=int,
+            help="Delete uploads started more than this many hours ago (default 24)",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            deleted, _ = AttachmentUpload.objects.filter(
+                date_started__lt=timezone.now() - timedelta(hours=options["hours"])
+            ).delete()
+
+        self.stdout.write("Deleted {} attachment uploads.".format(deleted))
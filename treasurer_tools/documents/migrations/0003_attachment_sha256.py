@@ -0,0 +1,46 @@
+"""Migrations to add the SHA-256 digest of attachments."""
+import hashlib
+
+import documents.models
+from django.db import migrations, models
+
+
+def populate_attachment_sha256(apps, schema_editor):
+    """Calculates the digest of all existing attachment files."""
+    # pylint: disable=unused-argument
+    Attachment = apps.get_model('documents', 'Attachment')
+
+    for attachment in Attachment.objects.filter(sha256='').iterator():
+        digest = hashlib.sha256()
+
+        try:
+            with attachment.location.open('rb') as attachment_file:
+                for chunk in attachment_file.chunks():
+                    digest.update(chunk)
+        except (OSError, ValueError):
+            # Leave missing files without a digest
+            continue
+
+        Attachment.objects.filter(id=attachment.id).update(sha256=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+    """Migrations for the Attachment digest."""
+
+    dependencies = [
+        ('documents', '0002_alter_historicalbankstatementmatch_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='SHA-256 digest of the file content', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='location',
+            field=models.FileField(max_length=255, upload_to=documents.models.get_attachment_upload_to),
+        ),
+        migrations.RunPython(populate_attachment_sha256, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_attachment_uploads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Thumbnail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(help_text='SHA-256 digest of the attachment content', max_length=64, unique=True)),
+                ('location', models.FileField(max_length=255, upload_to='')),
+                ('size', models.PositiveIntegerField(help_text='The size of the thumbnail (in bytes)')),
+                ('date_accessed', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='When the thumbnail was last served')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+def mark_canonical_attachments(apps, schema_editor):
+    """Marks the oldest attachment of each digest to be reused.
+
+        Existing attachments with the same content are left as they
+        are; only the first one is reused by new uploads.
+    """
+    # pylint: disable=unused-argument
+    Attachment = apps.get_model('documents', 'Attachment')
+
+    canonical_ids = Attachment.objects.exclude(sha256='').values('sha256').annotate(
+        first_id=models.Min('id')
+    ).values_list('first_id', flat=True)
+
+    Attachment.objects.filter(id__in=list(canonical_ids)).update(canonical=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='canonical',
+            field=models.BooleanField(default=False, help_text='Whether new uploads with the same content reuse this attachment'),
+        ),
+        migrations.RunPython(mark_canonical_attachments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attachment',
+            constraint=models.UniqueConstraint(condition=models.Q(('canonical', True), models.Q(('sha256', ''), _negated=True)), fields=('sha256',), name='unique_canonical_attachment_sha256'),
+        ),
+    ]
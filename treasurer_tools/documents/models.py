@@ -1,7 +1,11 @@
 """Models for the documents app"""
+import hashlib
 import os
+import posixpath
+import uuid
 
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 
 from simple_history.models import HistoricalRecords
@@ -9,15 +13,94 @@ from simple_history.models import HistoricalRecords
 from bank_transactions.models import Statement
 from financial_transactions.models import FinancialTransaction
 
+def get_attachment_upload_to(instance, filename):
+    """Stores attachments in a folder named after their SHA-256 digest"""
+    if instance.sha256:
+        return posixpath.join("attachments", instance.sha256[:2], instance.sha256, filename)
+
+    return posixpath.join("attachments", filename)
+
+def get_file_sha256(file):
+    """Returns the SHA-256 digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+
+    for chunk in file.chunks():
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+class AttachmentQuerySet(models.QuerySet):
+    """Custom queryset for the Attachment model"""
+    def get_or_create_from_file(self, file, sha256=None):
+        """Returns the attachment with the file content, saving it if new
+
+            Uploads with the same content (by SHA-256 digest) share one
+            stored file. The digest is calculated unless provided.
+            Returns the attachment and whether it was created.
+
+            A reused attachment is locked until the transaction ends, so
+            the delete of its last match (which locks it too) either
+            sees the new reference or finishes before the lookup.
+        """
+        if sha256 is None:
+            sha256 = get_file_sha256(file)
+            file.seek(0)
+
+        attachment = self.select_for_update().filter(sha256=sha256, canonical=True).first()
+
+        if attachment:
+            return attachment, False
+
+        attachment = self.model(location=file, sha256=sha256, canonical=True)
+
+        try:
+            with transaction.atomic(using=self.db):
+                attachment.save(force_insert=True, using=self.db)
+        except IntegrityError:
+            # Another request saved the same content first
+            attachment.location.delete(save=False)
+
+            return self.select_for_update().get(sha256=sha256, canonical=True), False
+
+        return attachment, True
+
 class Attachment(models.Model):
-    """Holds an attachment"""
+    """Holds an attachment
+
+        Attachments are shared by every transaction and statement match
+        with the same file content and are deleted (with their file)
+        once the last match is removed.
+    """
     location = models.FileField(
-        upload_to="attachments",
+        upload_to=get_attachment_upload_to,
         max_length=255,
     )
+    sha256 = models.CharField(
+        blank=True,
+        db_index=True,
+        default="",
+        help_text="SHA-256 digest of the file content",
+        max_length=64,
+    )
     date_uploaded = models.DateTimeField(
         default=timezone.now,
     )
+    canonical = models.BooleanField(
+        default=False,
+        help_text="Whether new uploads with the same content reuse this attachment",
+    )
+
+    objects = AttachmentQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Attachments saved before deduplication may share a digest
+            models.UniqueConstraint(
+                fields=["sha256"],
+                condition=models.Q(canonical=True) & ~models.Q(sha256=""),
+                name="unique_canonical_attachment_sha256",
+            ),
+        ]
 
     def __str__(self):
         file_name = os.path.basename(self.location.name)
@@ -58,3 +141,80 @@ class FinancialTransactionMatch(models.Model):
 
     def __str__(self):
         return "{} - {}".format(self.transaction, self.attachment)
+
+class AttachmentUpload(models.Model):
+    """Holds a chunked attachment upload
+
+        Chunks are saved to storage as parts and combined into an
+        attachment once the whole file is received. The token is then
+        submitted with a transaction or statement form to match the
+        attachment.
+    """
+    token = models.UUIDField(
+        default=uuid.uuid4,
+        editable=False,
+        unique=True,
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    file_name = models.CharField(
+        help_text="The name of the uploaded file",
+        max_length=255,
+    )
+    file_size = models.PositiveBigIntegerField(
+        help_text="The size of the uploaded file (in bytes)",
+    )
+    bytes_received = models.PositiveBigIntegerField(
+        default=0,
+        help_text="The number of bytes saved to storage",
+    )
+    attachment = models.ForeignKey(
+        Attachment,
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+    )
+    date_started = models.DateTimeField(
+        default=timezone.now,
+    )
+
+    def __str__(self):
+        return "{} ({} of {} bytes)".format(self.file_name, self.bytes_received, self.file_size)
+
+    @property
+    def parts_folder(self):
+        """The storage folder of the uploaded parts"""
+        return posixpath.join("uploads", str(self.token))
+
+    @property
+    def complete(self):
+        """Whether the whole file was received"""
+        return self.attachment_id is not None
+
+class Thumbnail(models.Model):
+    """Holds a first page preview of attachment content
+
+        Thumbnails are keyed by the SHA-256 digest of the attachment
+        content and stored next to the attachment file.
+    """
+    sha256 = models.CharField(
+        help_text="SHA-256 digest of the attachment content",
+        max_length=64,
+        unique=True,
+    )
+    location = models.FileField(
+        max_length=255,
+    )
+    size = models.PositiveIntegerField(
+        help_text="The size of the thumbnail (in bytes)",
+    )
+    date_accessed = models.DateTimeField(
+        db_index=True,
+        default=timezone.now,
+        help_text="When the thumbnail was last served",
+    )
+
+    def __str__(self):
+        return self.location.name
@@ -1,5 +1,23 @@
 """Functions to handle upload of attachment files"""
+import atexit
+import concurrent.futures
+import concurrent.futures.process
+import io
+import multiprocessing
+import os
+import signal
+import threading
+
 import magic
+import pypdfium2
+from PIL import Image, ImageOps, ImageSequence
+from pypdf import PdfReader, PdfWriter, Transformation
+from pypdf.errors import PdfReadError
+from pypdf.generic import RectangleObject
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
 
 """Process Planning
 
@@ -15,6 +33,60 @@ import magic
     - Saves entire document as a new PDF
   - Treasurer can save a final version of the PDF
 """
+
+# Size (in points) of the normalized PDF pages
+PAGE_WIDTH, PAGE_HEIGHT = letter
+
+# Margin around converted images
+IMAGE_MARGIN = 10 * mm
+
+# Number of bytes read to detect the file type
+MIME_HEADER_SIZE = 2048
+
+# Maximum width and height of attachment thumbnails (in pixels)
+THUMBNAIL_SIZE = (240, 240)
+
+# Maximum number of conversion processes (shared by all requests)
+CONVERSION_MAX_WORKERS = 2
+
+# Seconds a single file may take to convert (from when its conversion starts)
+CONVERSION_TIMEOUT = 120
+
+# Seconds a worker waits for an interrupted task before stopping itself
+WORKER_STOP_GRACE = 10
+
+# Errors of pool tasks that never ran to completion (their pool broke)
+LOST_TASK_ERRORS = (
+    concurrent.futures.CancelledError, concurrent.futures.process.BrokenProcessPool,
+)
+
+CONVERSION_EXECUTOR = None
+CONVERSION_EXECUTOR_LOCK = threading.Lock()
+
+# Number of submitted conversion tasks that have not finished
+CONVERSION_TASK_COUNT = 0
+CONVERSION_TASK_LOCK = threading.Lock()
+
+
+class WorkerTimeoutError(Exception):
+    """Raised in a pool worker when a task runs past its deadline"""
+
+class ConvertedFile():
+    """The result of converting one attachment file
+
+        file holds the normalized PDF content on success; message
+        explains why the conversion failed.
+    """
+    def __init__(self, name, file=None, message=None):
+        self.name = name
+        self.file = file
+        self.message = message
+
+    @property
+    def success(self):
+        """Whether the file was converted to a PDF"""
+        return self.file is not None
+
 def invalid_file_type_message(file):
     """Generates an error message for an invalid file type"""
     return (
@@ -22,62 +94,394 @@ def invalid_file_type_message(file):
         "attachment".format(file)
     )
 
-def check_pypdf2_pdf(file):
-    """Checks if this is a workable pdf"""
-    return file
+def unreadable_file_message(name, file_type):
+    """Generates an error message for a file that could not be read"""
+    return (
+        "The attachment {} could not be read as a {} file. It may be "
+        "damaged or password protected".format(name, file_type)
+    )
+
+def fit_to_page(width, height, max_width, max_height):
+    """Returns the scale, x and y offsets to center a box on a page"""
+    scale = min(max_width / width, max_height / height)
+
+    return (
+        scale,
+        (PAGE_WIDTH - width * scale) / 2,
+        (PAGE_HEIGHT - height * scale) / 2,
+    )
+
+def check_pypdf_pdf(name, content):
+    """Checks if this is a workable PDF and normalizes its pages
+
+        Each page is scaled (keeping its aspect ratio) and centered on
+        a letter size page.
+    """
+    try:
+        reader = PdfReader(io.BytesIO(content))
+
+        if reader.is_encrypted and not reader.decrypt(""):
+            return ConvertedFile(name, message=unreadable_file_message(name, "PDF"))
 
-def convert_gif(file):
-    """Converts gif to workable PDF"""
-    return file
+        writer = PdfWriter(clone_from=reader)
 
-def convert_jpeg(file):
+        for page in writer.pages:
+            page.transfer_rotation_to_content()
+
+            # Move the visible area of the page to the origin and fit it to the page
+            left, bottom, right, top = [float(value) for value in page.cropbox]
+            scale, x_offset, y_offset = fit_to_page(
+                right - left, top - bottom, PAGE_WIDTH, PAGE_HEIGHT
+            )
+            page.add_transformation(
+                Transformation().translate(-left, -bottom).scale(scale).translate(x_offset, y_offset)
+            )
+            page.mediabox = RectangleObject([0, 0, PAGE_WIDTH, PAGE_HEIGHT])
+            page.cropbox = RectangleObject([0, 0, PAGE_WIDTH, PAGE_HEIGHT])
+
+        if not writer.pages:
+            return ConvertedFile(name, message=unreadable_file_message(name, "PDF"))
+
+        pdf_file = io.BytesIO()
+        writer.write(pdf_file)
+    except (PdfReadError, ValueError, KeyError, TypeError, ZeroDivisionError):
+        return ConvertedFile(name, message=unreadable_file_message(name, "PDF"))
+
+    return ConvertedFile(name, file=pdf_file.getvalue())
+
+def convert_image(name, content, file_type, all_frames=True):
+    """Converts an image to a workable PDF
+
+        Every frame becomes a page (e.g. multipage TIFF scans) unless
+        all_frames is False. Frames are rotated per their EXIF data and
+        scaled to fit within the page margins.
+    """
+    pdf_file = io.BytesIO()
+    pdf = canvas.Canvas(pdf_file, pagesize=letter, pageCompression=1)
+
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            for frame in ImageSequence.Iterator(image):
+                page_image = ImageOps.exif_transpose(frame).convert("RGB")
+                width, height = page_image.size
+                scale, x_offset, y_offset = fit_to_page(
+                    width,
+                    height,
+                    PAGE_WIDTH - 2 * IMAGE_MARGIN,
+                    PAGE_HEIGHT - 2 * IMAGE_MARGIN,
+                )
+
+                pdf.drawImage(
+                    ImageReader(page_image),
+                    x_offset,
+                    y_offset,
+                    width=width * scale,
+                    height=height * scale,
+                )
+                pdf.showPage()
+
+                if not all_frames:
+                    break
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return ConvertedFile(name, message=unreadable_file_message(name, file_type))
+
+    pdf.save()
+
+    return ConvertedFile(name, file=pdf_file.getvalue())
+
+def convert_gif(name, content):
+    """Converts gif to workable PDF (first frame only)"""
+    return convert_image(name, content, "GIF", all_frames=False)
+
+def convert_jpeg(name, content):
     """Converts jpeg to workable PDF"""
-    return file
+    return convert_image(name, content, "JPEG")
 
-def convert_png(file):
+def convert_png(name, content):
     """Converts png to workable PDF"""
-    return file
+    return convert_image(name, content, "PNG")
 
-def convert_tiff(file):
+def convert_tiff(name, content):
     """Converts tiff to workable PDF"""
-    return file
+    return convert_image(name, content, "TIFF")
+
+# Conversion functions for each supported MIME type
+CONVERSION_FUNCTIONS = {
+    "application/pdf": check_pypdf_pdf,
+    "image/gif": convert_gif,
+    "image/jpeg": convert_jpeg,
+    "image/png": convert_png,
+    "image/tiff": convert_tiff,
+}
+
+def convert_file(name, content):
+    """Sends a file to the proper conversion function"""
+    # Get filetype MIME
+    file_type = magic.from_buffer(content[:MIME_HEADER_SIZE], mime=True)
+
+    try:
+        conversion_function = CONVERSION_FUNCTIONS[file_type]
+    except KeyError:
+        return ConvertedFile(name, message=invalid_file_type_message(file_type))
+
+    return conversion_function(name, content)
+
+def get_conversion_workers():
+    """Returns the number of conversion processes"""
+    return min(CONVERSION_MAX_WORKERS, os.cpu_count() or 1)
+
+def get_conversion_executor():
+    """Returns the process pool used to convert files
+
+        The pool is created on first use and shared by all request
+        threads, which limits the number of concurrent conversions.
+        Workers are spawned so they do not inherit database
+        connections or threads.
+    """
+    global CONVERSION_EXECUTOR # pylint: disable=global-statement
+
+    with CONVERSION_EXECUTOR_LOCK:
+        if CONVERSION_EXECUTOR is None:
+            CONVERSION_EXECUTOR = concurrent.futures.ProcessPoolExecutor(
+                max_workers=get_conversion_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(CONVERSION_EXECUTOR.shutdown)
+
+        return CONVERSION_EXECUTOR
+
+def interrupt_task(signum, frame):
+    """Signal handler that interrupts a task past its deadline"""
+    # pylint: disable=unused-argument
+    raise WorkerTimeoutError("The task did not finish in time")
+
+def run_with_deadline(timeout, function, *args):
+    """Runs a task in a pool worker with a deadline from when it starts
+
+        The task is interrupted with a WorkerTimeoutError after timeout
+        seconds, which leaves the worker (and its pool) running. A task
+        that cannot be interrupted (e.g. stuck in a C library) stops its
+        own worker after a grace period; the pool then reports it is
+        broken and the tasks it held are submitted again.
+    """
+    previous_handler = signal.signal(signal.SIGALRM, interrupt_task)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    watchdog = threading.Timer(timeout + WORKER_STOP_GRACE, os._exit, args=(1,))
+    watchdog.daemon = True
+    watchdog.start()
 
-def convert_doc(file):
-    """Converts word document to workable PDF"""
-    return file
+    try:
+        return function(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        watchdog.cancel()
 
-def convert_odt(file):
-    """Converts speadsheet to workable PDF"""
-    return file
+def reset_conversion_executor(executor):
+    """Discards a broken process pool so the next use creates a new one"""
+    global CONVERSION_EXECUTOR # pylint: disable=global-statement
+
+    with CONVERSION_EXECUTOR_LOCK:
+        if CONVERSION_EXECUTOR is executor:
+            CONVERSION_EXECUTOR = None
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def finish_conversion_task(future):
+    """Stops counting a finished (or cancelled) conversion task"""
+    # pylint: disable=unused-argument
+    global CONVERSION_TASK_COUNT # pylint: disable=global-statement
+
+    with CONVERSION_TASK_LOCK:
+        CONVERSION_TASK_COUNT -= 1
+
+def submit_conversion(executor, function, *args):
+    """Submits a task to the conversion pool and counts it until it finishes"""
+    global CONVERSION_TASK_COUNT # pylint: disable=global-statement
+
+    future = executor.submit(run_with_deadline, CONVERSION_TIMEOUT, function, *args)
+
+    with CONVERSION_TASK_LOCK:
+        CONVERSION_TASK_COUNT += 1
+
+    future.add_done_callback(finish_conversion_task)
+
+    return future
+
+def is_conversion_pool_saturated():
+    """Whether every conversion process is busy (or has work queued)"""
+    return CONVERSION_TASK_COUNT >= get_conversion_workers()
+
+def is_completed(future):
+    """Whether a future finished with a result"""
+    return future.done() and not future.cancelled() and future.exception() is None
+
+def run_conversions(function, arguments_list):
+    """Runs a function for each set of arguments in the conversion pool
+
+        Returns a (result, error) tuple for each set of arguments (in
+        the same order); error is a WorkerTimeoutError for a task that
+        ran out of time or a LOST_TASK_ERRORS error for a task that
+        could not be run. Tasks lost when the shared pool broke (e.g.
+        a hung task of any request stopped its worker) are submitted
+        once more to a new pool.
+    """
+    outcomes = [None] * len(arguments_list)
+    pending = list(range(len(arguments_list)))
+
+    for _ in range(2):
+        executor = get_conversion_executor()
+        futures = {}
+
+        try:
+            for index in pending:
+                futures[index] = submit_conversion(executor, function, *arguments_list[index])
+        except (RuntimeError, concurrent.futures.process.BrokenProcessPool):
+            # The pool broke (or was discarded by another request) while submitting
+            reset_conversion_executor(executor)
+
+        lost = []
+
+        for index in pending:
+            try:
+                outcomes[index] = (futures[index].result(), None)
+            except WorkerTimeoutError as error:
+                outcomes[index] = (None, error)
+            except (KeyError,) + LOST_TASK_ERRORS:
+                reset_conversion_executor(executor)
+                outcomes[index] = (None, concurrent.futures.process.BrokenProcessPool())
+                lost.append(index)
+
+        pending = lost
+
+        if not pending:
+            break
+
+    return outcomes
 
 def organize_file_conversion(files):
-    """Method to sort file uploads into proper conversion functions"""
-    converted_files = []
-    user_messages = []
+    """Converts the files to PDFs in the conversion process pool
 
-    for file in files:
-        # Get filetype MIME
-        file_type = magic.from_file(file, mime=True)
+        files is a list of (name, content) tuples. Returns a
+        ConvertedFile for each file (in the same order). Each file
+        has CONVERSION_TIMEOUT seconds to convert once it starts.
+    """
+    converted_files = []
 
-        # Send file to proper conversion function
-        if file_type == "application/pdf":
-            converted_file = check_pypdf2_pdf(file)
-        elif file_type == "image/gif":
-            converted_file = convert_gif(file)
-        elif file_type == "image/jpeg":
-            converted_file = convert_jpeg(file)
-        elif file_type == "image/png":
-            converted_file = convert_png(file)
-        elif file_type == "image/tiff":
-            converted_file = convert_tiff(file)
-        elif file_type == "application/msword":
-            converted_file = convert_doc(file)
-        elif file_type == "application/vnd.oasis.opendocument.text":
-            converted_file = convert_odt(file)
+    for (name, _), (converted_file, error) in zip(files, run_conversions(convert_file, files)):
+        if isinstance(error, WorkerTimeoutError):
+            converted_files.append(ConvertedFile(
+                name, message="The attachment {} took too long to convert".format(name)
+            ))
+        elif error:
+            converted_files.append(ConvertedFile(
+                name, message="The attachment {} could not be converted".format(name)
+            ))
         else:
-            user_messages.append(invalid_file_type_message(file))
+            converted_files.append(converted_file)
+
+    return converted_files
+
+def generate_issue_page(user_messages):
+    """Generates a PDF page listing the files that could not be converted"""
+    pdf_file = io.BytesIO()
+    pdf = canvas.Canvas(pdf_file, pagesize=letter)
 
+    text = pdf.beginText(20 * mm, PAGE_HEIGHT - 25 * mm)
+    text.setFont("Helvetica-Bold", 12)
+    text.textLine("Attachments that could not be converted")
+    text.setFont("Helvetica", 10)
+    text.moveCursor(0, 5 * mm)
+
+    for message in user_messages:
+        text.textLine("- {}".format(message))
+
+    pdf.drawText(text)
+    pdf.showPage()
+    pdf.save()
+
+    return pdf_file.getvalue()
+
+def merge_converted_files(converted_files):
+    """Merges the converted files into a single PDF for review
+
+        Returns the PDF content and the messages of any files that
+        could not be converted (which are also listed on a final page).
+    """
+    writer = PdfWriter()
+    user_messages = []
+
+    for converted_file in converted_files:
         if converted_file.success:
-            converted_files.append(converted_file.file)
+            writer.append(io.BytesIO(converted_file.file))
         else:
             user_messages.append(converted_file.message)
+
+    if user_messages:
+        writer.append(io.BytesIO(generate_issue_page(user_messages)))
+
+    pdf_file = io.BytesIO()
+    writer.write(pdf_file)
+
+    return pdf_file.getvalue(), user_messages
+
+def create_review_pdf(attachments):
+    """Converts and merges attachments into a single PDF for review"""
+    files = []
+
+    for attachment in attachments:
+        with attachment.location.open("rb") as attachment_file:
+            files.append((os.path.basename(attachment.location.name), attachment_file.read()))
+
+    return merge_converted_files(organize_file_conversion(files))
+
+def create_thumbnail(content):
+    """Returns a JPEG thumbnail of the first page of an image or PDF
+
+        Returns None for unsupported or unreadable files.
+    """
+    file_type = magic.from_buffer(content[:MIME_HEADER_SIZE], mime=True)
+
+    try:
+        if file_type == "application/pdf":
+            pdf = pypdfium2.PdfDocument(content)
+
+            try:
+                page = pdf[0]
+                scale = max(THUMBNAIL_SIZE) / max(page.get_size())
+                image = page.render(scale=scale).to_pil()
+            finally:
+                pdf.close()
+        elif file_type in CONVERSION_FUNCTIONS:
+            image = Image.open(io.BytesIO(content))
+            image.draft("RGB", THUMBNAIL_SIZE)
+            image = ImageOps.exif_transpose(image)
+        else:
+            return None
+
+        image.thumbnail(THUMBNAIL_SIZE)
+
+        # Flatten any transparency onto a white background
+        if image.mode != "RGB":
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+
+        thumbnail_file = io.BytesIO()
+        image.save(thumbnail_file, format="JPEG", quality=80)
+    except (pypdfium2.PdfiumError, IndexError, OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    return thumbnail_file.getvalue()
+
+def render_thumbnail(content):
+    """Creates a thumbnail in the conversion process pool (or None)
+
+        A thumbnail that times out or cannot be run (even after its
+        pool is replaced) is None; the shared pool keeps running.
+    """
+    [(thumbnail, _)] = run_conversions(create_thumbnail, [(content,)])
+
+    return thumbnail
@@ -0,0 +1,70 @@
+"""Signals to delete attachments (and their thumbnails) once they are no longer referenced"""
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import (
+    Attachment, AttachmentUpload, BankStatementMatch, FinancialTransactionMatch, Thumbnail,
+)
+from .utils import delete_upload_parts
+
+
+def delete_unreferenced_attachment(attachment_id):
+    """Deletes an attachment if no transaction, statement or upload references it
+
+        The attachment is locked before the references are checked, so
+        an upload reusing it (see get_or_create_from_file) either adds
+        its reference first or creates a new attachment after.
+    """
+    if Attachment.objects.select_for_update().filter(id=attachment_id).first() is None:
+        return
+
+    Attachment.objects.filter(
+        id=attachment_id,
+        financialtransactionmatch__isnull=True,
+        bankstatementmatch__isnull=True,
+        attachmentupload__isnull=True,
+    ).delete()
+
+@receiver(post_delete, sender=FinancialTransactionMatch)
+@receiver(post_delete, sender=BankStatementMatch)
+def remove_attachment_reference(sender, instance, **kwargs):
+    """Deletes the attachment after its last match is deleted"""
+    # pylint: disable=unused-argument
+    delete_unreferenced_attachment(instance.attachment_id)
+
+@receiver(post_delete, sender=AttachmentUpload)
+def remove_upload(sender, instance, **kwargs):
+    """Deletes the parts and any unmatched attachment of an upload"""
+    # pylint: disable=unused-argument
+    if instance.attachment_id:
+        delete_unreferenced_attachment(instance.attachment_id)
+
+    parts_folder = instance.parts_folder
+    transaction.on_commit(lambda: delete_upload_parts(parts_folder))
+
+@receiver(post_delete, sender=Attachment)
+def delete_attachment_file(sender, instance, **kwargs):
+    """Deletes the stored file once the deletion is committed"""
+    # pylint: disable=unused-argument
+    if instance.location:
+        storage = instance.location.storage
+        name = instance.location.name
+
+        transaction.on_commit(lambda: storage.delete(name))
+
+@receiver(post_delete, sender=Attachment)
+def delete_attachment_thumbnail(sender, instance, **kwargs):
+    """Deletes the thumbnail once no attachment has the same content"""
+    # pylint: disable=unused-argument
+    if instance.sha256 and not Attachment.objects.filter(sha256=instance.sha256).exists():
+        Thumbnail.objects.filter(sha256=instance.sha256).delete()
+
+@receiver(post_delete, sender=Thumbnail)
+def delete_thumbnail_file(sender, instance, **kwargs):
+    """Deletes the stored thumbnail once the deletion is committed"""
+    # pylint: disable=unused-argument
+    storage = instance.location.storage
+    name = instance.location.name
+
+    transaction.on_commit(lambda: storage.delete(name))
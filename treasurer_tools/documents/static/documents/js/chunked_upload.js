@@ -0,0 +1,99 @@
+// Number of times a chunk is retried before the upload fails
+const CHUNK_RETRIES = 3;
+
+function getCSRF() {
+  return $('[name=csrfmiddlewaretoken]').val();
+}
+
+function addUploadToken($tokenInput, token) {
+  const tokens = $tokenInput.val() ? $tokenInput.val().split(',') : [];
+
+  tokens.push(token);
+  $tokenInput.val(tokens.join(','));
+}
+
+async function requestJSON(url, options) {
+  const response = await fetch(url, { credentials: 'same-origin', ...options });
+  const data = await response.json();
+
+  return { status: response.status, data };
+}
+
+async function uploadFile(uploadURL, file, $status) {
+  // Start the upload
+  let { status, data } = await requestJSON(uploadURL, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'X-CSRFToken': getCSRF() },
+    body: JSON.stringify({ file_name: file.name, file_size: file.size }),
+  });
+
+  if (status !== 201) {
+    throw new Error(data.errors.join(' '));
+  }
+
+  const chunkURL = `${uploadURL}${data.token}/`;
+  let retries = 0;
+
+  // Send each chunk (resuming from the server offset after any failure)
+  while (!data.complete) {
+    const offset = data.offset;
+
+    try {
+      ({ status, data } = await requestJSON(chunkURL, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          'Upload-Offset': offset,
+          'X-CSRFToken': getCSRF(),
+        },
+        body: file.slice(offset, offset + data.chunk_size),
+      }));
+    } catch (error) {
+      status = 0;
+    }
+
+    if (status === 400) {
+      throw new Error(data.errors.join(' '));
+    }
+
+    if (status !== 200) {
+      retries += 1;
+
+      if (retries > CHUNK_RETRIES) {
+        throw new Error(`${file.name} could not be uploaded.`);
+      }
+
+      ({ data } = await requestJSON(chunkURL, { method: 'GET' }));
+    } else {
+      retries = 0;
+      $status.text(`${file.name} (${Math.round((100 * data.offset) / file.size)}%)`);
+    }
+  }
+
+  return data.token;
+}
+
+$(document).ready(() => {
+  const $dropZone = $('#attachment-drop-zone');
+  const $fileInput = $dropZone.find('input[type=file]');
+  const $tokenInput = $dropZone.closest('fieldset').find('input[name$=tokens]');
+  const $uploads = $('<ul id="attachment-uploads"></ul>').insertAfter($dropZone);
+
+  // Upload selected files in chunks and submit only their tokens
+  $fileInput.on('change', () => {
+    const files = Array.from($fileInput[0].files);
+
+    $fileInput.val('');
+
+    files.forEach(async (file) => {
+      const $status = $('<li></li>').text(`${file.name} (0%)`).appendTo($uploads);
+
+      try {
+        addUploadToken($tokenInput, await uploadFile($dropZone.data('upload-url'), file, $status));
+        $status.text(`${file.name} (uploaded)`);
+      } catch (error) {
+        $status.text(error.message).addClass('error');
+      }
+    });
+  });
+});
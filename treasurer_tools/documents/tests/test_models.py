@@ -1,11 +1,20 @@
 """Test cases for the documents app"""
 
+import hashlib
+import importlib
+import posixpath
 import tempfile
+from unittest import mock
 from unipath import Path
 
-from django.test import TestCase
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
 
-from documents.models import Attachment, BankStatementMatch, FinancialTransactionMatch
+from documents.models import (
+    Attachment, AttachmentQuerySet, BankStatementMatch, FinancialTransactionMatch,
+)
 
 from .utils import create_bank_statement, create_financial_transactions
 
@@ -85,3 +94,133 @@ class FinancialTransactionMatchTest(TestCase):
             str(match),
             "{} - {}".format(transactions[0], attachment)
         )
+
+class AttachmentDeduplicationTest(TestCase):
+    """Tests for the content-hash deduplication of attachments"""
+
+    def setUp(self):
+        # Use a new media_root folder for the attachments
+        media_settings = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def test_same_content_reuses_attachment(self):
+        """Checks files with the same content share one stored file"""
+        attachment, created = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"receipt", name="receipt.pdf")
+        )
+        duplicate, duplicate_created = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"receipt", name="copy.pdf")
+        )
+
+        self.assertTrue(created)
+        self.assertFalse(duplicate_created)
+        self.assertEqual(attachment, duplicate)
+        self.assertEqual(attachment.sha256, hashlib.sha256(b"receipt").hexdigest())
+        self.assertEqual(
+            attachment.location.name,
+            "attachments/{}/{}/receipt.pdf".format(attachment.sha256[:2], attachment.sha256)
+        )
+
+    def test_concurrent_upload_reuses_attachment(self):
+        """Checks an upload that loses a race reuses the saved attachment"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"receipt", name="receipt.pdf")
+        )
+
+        # Miss the attachment on the lookup, as if it was saved just after
+        with mock.patch.object(AttachmentQuerySet, "first", return_value=None):
+            duplicate, created = Attachment.objects.get_or_create_from_file(
+                ContentFile(b"receipt", name="copy.pdf")
+            )
+
+        self.assertFalse(created)
+        self.assertEqual(attachment, duplicate)
+        self.assertEqual(
+            default_storage.listdir(posixpath.dirname(attachment.location.name))[1],
+            ["receipt.pdf"]
+        )
+
+    def test_reuse_and_delete_lock_attachment(self):
+        """Checks reusing and deleting an attachment lock the same row"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"receipt", name="receipt.pdf")
+        )
+        match = BankStatementMatch.objects.create(
+            statement=create_bank_statement(), attachment=attachment
+        )
+        locked_ids = []
+
+        def select_for_update(queryset):
+            locked_ids.extend(queryset.filter().values_list("id", flat=True))
+
+            return queryset
+
+        with mock.patch.object(
+            AttachmentQuerySet, "select_for_update", autospec=True, side_effect=select_for_update
+        ):
+            Attachment.objects.get_or_create_from_file(
+                ContentFile(b"receipt", name="copy.pdf")
+            )
+            match.delete()
+
+        self.assertEqual(locked_ids, [attachment.id, attachment.id])
+        self.assertFalse(Attachment.objects.filter(id=attachment.id).exists())
+
+    def test_migration_marks_oldest_duplicate(self):
+        """Checks existing duplicates are kept and the oldest is reused"""
+        migration = importlib.import_module("documents.migrations.0006_attachment_canonical")
+        sha256 = hashlib.sha256(b"receipt").hexdigest()
+        attachments = [
+            Attachment.objects.create(location="attachments/{}.pdf".format(name), sha256=sha256)
+            for name in ["first", "second"]
+        ]
+
+        migration.mark_canonical_attachments(apps, None)
+
+        self.assertEqual(
+            list(Attachment.objects.order_by("id").values_list("id", "canonical")),
+            [(attachments[0].id, True), (attachments[1].id, False)]
+        )
+        self.assertEqual(
+            Attachment.objects.get_or_create_from_file(ContentFile(b"receipt", name="new.pdf")),
+            (attachments[0], False)
+        )
+
+    def test_different_content_creates_attachment(self):
+        """Checks files with different content are stored separately"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"receipt", name="receipt.pdf")
+        )
+        other_attachment, created = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"invoice", name="receipt.pdf")
+        )
+
+        self.assertTrue(created)
+        self.assertNotEqual(attachment, other_attachment)
+
+    def test_attachment_deleted_with_last_reference(self):
+        """Checks the attachment and file remain until the last match is deleted"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"receipt", name="receipt.pdf")
+        )
+        name = attachment.location.name
+
+        statement_match = BankStatementMatch.objects.create(
+            statement=create_bank_statement(), attachment=attachment
+        )
+        transaction_match = FinancialTransactionMatch.objects.create(
+            transaction=create_financial_transactions()[0], attachment=attachment
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            statement_match.delete()
+
+        self.assertTrue(Attachment.objects.filter(id=attachment.id).exists())
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transaction_match.transaction.delete()
+
+        self.assertFalse(Attachment.objects.filter(id=attachment.id).exists())
+        self.assertFalse(default_storage.exists(name))
@@ -0,0 +1,206 @@
+"""Test cases for the documents conversion services"""
+import concurrent.futures
+import io
+import os
+import threading
+import time
+from unittest import mock
+
+from PIL import Image
+from pypdf import PdfReader
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfgen import canvas
+
+from django.test import SimpleTestCase
+
+from documents.services import (
+    CONVERSION_MAX_WORKERS, LOST_TASK_ERRORS, PAGE_HEIGHT, PAGE_WIDTH, ConvertedFile,
+    WorkerTimeoutError, convert_file, get_conversion_executor, merge_converted_files,
+    organize_file_conversion, render_thumbnail, run_conversions, submit_conversion,
+)
+
+
+def create_image(image_format, frames=1, size=(400, 200)):
+    """Returns the content of an image with the requested frames"""
+    images = [Image.new("RGB", size, colour) for colour in ["red", "green", "blue"][:frames]]
+    image_file = io.BytesIO()
+    images[0].save(image_file, format=image_format, save_all=frames > 1, append_images=images[1:])
+
+    return image_file.getvalue()
+
+def create_pdf(pages=1, pagesize=A4):
+    """Returns the content of a PDF with the requested pages"""
+    pdf_file = io.BytesIO()
+    pdf = canvas.Canvas(pdf_file, pagesize=pagesize)
+
+    for page_number in range(pages):
+        pdf.drawString(100, 100, "Page {}".format(page_number + 1))
+        pdf.showPage()
+
+    pdf.save()
+
+    return pdf_file.getvalue()
+
+def get_page_sizes(content):
+    """Returns the (width, height) of each page of a PDF"""
+    return [
+        (float(page.mediabox.width), float(page.mediabox.height))
+        for page in PdfReader(io.BytesIO(content)).pages
+    ]
+
+
+class ConvertFileTest(SimpleTestCase):
+    """Tests for converting single files to normalized PDFs"""
+
+    def test_images_convert_to_letter_pages(self):
+        """Checks JPEG, PNG and GIF images convert to one letter page"""
+        for image_format in ["JPEG", "PNG", "GIF"]:
+            converted_file = convert_file("receipt", create_image(image_format))
+
+            self.assertTrue(converted_file.success)
+            self.assertEqual(
+                get_page_sizes(converted_file.file), [(PAGE_WIDTH, PAGE_HEIGHT)]
+            )
+
+    def test_multipage_tiff_converts_each_frame(self):
+        """Checks each frame of a TIFF scan becomes a page"""
+        converted_file = convert_file("scan.tiff", create_image("TIFF", frames=3))
+
+        self.assertTrue(converted_file.success)
+        self.assertEqual(len(get_page_sizes(converted_file.file)), 3)
+
+    def test_pdf_pages_are_normalized(self):
+        """Checks PDF pages are fit to letter pages"""
+        converted_file = convert_file("invoice.pdf", create_pdf(2, landscape(A4)))
+
+        self.assertTrue(converted_file.success)
+        self.assertEqual(
+            get_page_sizes(converted_file.file), [(PAGE_WIDTH, PAGE_HEIGHT)] * 2
+        )
+
+    def test_unsupported_file_type_fails(self):
+        """Checks unsupported files report a message"""
+        converted_file = convert_file("notes.txt", b"Some plain text notes")
+
+        self.assertFalse(converted_file.success)
+        self.assertEqual(
+            converted_file.message,
+            "The provided attachment is a text/plain file. Please provide a supported attachment"
+        )
+
+    def test_damaged_files_fail(self):
+        """Checks files that cannot be read report a message"""
+        for name, content in [
+                ("invoice.pdf", b"%PDF-1.4\nnot really a pdf"),
+                ("receipt.png", create_image("PNG")[:100]),
+        ]:
+            converted_file = convert_file(name, content)
+
+            self.assertFalse(converted_file.success)
+            self.assertIn("could not be read", converted_file.message)
+
+
+class OrganizeFileConversionTest(SimpleTestCase):
+    """Tests for converting and merging many files"""
+
+    def test_files_convert_in_order(self):
+        """Checks each file reports its own result in the original order"""
+        converted_files = organize_file_conversion([
+            ("invoice.pdf", create_pdf(2)),
+            ("notes.txt", b"Some plain text notes"),
+            ("receipt.jpg", create_image("JPEG")),
+        ])
+
+        self.assertEqual(
+            [converted_file.name for converted_file in converted_files],
+            ["invoice.pdf", "notes.txt", "receipt.jpg"]
+        )
+        self.assertEqual(
+            [converted_file.success for converted_file in converted_files],
+            [True, False, True]
+        )
+
+    def test_queued_files_do_not_time_out(self):
+        """Checks the timeout only counts from when a conversion starts"""
+        executor = get_conversion_executor()
+
+        with mock.patch("documents.services.CONVERSION_TIMEOUT", 3):
+            # Occupy every worker for most of the timeout
+            for _ in range(CONVERSION_MAX_WORKERS):
+                submit_conversion(executor, time.sleep, 2.5)
+
+            converted_files = organize_file_conversion([
+                ("receipt.png", create_image("PNG")),
+                ("invoice.pdf", create_pdf()),
+            ])
+
+        self.assertTrue(all(converted_file.success for converted_file in converted_files))
+
+    def test_timeout_interrupts_only_the_hung_task(self):
+        """Checks a timed out task is stopped without replacing the shared pool"""
+        executor = get_conversion_executor()
+
+        with mock.patch("documents.services.CONVERSION_TIMEOUT", 1):
+            outcomes = run_conversions(time.sleep, [(60,), (0,)])
+
+        self.assertIsInstance(outcomes[0][1], WorkerTimeoutError)
+        self.assertEqual(outcomes[1], (None, None))
+        self.assertIs(get_conversion_executor(), executor)
+        self.assertTrue(organize_file_conversion([("invoice.pdf", create_pdf())])[0].success)
+
+    def test_lost_tasks_are_resubmitted(self):
+        """Checks tasks lost when another task breaks the pool are run again"""
+        outcomes = []
+        sleeper = threading.Thread(
+            target=lambda: outcomes.extend(run_conversions(time.sleep, [(1,)]))
+        )
+        sleeper.start()
+        time.sleep(0.5)
+
+        # A worker that exits breaks the pool for every task it holds
+        crashed = run_conversions(os._exit, [(1,)])
+        sleeper.join()
+
+        self.assertIsInstance(crashed[0][1], LOST_TASK_ERRORS)
+        self.assertEqual(outcomes, [(None, None)])
+
+    def test_merge_adds_issue_page(self):
+        """Checks failed files are listed on a final page"""
+        pdf_content, user_messages = merge_converted_files([
+            ConvertedFile("invoice.pdf", file=create_pdf(2)),
+            ConvertedFile("notes.txt", message="Unsupported file"),
+        ])
+
+        reader = PdfReader(io.BytesIO(pdf_content))
+
+        self.assertEqual(user_messages, ["Unsupported file"])
+        self.assertEqual(len(reader.pages), 3)
+        self.assertIn("Unsupported file", reader.pages[2].extract_text())
+
+
+class RenderThumbnailTest(SimpleTestCase):
+    """Tests for creating thumbnails in the conversion pool"""
+
+    def test_thumbnail_is_created(self):
+        """Checks an image is rendered to a JPEG thumbnail"""
+        thumbnail = render_thumbnail(create_image("PNG", size=(800, 400)))
+
+        with Image.open(io.BytesIO(thumbnail)) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (240, 120))
+
+    def test_cancelled_thumbnail_is_resubmitted(self):
+        """Checks a thumbnail cancelled with a broken pool is retried and then skipped"""
+        def submit_cancelled(*args):
+            # pylint: disable=unused-argument
+            future = concurrent.futures.Future()
+            future.cancel()
+
+            return future
+
+        with mock.patch(
+            "documents.services.submit_conversion", side_effect=submit_cancelled
+        ) as mock_submit:
+            self.assertIsNone(render_thumbnail(create_image("PNG")))
+
+        self.assertEqual(mock_submit.call_count, 2)
@@ -0,0 +1,366 @@
+"""Test cases for the documents app views"""
+import io
+import tempfile
+from unittest import mock
+
+from PIL import Image
+from reportlab.pdfgen import canvas
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from bank_transactions.models import Statement
+from documents.models import Attachment, AttachmentUpload, BankStatementMatch, Thumbnail
+from documents.utils import get_upload_part_names
+from documents.views import attachment_thumbnail
+
+from .utils import create_bank_account
+
+
+def create_user():
+    """Creates and returns a regular user"""
+    user = get_user_model().objects.create(username="user", email="user@email.com")
+    user.set_password("abcd123456")
+    user.save()
+
+    return user
+
+def create_pdf_content():
+    """Returns the content of a small PDF"""
+    pdf_file = io.BytesIO()
+    pdf = canvas.Canvas(pdf_file)
+    pdf.drawString(100, 100, "Receipt")
+    pdf.showPage()
+    pdf.save()
+
+    return pdf_file.getvalue()
+
+def create_image_content(colour="blue"):
+    """Returns the content of a PNG image"""
+    image_file = io.BytesIO()
+    Image.new("RGB", (800, 400), colour).save(image_file, format="PNG")
+
+    return image_file.getvalue()
+
+
+class AttachmentUploadTest(TestCase):
+    """Tests for the chunked attachment upload views"""
+
+    def setUp(self):
+        # Use a new media_root folder for the uploads
+        media_settings = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = create_user()
+        self.content = create_pdf_content()
+        self.start_url = reverse("documents:upload_start")
+
+        self.client.login(username="user", password="abcd123456")
+
+    def start_upload(self, file_name="receipt.pdf", file_size=None):
+        """Starts an upload and returns the response"""
+        return self.client.post(
+            self.start_url,
+            {"file_name": file_name, "file_size": file_size or len(self.content)},
+            content_type="application/json",
+        )
+
+    def send_chunk(self, token, offset, chunk):
+        """Sends a chunk of an upload and returns the response"""
+        return self.client.post(
+            reverse("documents:upload_chunk", kwargs={"token": token}),
+            chunk,
+            content_type="application/octet-stream",
+            headers={"Upload-Offset": str(offset)},
+        )
+
+    def upload(self, content):
+        """Uploads the content in two chunks and returns the upload"""
+        self.content = content
+        token = self.start_upload().json()["token"]
+        middle = len(content) // 2
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.send_chunk(token, 0, content[:middle])
+            self.send_chunk(token, middle, content[middle:])
+
+        return AttachmentUpload.objects.get(token=token)
+
+    def test_upload_redirect_if_not_logged_in(self):
+        """Checks user is redirected if not logged in"""
+        self.client.logout()
+        response = self.start_upload()
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_start_upload(self):
+        """Checks an upload returns a token to send chunks"""
+        response = self.start_upload()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["offset"], 0)
+        self.assertFalse(response.json()["complete"])
+        self.assertTrue(
+            AttachmentUpload.objects.filter(token=response.json()["token"], user=self.user).exists()
+        )
+
+    def test_start_upload_rejects_large_files(self):
+        """Checks files over 10 MB are rejected"""
+        response = self.start_upload(file_size=1024 * 1024 * 10 + 1)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AttachmentUpload.objects.exists())
+
+    def test_chunks_create_attachment(self):
+        """Checks the chunks are combined into an attachment"""
+        upload = self.upload(self.content)
+
+        self.assertTrue(upload.complete)
+        self.assertEqual(upload.bytes_received, len(self.content))
+        self.assertEqual(upload.attachment.location.read(), self.content)
+        self.assertEqual(get_upload_part_names(upload.parts_folder), [])
+
+    def test_duplicate_upload_reuses_attachment(self):
+        """Checks uploading the same content reuses the attachment"""
+        upload = self.upload(self.content)
+        duplicate_upload = self.upload(self.content)
+
+        self.assertEqual(upload.attachment, duplicate_upload.attachment)
+        self.assertEqual(Attachment.objects.count(), 1)
+
+    def test_wrong_offset_returns_current_offset(self):
+        """Checks an out of order chunk returns the offset to resume from"""
+        token = self.start_upload().json()["token"]
+        self.send_chunk(token, 0, self.content[:100])
+
+        response = self.send_chunk(token, 0, self.content[:100])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["offset"], 100)
+
+        response = self.client.get(reverse("documents:upload_chunk", kwargs={"token": token}))
+
+        self.assertEqual(response.json()["offset"], 100)
+
+    def test_invalid_file_type_is_rejected(self):
+        """Checks the file type is validated on the first chunk"""
+        token = self.start_upload(file_name="notes.txt").json()["token"]
+
+        response = self.send_chunk(token, 0, b"Some plain text notes")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("text/plain", response.json()["errors"][0])
+        self.assertFalse(AttachmentUpload.objects.filter(token=token).exists())
+
+    def test_upload_of_other_user_is_not_found(self):
+        """Checks users cannot send chunks to another user's upload"""
+        token = self.start_upload().json()["token"]
+
+        other_user = get_user_model().objects.create(username="other", email="other@email.com")
+        self.client.force_login(other_user)
+
+        response = self.send_chunk(token, 0, self.content)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_statement_add_with_upload_token(self):
+        """Checks a statement form matches the uploaded attachment"""
+        upload = self.upload(self.content)
+
+        self.client.post(
+            reverse("bank_transactions:add"),
+            {
+                "account": create_bank_account().id,
+                "date_start": "2017-01-01",
+                "date_end": "2017-01-31",
+                "banktransaction_set-TOTAL_FORMS": 0,
+                "banktransaction_set-INITIAL_FORMS": 0,
+                "banktransaction_set-MIN_NUM_FORMS": 0,
+                "banktransaction_set-MAX_NUM_FORMS": 1000,
+                "tokens": str(upload.token),
+            },
+        )
+
+        self.assertTrue(BankStatementMatch.objects.filter(
+            statement=Statement.objects.get(), attachment=upload.attachment
+        ).exists())
+        self.assertFalse(AttachmentUpload.objects.exists())
+        self.assertTrue(Attachment.objects.filter(id=upload.attachment_id).exists())
+
+    def test_upload_token_of_other_user_is_rejected(self):
+        """Checks users cannot submit another user's upload token"""
+        upload = self.upload(self.content)
+
+        other_user = get_user_model().objects.create(username="other", email="other@email.com")
+        self.client.force_login(other_user)
+
+        response = self.client.post(
+            reverse("bank_transactions:add"),
+            {
+                "account": create_bank_account().id,
+                "date_start": "2017-01-01",
+                "date_end": "2017-01-31",
+                "banktransaction_set-TOTAL_FORMS": 0,
+                "banktransaction_set-INITIAL_FORMS": 0,
+                "banktransaction_set-MIN_NUM_FORMS": 0,
+                "banktransaction_set-MAX_NUM_FORMS": 1000,
+                "tokens": str(upload.token),
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Statement.objects.exists())
+        self.assertFalse(BankStatementMatch.objects.exists())
+        self.assertTrue(AttachmentUpload.objects.filter(id=upload.id).exists())
+
+    def test_clean_command_deletes_old_uploads(self):
+        """Checks abandoned uploads and their attachments are deleted"""
+        upload = self.upload(self.content)
+        name = upload.attachment.location.name
+        AttachmentUpload.objects.update(date_started="2017-01-01T00:00Z")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("clean_attachment_uploads", stdout=io.StringIO())
+
+        self.assertFalse(AttachmentUpload.objects.exists())
+        self.assertFalse(Attachment.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+
+class AttachmentThumbnailTest(TestCase):
+    """Tests for the attachment thumbnail view"""
+
+    def setUp(self):
+        # Use a new media_root folder for the attachments and thumbnails
+        media_settings = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        create_user()
+
+        self.client.login(username="user", password="abcd123456")
+
+    def get_thumbnail(self, attachment, **kwargs):
+        """Requests the thumbnail of an attachment"""
+        return self.client.get(
+            reverse("documents:thumbnail", kwargs={"sha256": attachment.sha256}), **kwargs
+        )
+
+    def test_thumbnail_redirect_if_not_logged_in(self):
+        """Checks user is redirected if not logged in"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(create_image_content(), name="receipt.png")
+        )
+        self.client.logout()
+
+        self.assertEqual(self.get_thumbnail(attachment).status_code, 302)
+
+    def test_thumbnails_are_created_and_cached(self):
+        """Checks image and PDF thumbnails are stored next to the attachment"""
+        for name, content in [
+                ("receipt.png", create_image_content()),
+                ("receipt.pdf", create_pdf_content()),
+        ]:
+            attachment, _ = Attachment.objects.get_or_create_from_file(
+                ContentFile(content, name=name)
+            )
+
+            response = self.get_thumbnail(attachment)
+            thumbnail = Thumbnail.objects.get(sha256=attachment.sha256)
+            image = Image.open(io.BytesIO(b"".join(response.streaming_content)))
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "image/jpeg")
+            self.assertIn("max-age=31536000", response["Cache-Control"])
+            self.assertIn("immutable", response["Cache-Control"])
+            self.assertLessEqual(max(image.size), 240)
+            self.assertEqual(
+                thumbnail.location.name,
+                "{}/{}.thumbnail.jpg".format(attachment.location.name.rsplit("/", 1)[0], attachment.sha256)
+            )
+
+    def test_thumbnail_not_modified(self):
+        """Checks a cached thumbnail returns a 304"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(create_image_content(), name="receipt.png")
+        )
+
+        response = self.get_thumbnail(attachment)
+        response = self.get_thumbnail(attachment, headers={"If-None-Match": response["ETag"]})
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_thumbnail_unavailable(self):
+        """Checks unknown content and unsupported files return a 404"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(b"Some plain text notes", name="notes.txt")
+        )
+
+        self.assertEqual(self.get_thumbnail(attachment).status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse("documents:thumbnail", kwargs={"sha256": "a" * 64})).status_code,
+            404
+        )
+
+    def test_placeholder_while_conversions_are_busy(self):
+        """Checks a busy conversion pool returns an uncached placeholder"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(create_image_content(), name="receipt.png")
+        )
+
+        with mock.patch("documents.services.is_conversion_pool_saturated", return_value=True):
+            response = self.get_thumbnail(attachment)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertNotIn("ETag", response)
+        self.assertFalse(Thumbnail.objects.exists())
+
+        # The thumbnail is created once the pool is free
+        self.assertEqual(self.get_thumbnail(attachment)["Content-Type"], "image/jpeg")
+
+    def test_thumbnail_view_is_not_atomic(self):
+        """Checks no request transaction is held while a thumbnail renders"""
+        self.assertIn("default", attachment_thumbnail._non_atomic_requests) # pylint: disable=protected-access
+
+    def test_least_recently_accessed_thumbnails_are_evicted(self):
+        """Checks thumbnails over the size cap are evicted oldest first"""
+        attachments = [
+            Attachment.objects.get_or_create_from_file(
+                ContentFile(create_image_content(colour), name="{}.png".format(colour))
+            )[0]
+            for colour in ["red", "green", "blue"]
+        ]
+
+        self.get_thumbnail(attachments[0])
+        self.get_thumbnail(attachments[1])
+        Thumbnail.objects.filter(sha256=attachments[0].sha256).update(date_accessed="2017-01-01T00:00Z")
+
+        cache_size = sum(Thumbnail.objects.values_list("size", flat=True))
+
+        with mock.patch("documents.utils.THUMBNAIL_CACHE_MAX_SIZE", cache_size):
+            self.get_thumbnail(attachments[2])
+
+        self.assertEqual(
+            set(Thumbnail.objects.values_list("sha256", flat=True)),
+            {attachments[1].sha256, attachments[2].sha256}
+        )
+
+    def test_thumbnail_deleted_with_attachment(self):
+        """Checks the thumbnail is removed with its attachment"""
+        attachment, _ = Attachment.objects.get_or_create_from_file(
+            ContentFile(create_image_content(), name="receipt.png")
+        )
+        self.get_thumbnail(attachment)
+        name = Thumbnail.objects.get().location.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            attachment.delete()
+
+        self.assertFalse(Thumbnail.objects.exists())
+        self.assertFalse(default_storage.exists(name))
@@ -0,0 +1,12 @@
+"""Documents URLs"""
+from django.urls import path, re_path
+
+from .views import attachment_thumbnail, upload_start, upload_chunk
+
+app_name = "documents"
+
+urlpatterns = [
+    path('uploads/', upload_start, name="upload_start"),
+    path('uploads/<uuid:token>/', upload_chunk, name="upload_chunk"),
+    re_path(r'^thumbnails/(?P<sha256>[0-9a-f]{64})/$', attachment_thumbnail, name="thumbnail"),
+]
@@ -0,0 +1,230 @@
+"""Functions to support chunked attachment uploads and thumbnails"""
+import hashlib
+import io
+import posixpath
+from datetime import timedelta
+
+import magic
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Attachment, Thumbnail
+
+
+# Maximum size of an attachment (in bytes)
+MAX_ATTACHMENT_SIZE = 1024 * 1024 * 10
+
+# Maximum size of each uploaded chunk (in bytes)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Number of bytes read to detect the file type
+MIME_HEADER_SIZE = 2048
+
+# File types accepted as attachments
+ATTACHMENT_MIME_TYPES = [
+    "application/pdf",
+    "image/gif",
+    "image/jpeg",
+    "image/png",
+    "image/tiff",
+]
+
+# Maximum total size of the stored thumbnails (in bytes)
+THUMBNAIL_CACHE_MAX_SIZE = 1024 * 1024 * 100
+
+# Minimum time between updates of a thumbnail's access date
+THUMBNAIL_ACCESS_INTERVAL = timedelta(hours=1)
+
+
+class ThumbnailBusyError(Exception):
+    """Raised when a thumbnail cannot be created while the conversion processes are busy"""
+
+def invalid_upload_type_message(file_name, file_type):
+    """Generates an error message for an invalid upload file type"""
+    return (
+        "The attachment {} is a {} file. Please provide a PDF or image "
+        "attachment".format(file_name, file_type)
+    )
+
+def get_chunk_mime_type(chunk):
+    """Returns the MIME type detected from the start of a file"""
+    return magic.from_buffer(chunk[:MIME_HEADER_SIZE], mime=True)
+
+def get_upload_part_name(upload, offset):
+    """Returns the storage name of the part starting at offset"""
+    return posixpath.join(upload.parts_folder, "{:012d}.part".format(offset))
+
+def get_upload_part_names(parts_folder):
+    """Returns the storage names of the uploaded parts (in order)"""
+    try:
+        file_names = default_storage.listdir(parts_folder)[1]
+    except FileNotFoundError:
+        return []
+
+    return [posixpath.join(parts_folder, file_name) for file_name in sorted(file_names)]
+
+def delete_upload_parts(parts_folder):
+    """Deletes the uploaded parts of an upload"""
+    for name in get_upload_part_names(parts_folder):
+        default_storage.delete(name)
+
+def save_upload_part(upload, offset, chunk):
+    """Saves an uploaded chunk to storage"""
+    name = get_upload_part_name(upload, offset)
+
+    # Replace any part left by an interrupted request
+    if default_storage.exists(name):
+        default_storage.delete(name)
+
+    default_storage.save(name, ContentFile(chunk))
+
+class UploadPartsReader(io.RawIOBase):
+    """Reads the stored parts of an upload as a single file"""
+    def __init__(self, part_names):
+        super(UploadPartsReader, self).__init__()
+        self.part_names = iter(part_names)
+        self.part_file = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self.part_file is None:
+                name = next(self.part_names, None)
+
+                if name is None:
+                    return 0
+
+                self.part_file = default_storage.open(name, "rb")
+
+            data = self.part_file.read(len(buffer))
+
+            if data:
+                buffer[:len(data)] = data
+
+                return len(data)
+
+            self.part_file.close()
+            self.part_file = None
+
+    def close(self):
+        if self.part_file is not None:
+            self.part_file.close()
+            self.part_file = None
+
+        super(UploadPartsReader, self).close()
+
+def complete_upload(upload):
+    """Combines the parts of a received upload into an attachment
+
+        The digest is calculated from the stored parts first, so the
+        parts are only copied to a new attachment when the content has
+        not been uploaded before.
+    """
+    part_names = get_upload_part_names(upload.parts_folder)
+    digest = hashlib.sha256()
+
+    with io.BufferedReader(UploadPartsReader(part_names)) as reader:
+        for chunk in iter(lambda: reader.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    with io.BufferedReader(UploadPartsReader(part_names)) as reader:
+        upload_file = File(reader, name=upload.file_name)
+        upload_file.size = upload.file_size
+
+        upload.attachment, _ = Attachment.objects.get_or_create_from_file(
+            upload_file, sha256=digest.hexdigest()
+        )
+
+    upload.save(update_fields=["attachment"])
+
+    # Remove the parts once the attachment is saved
+    parts_folder = upload.parts_folder
+    transaction.on_commit(lambda: delete_upload_parts(parts_folder))
+
+def get_thumbnail_name(attachment):
+    """Returns the storage name of a thumbnail (next to its attachment)"""
+    return posixpath.join(
+        posixpath.dirname(attachment.location.name),
+        "{}.thumbnail.jpg".format(attachment.sha256),
+    )
+
+def evict_thumbnails():
+    """Deletes the least recently accessed thumbnails over the size cap"""
+    total = Thumbnail.objects.aggregate(total=Sum("size"))["total"] or 0
+
+    if total <= THUMBNAIL_CACHE_MAX_SIZE:
+        return
+
+    evicted_ids = []
+
+    for thumbnail_id, size in Thumbnail.objects.order_by(
+            "date_accessed", "id"
+    ).values_list("id", "size").iterator():
+        if total <= THUMBNAIL_CACHE_MAX_SIZE:
+            break
+
+        evicted_ids.append(thumbnail_id)
+        total -= size
+
+    Thumbnail.objects.filter(id__in=evicted_ids).delete()
+
+def get_or_create_thumbnail(sha256):
+    """Returns the thumbnail of attachment content
+
+        The thumbnail is created on the first request and its access
+        date is updated (at most hourly) on later requests. Returns
+        None if there is no attachment or no preview can be made.
+        Raises ThumbnailBusyError rather than waiting for a busy
+        conversion process.
+    """
+    now = timezone.now()
+    thumbnail = Thumbnail.objects.filter(sha256=sha256).first()
+
+    if thumbnail:
+        if thumbnail.date_accessed < now - THUMBNAIL_ACCESS_INTERVAL:
+            Thumbnail.objects.filter(id=thumbnail.id).update(date_accessed=now)
+
+        return thumbnail
+
+    attachment = Attachment.objects.filter(sha256=sha256).order_by("id").first()
+
+    if attachment is None:
+        return None
+
+    # Import the conversion libraries only when a thumbnail is created
+    # pylint: disable=import-outside-toplevel
+    from .services import is_conversion_pool_saturated, render_thumbnail
+
+    if is_conversion_pool_saturated():
+        raise ThumbnailBusyError()
+
+    try:
+        with attachment.location.open("rb") as attachment_file:
+            thumbnail_content = render_thumbnail(attachment_file.read())
+    except OSError:
+        return None
+
+    if thumbnail_content is None:
+        return None
+
+    name = default_storage.save(get_thumbnail_name(attachment), ContentFile(thumbnail_content))
+
+    thumbnail, created = Thumbnail.objects.get_or_create(
+        sha256=sha256,
+        defaults={"location": name, "size": len(thumbnail_content), "date_accessed": now},
+    )
+
+    if created:
+        evict_thumbnails()
+    else:
+        # Another request created the thumbnail first
+        default_storage.delete(name)
+
+    return thumbnail
@@ -0,0 +1,163 @@
+"""Views for the documents app"""
+import json
+import os
+
+from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse,
+)
+from django.shortcuts import get_object_or_404
+from django.utils.cache import (
+    add_never_cache_headers, get_conditional_response, patch_cache_control,
+)
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET, require_POST
+
+from .models import AttachmentUpload
+from .utils import (
+    ATTACHMENT_MIME_TYPES, MAX_ATTACHMENT_SIZE, UPLOAD_CHUNK_SIZE, ThumbnailBusyError,
+    complete_upload, get_chunk_mime_type, get_or_create_thumbnail, invalid_upload_type_message,
+    save_upload_part,
+)
+
+# Seconds browsers may cache a thumbnail (content never changes for a digest)
+THUMBNAIL_MAX_AGE = 60 * 60 * 24 * 365
+
+# Image returned (and not cached) while the conversion processes are busy
+THUMBNAIL_PLACEHOLDER = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="240" height="240">'
+    b'<rect width="240" height="240" fill="#eeeeee"/></svg>'
+)
+
+
+def return_upload_as_json(upload):
+    """Returns the progress of an upload"""
+    return {
+        "token": str(upload.token),
+        "offset": upload.bytes_received,
+        "complete": upload.complete,
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+    }
+
+@login_required
+@require_POST
+def upload_start(request):
+    """Starts a chunked attachment upload
+
+        Expects a JSON body with the file_name and file_size. Returns
+        the upload token used to send chunks and submit the attachment
+        with a transaction or statement form.
+    """
+    try:
+        request_data = json.loads(request.body)
+        file_name = os.path.basename(str(request_data["file_name"]))[:255]
+        file_size = int(request_data["file_size"])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"errors": ["Invalid data submitted to server."]}, status=400)
+
+    if not file_name:
+        return JsonResponse({"errors": ["Attachments must have a file name."]}, status=400)
+
+    if file_size <= 0 or file_size > MAX_ATTACHMENT_SIZE:
+        return JsonResponse(
+            {"errors": ["Attachments must be between 1 byte and 10 MB."]}, status=400
+        )
+
+    upload = AttachmentUpload.objects.create(
+        user=request.user,
+        file_name=file_name,
+        file_size=file_size,
+    )
+
+    return JsonResponse(return_upload_as_json(upload), status=201)
+
+@login_required
+def upload_chunk(request, token):
+    """Returns the progress of an upload or saves its next chunk
+
+        A POST body holds the chunk starting at the Upload-Offset
+        header. Offsets that do not match the bytes received return a
+        409 with the current offset, so interrupted uploads can resume.
+        The file type is checked on the first chunk.
+    """
+    upload = get_object_or_404(
+        AttachmentUpload.objects.select_for_update(), token=token, user=request.user
+    )
+
+    if request.method == "GET":
+        return JsonResponse(return_upload_as_json(upload))
+
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["GET", "POST"])
+
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return JsonResponse({"errors": ["Provide the Upload-Offset of the chunk."]}, status=400)
+
+    if upload.complete or offset != upload.bytes_received:
+        return JsonResponse(return_upload_as_json(upload), status=409)
+
+    chunk = request.read(UPLOAD_CHUNK_SIZE + 1)
+
+    if not chunk or len(chunk) > UPLOAD_CHUNK_SIZE or offset + len(chunk) > upload.file_size:
+        return JsonResponse(
+            {"errors": ["Chunks must not be empty or exceed the chunk or file size."]}, status=400
+        )
+
+    # Reject unsupported files before any content is stored
+    if offset == 0:
+        file_type = get_chunk_mime_type(chunk)
+
+        if file_type not in ATTACHMENT_MIME_TYPES:
+            upload.delete()
+
+            return JsonResponse(
+                {"errors": [invalid_upload_type_message(upload.file_name, file_type)]}, status=400
+            )
+
+    save_upload_part(upload, offset, chunk)
+
+    upload.bytes_received += len(chunk)
+    upload.save(update_fields=["bytes_received"])
+
+    if upload.bytes_received == upload.file_size:
+        complete_upload(upload)
+
+    return JsonResponse(return_upload_as_json(upload))
+
+@login_required
+@require_GET
+@transaction.non_atomic_requests
+def attachment_thumbnail(request, sha256):
+    """Returns the first page preview of an attachment
+
+        Thumbnails are created on the first request. They are keyed by
+        the content digest, so browsers may cache them indefinitely.
+        While the conversion processes are busy, an uncached
+        placeholder is returned instead. The view runs outside the
+        request transaction, so no transaction is held while a
+        thumbnail renders.
+    """
+    etag = quote_etag(sha256)
+    response = get_conditional_response(request, etag=etag)
+
+    if response is None:
+        try:
+            thumbnail = get_or_create_thumbnail(sha256)
+        except ThumbnailBusyError:
+            response = HttpResponse(THUMBNAIL_PLACEHOLDER, content_type="image/svg+xml")
+            add_never_cache_headers(response)
+
+            return response
+
+        if thumbnail is None:
+            raise Http404("No preview is available for this attachment.")
+
+        response = FileResponse(thumbnail.location.open("rb"), content_type="image/jpeg")
+
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, max_age=THUMBNAIL_MAX_AGE, immutable=True)
+
+    return response
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class FinancialCodesConfig(AppConfig):
     """Configuration for the financial_codes app"""
     name = 'financial_codes'
+
+    def ready(self):
+        """Registers the financial code choice cache signals"""
+        # pylint: disable=import-outside-toplevel, unused-import
+        from financial_codes import signals
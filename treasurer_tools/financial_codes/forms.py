@@ -158,6 +158,12 @@ class FinancialCodeForm(forms.ModelForm):
         # Add the budget year choices
         self.fields["budget_year"].choices = get_years_with_opt_groups()
 
+        # Provide the budget year IDs for the financial code group options
+        self.fields["financial_code_group"].widget.year_ids = {
+            str(group_id): year_id for group_id, year_id
+            in FinancialCodeGroup.objects.values_list("id", "budget_year_id")
+        }
+
         # Set the proper default budget year (if applicable)
         if self.instance.id:
             self.fields["budget_year"].initial = self.instance.financial_code_group.budget_year.id
@@ -0,0 +1,20 @@
+"""Signals to invalidate the cached financial code choices"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FinancialCodeSystem, BudgetYear, FinancialCodeGroup, FinancialCode
+from .utils import clear_financial_code_choices
+
+
+@receiver(post_save, sender=FinancialCodeSystem)
+@receiver(post_delete, sender=FinancialCodeSystem)
+@receiver(post_save, sender=BudgetYear)
+@receiver(post_delete, sender=BudgetYear)
+@receiver(post_save, sender=FinancialCodeGroup)
+@receiver(post_delete, sender=FinancialCodeGroup)
+@receiver(post_save, sender=FinancialCode)
+@receiver(post_delete, sender=FinancialCode)
+def invalidate_financial_code_choices(sender, **kwargs):
+    """Clears the cached choices when any financial code data changes"""
+    # pylint: disable=unused-argument
+    clear_financial_code_choices()
@@ -0,0 +1,71 @@
+"""Test cases for the financial codes app utility functions"""
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from financial_codes.models import FinancialCode
+from financial_codes.utils import get_financial_code_choices
+
+from .utils import create_financial_codes
+
+
+class GetFinancialCodeChoicesTest(TestCase):
+    """Tests for the cached financial code choices"""
+
+    def setUp(self):
+        self.codes = create_financial_codes()
+        self.system = self.codes[0].financial_code_group.budget_year.financial_code_system
+
+    def test_choices_content(self):
+        """Tests that the choices are grouped by financial code group"""
+        code = self.codes[0]
+        year = code.financial_code_group.budget_year
+        choices = get_financial_code_choices(self.system, "e")
+
+        self.assertEqual(choices["budget_years"], [(year.id, str(year))])
+        self.assertEqual(
+            choices["financial_codes"],
+            [("", "---------"), [code.financial_code_group.title, [(code.id, str(code))]]]
+        )
+        self.assertEqual(choices["code_years"], {code.id: year.id})
+
+    def test_system_id_and_instance_match(self):
+        """Tests that a system ID or instance returns the same choices"""
+        self.assertEqual(
+            get_financial_code_choices(self.system, "r"),
+            get_financial_code_choices(self.system.id, "r"),
+        )
+
+    def test_choices_cached(self):
+        """Tests that the choices are only built once"""
+        get_financial_code_choices(self.system, "e")
+
+        with CaptureQueriesContext(connection) as queries:
+            get_financial_code_choices(self.system, "e")
+
+        self.assertEqual(len(queries), 0)
+
+    def test_cache_invalidated_on_save(self):
+        """Tests that adding a new code clears the cached choices"""
+        get_financial_code_choices(self.system, "e")
+
+        new_code = FinancialCode.objects.create(
+            financial_code_group=self.codes[0].financial_code_group,
+            code="1001",
+            description="Conference Grant",
+        )
+
+        choices = get_financial_code_choices(self.system, "e")
+
+        self.assertIn((new_code.id, str(new_code)), choices["financial_codes"][1][1])
+
+    def test_cache_invalidated_on_delete(self):
+        """Tests that deleting a code clears the cached choices"""
+        get_financial_code_choices(self.system, "e")
+
+        self.codes[0].delete()
+
+        choices = get_financial_code_choices(self.system, "e")
+
+        self.assertEqual(choices["financial_codes"], [("", "---------")])
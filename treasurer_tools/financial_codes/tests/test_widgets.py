@@ -49,3 +49,9 @@ class FinancialCodeGroupWithYearIDTest(TestCase):
             str(self.form["financial_code_group"]),
             select_html
         )
+
+    def test_render_queries(self):
+        """Checks that the budget years do not need a query per option"""
+        # Only the financial code group choices should be queried
+        with self.assertNumQueries(1):
+            str(self.form["financial_code_group"])
@@ -0,0 +1,101 @@
+"""Objects and functions supporting the financial_codes app"""
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import BudgetYear
+
+
+FINANCIAL_CODE_CHOICES_VERSION_KEY = "financial_code_choices_version"
+FINANCIAL_CODE_CHOICES_KEY = "financial_code_choices:{}:{}:{}"
+FINANCIAL_CODE_CHOICES_TIMEOUT = 60 * 60 * 24
+
+def build_financial_code_choices(system_id, transaction_type):
+    """Builds the budget year and financial code choices for a system
+
+        All budget years, groups and codes are retrieved in a single
+        query. Returns a dictionary with the budget year choices, the
+        grouped financial code choices, and a map of each code ID to
+        its budget year ID.
+    """
+    rows = BudgetYear.objects.filter(financial_code_system__id=system_id).values(
+        "id",
+        "date_start",
+        "date_end",
+        "financialcodegroup__id",
+        "financialcodegroup__title",
+        "financialcodegroup__type",
+        "financialcodegroup__financialcode__id",
+        "financialcodegroup__financialcode__code",
+        "financialcodegroup__financialcode__description",
+    ).order_by(
+        "-date_start", "id", "financialcodegroup__id", "financialcodegroup__financialcode__code"
+    )
+
+    budget_year_choices = []
+    groups = {}
+    code_years = {}
+
+    for row in rows:
+        # Add each budget year once
+        if not budget_year_choices or budget_year_choices[-1][0] != row["id"]:
+            budget_year_choices.append(
+                (row["id"], "{} to {}".format(row["date_start"], row["date_end"]))
+            )
+
+        # Only include codes for the requested transaction type
+        code_id = row["financialcodegroup__financialcode__id"]
+
+        if row["financialcodegroup__type"] != transaction_type or code_id is None:
+            continue
+
+        group = groups.setdefault(
+            row["financialcodegroup__id"], [row["financialcodegroup__title"], []]
+        )
+        group[1].append((
+            code_id,
+            "{} - {}".format(
+                row["financialcodegroup__financialcode__code"],
+                row["financialcodegroup__financialcode__description"],
+            ),
+        ))
+        code_years[code_id] = row["id"]
+
+    # Sort the groups by the first code in each group
+    sorted_groups_and_codes = sorted(groups.values(), key=lambda x: x[1][0][1])
+
+    return {
+        "budget_years": budget_year_choices,
+        "financial_codes": [("", "---------")] + sorted_groups_and_codes,
+        "code_years": code_years,
+    }
+
+def get_financial_code_choices(system, transaction_type):
+    """Returns the (cached) financial code choices for a system"""
+    system_id = getattr(system, "id", system)
+
+    version = cache.get(FINANCIAL_CODE_CHOICES_VERSION_KEY, "")
+    key = FINANCIAL_CODE_CHOICES_KEY.format(version, system_id, transaction_type)
+
+    choices = cache.get(key)
+
+    if choices is None:
+        choices = build_financial_code_choices(system_id, transaction_type)
+        cache.set(key, choices, FINANCIAL_CODE_CHOICES_TIMEOUT)
+
+    return choices
+
+def reset_financial_code_choices_version():
+    """Changes the cache version so all cached choices are rebuilt"""
+    cache.set(FINANCIAL_CODE_CHOICES_VERSION_KEY, uuid.uuid4().hex, None)
+
+def clear_financial_code_choices():
+    """Invalidates all cached financial code choices
+
+        The cache is cleared immediately and again once the transaction
+        commits, so that choices cached from uncommitted data by another
+        request are not kept.
+    """
+    reset_financial_code_choices_version()
+    transaction.on_commit(reset_financial_code_choices_version)
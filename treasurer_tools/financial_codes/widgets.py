@@ -1,10 +1,18 @@
 """Custom widgets for the Financial Codes app"""
 from django.forms.widgets import Select
 
-from .models import FinancialCodeGroup
-
 class FinancialCodeGroupWithYearID(Select):
-    """Select widget that allows data-attribute addition to options"""
+    """Select widget that allows data-attribute addition to options
+
+        The budget year IDs are taken from the year_ids dictionary
+        (financial code group ID to budget year ID), which is supplied
+        by the form when the choices are built.
+    """
+    def __init__(self, attrs=None, choices=(), year_ids=None):
+        super(FinancialCodeGroupWithYearID, self).__init__(attrs, choices)
+
+        self.year_ids = year_ids or {}
+
     # pylint: disable=too-many-arguments
     def create_option(self, name, value, label, selected, index, subindex=None, attrs=None):
         """Modifies function to include the budget year ID"""
@@ -12,11 +20,10 @@ class FinancialCodeGroupWithYearID(Select):
             name, value, label, selected, index, subindex, attrs
         )
 
-        # Use the option value (i.e. the model ID) to retrieve budget year ID
+        # Use the option value (i.e. the model ID) to look up budget year ID
         if option["value"]:
-            # Coerce value into a string to allow lookup to pass
-            option_id = str(option["value"])
-            year_id = FinancialCodeGroup.objects.get(id=option_id).budget_year.id
+            # Coerce value into a string to match the dictionary keys
+            year_id = self.year_ids.get(str(option["value"]), "")
         else:
             year_id = ""
 
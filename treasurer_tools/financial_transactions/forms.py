@@ -1,15 +1,18 @@
 """Forms for the financial_codes app"""
 
 from django import forms
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
 from django.forms import inlineformset_factory, ValidationError
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from custom_multiupload.widgets import MultiFileField
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
 
-from financial_codes.models import FinancialCodeSystem, BudgetYear, FinancialCode
+from financial_codes.models import FinancialCodeSystem
+from financial_codes.utils import get_financial_code_choices
+from documents.forms import AttachmentTokenField, AttachmentTokenFormMixin
 from documents.models import Attachment, FinancialTransactionMatch
+from reports.utils import refresh_financial_code_totals
 
 from .models import FinancialTransaction, Item, FinancialCodeMatch
 from .widgets import FinancialCodeWithYearID
@@ -37,38 +40,63 @@ class CompiledForms(object):
             self.system = kwargs.pop("financial_code_system", None)
             self.form = kwargs.pop("financial_code_form", None)
 
+    def get_financial_code_systems(self, date):
+        """Returns the financial code systems encompassing the provided date
+
+            Systems are loaded once per CompiledForms and the result is
+            cached for each date.
+        """
+        try:
+            date = FinancialCodeSystem._meta.get_field("date_start").to_python(date)
+        except ValidationError:
+            date = None
+
+        if date is None:
+            return []
+
+        if date not in self.financial_code_systems_by_date:
+            self.financial_code_systems_by_date[date] = [
+                system for system in self.financial_code_systems
+                if system.date_start <= date and (system.date_end is None or system.date_end >= date)
+            ]
+
+        return self.financial_code_systems_by_date[date]
+
+    def load_financial_code_matches(self, transaction_id):
+        """Retrieves all financial code matches for the transaction items
+
+            Matches are keyed by item and financial code system ID
+            (keeping the first match for each system).
+        """
+        match_instances = FinancialCodeMatch.objects.filter(
+            item__transaction_id=transaction_id
+        ).select_related(
+            "financial_code__financial_code_group__budget_year"
+        ).order_by("id")
+
+        for match in match_instances:
+            budget_year = match.financial_code.financial_code_group.budget_year
+
+            self.financial_code_matches.setdefault(
+                (match.item_id, budget_year.financial_code_system_id), match
+            )
+
     def __set_financial_code_data(self, item_id, system_id, prefix):
         """Adds financial code data to the POST data to populate form"""
         if self.request_type == "GET":
+            data = None
+
             # If item ID, this is the initial edit form generation
             if item_id:
-                # Retrieve all financial code match entries for this item ID
-                try:
-                    match_instances = FinancialCodeMatch.objects.filter(item=Item.objects.get(id=item_id))
-                except ObjectDoesNotExist:
-                    match_instances = []
-                    data = None
-
-                # Cycle through each match instance
-                for match in match_instances:
-                    data = None
-
-                    # Get the budget year for this match instance
-                    budget_year = match.financial_code.financial_code_group.budget_year
-
-                    # Update data to the match instance matching provided ID
-                    if budget_year.financial_code_system.id == system_id:
-                        data = {
-                            "{}-financial_code_match_id".format(prefix): match.id,
-                            "{}-budget_year".format(prefix): budget_year.id,
-                            "{}-code".format(prefix): match.financial_code.id,
-                        }
-
-                        break
-
-            # No item ID = initial add form generation
-            else:
-                data = None
+                # Get the match instance for this item and system
+                match = self.financial_code_matches.get((item_id, system_id))
+
+                if match:
+                    data = {
+                        "{}-financial_code_match_id".format(prefix): match.id,
+                        "{}-budget_year".format(prefix): match.financial_code.financial_code_group.budget_year_id,
+                        "{}-code".format(prefix): match.financial_code_id,
+                    }
         elif self.request_type == "POST":
             # POST request - use POST data
             data = self.data
@@ -81,13 +109,7 @@ class CompiledForms(object):
         transaction_date = kwargs.pop("transaction_date", timezone.now())
 
         # Find all the systems encompassing the provided date
-        try:
-            financial_code_systems = FinancialCodeSystem.objects.filter(
-                Q(date_start__lte=transaction_date),
-                (Q(date_end=None) | Q(date_end__gte=transaction_date))
-            )
-        except ValidationError:
-            financial_code_systems = []
+        financial_code_systems = self.get_financial_code_systems(transaction_date)
 
         # Create a FinancialCodeAssignmentForm for each system
         financial_code_forms = []
@@ -142,6 +164,7 @@ class CompiledForms(object):
             compiled_forms.new_attachment_form = NewAttachmentForm(
                 self.data,
                 self.files,
+                user=self.user,
             )
 
             # Add attachment formset
@@ -165,6 +188,7 @@ class CompiledForms(object):
             compiled_forms.new_attachment_form = NewAttachmentForm(
                 self.data,
                 self.files,
+                user=self.user,
             )
 
             # Add attachment formset
@@ -207,6 +231,9 @@ class CompiledForms(object):
             # Create item formset with Transaction instance
             compiled_forms.item_formset = ItemFormSet(instance=transaction_instance)
 
+            # Retrieve the financial code matches for all items
+            self.load_financial_code_matches(transaction_instance.id)
+
             # Add attachment form
             compiled_forms.new_attachment_form = NewAttachmentForm()
 
@@ -266,10 +293,7 @@ class CompiledForms(object):
         date_item = timezone.now()
 
         # Find all the systems encompassing the provided date
-        financial_code_systems = FinancialCodeSystem.objects.filter(
-            Q(date_start__lte=date_item),
-            (Q(date_end=None) | Q(date_end__gte=date_item))
-        )
+        financial_code_systems = self.get_financial_code_systems(date_item)
 
         # Create a FinancialCodeAssignmentForm for each system
         financial_code_forms = []
@@ -340,64 +364,127 @@ class CompiledForms(object):
         return valid
 
     def save(self):
-        """Saves all item formsets and financial code matches"""
-        # Save the transaction form
-        transaction_instance = self.forms.transaction_form.save()
-
-        # Update the transaction_instance with the proper type
-        transaction_instance.transaction_type = self.transaction_type
-        transaction_instance.save()
+        """Saves all item formsets and financial code matches
+
+            Untouched forms are skipped; new, edited and deleted items
+            and code matches are each saved with a single bulk query
+            (plus their history records).
+        """
+        # Save the transaction form with the proper type
+        transaction_form = self.forms.transaction_form
+        transaction_instance = transaction_form.save(commit=False)
+
+        if (
+                transaction_instance.pk is None or transaction_form.has_changed()
+                or transaction_instance.transaction_type != self.transaction_type
+        ):
+            transaction_instance.transaction_type = self.transaction_type
+            transaction_instance.save()
+
+        # Retrieve all existing code matches in one query
+        existing_matches = FinancialCodeMatch.objects.in_bulk([
+            financial_code_form.form.cleaned_data["financial_code_match_id"]
+            for item_formset_group in self.forms.item_formsets
+            for financial_code_form in item_formset_group.financial_code_forms
+            if financial_code_form.form.cleaned_data["financial_code_match_id"]
+        ])
+
+        new_items = []
+        changed_items = []
+        deleted_item_ids = []
+        new_matches = []
+        changed_matches = []
+        totals_keys = set()
+        date_submitted = transaction_instance.date_submitted
 
         # Cycle through each item formset
         for item_formset_group in self.forms.item_formsets:
-            # Delete any item formset marked for deletion
-            if item_formset_group.item_formset.cleaned_data["DELETE"]:
-                item_formset_group.item_formset.cleaned_data["id"].delete()
-            else:
-                # Create the item instance
-                saved_item = item_formset_group.item_formset.save(commit=False)
+            item_form = item_formset_group.item_formset
+
+            # Collect any item formset marked for deletion
+            if item_form.cleaned_data["DELETE"]:
+                if item_form.instance.pk:
+                    deleted_item_ids.append(item_form.instance.pk)
+
+                continue
+
+            # Create the item instance
+            item = item_form.save(commit=False)
+            item.transaction = transaction_instance
 
-                # Set transaction ID for item item instance
-                saved_item.transaction = transaction_instance
+            # Totals change with any new or edited item
+            item_changed = item.pk is None or item_form.has_changed()
 
-                # Save the item formset
-                saved_item.save()
+            if item.pk is None:
+                new_items.append(item)
+            elif item_changed:
+                changed_items.append(item)
 
-                # Get new item ID
-                item_id = saved_item.id
+            # Cycle through each financial code form
+            for financial_code_form in item_formset_group.financial_code_forms:
+                # Get any ID for an exisiting match ID
+                match_id = financial_code_form.form.cleaned_data["financial_code_match_id"]
+                code_id = int(financial_code_form.form.cleaned_data["code"])
+                match_changed = False
+
+                # If a match ID is present, get the original object
+                if match_id:
+                    match = existing_matches.get(match_id)
+
+                    if match is None:
+                        raise Http404("No FinancialCodeMatch matches the given query.")
+
+                    if match.financial_code_id != code_id:
+                        totals_keys.add((match.financial_code_id, date_submitted))
+                        match.financial_code_id = code_id
+                        changed_matches.append(match)
+                        match_changed = True
+                # No match ID - create new instance
+                else:
+                    new_matches.append(FinancialCodeMatch(item=item, financial_code_id=code_id))
+                    match_changed = True
+
+                if item_changed or match_changed:
+                    totals_keys.add((code_id, date_submitted))
+
+        # Deletions send signals to record history and update the totals
+        if deleted_item_ids:
+            Item.objects.filter(id__in=deleted_item_ids).delete()
 
-                # Cycle through each financial code form
-                for financial_code_form in item_formset_group.financial_code_forms:
-                    # Get any ID for an exisiting match ID
-                    match_id = financial_code_form.form.cleaned_data["financial_code_match_id"]
+        if new_items:
+            bulk_create_with_history(new_items, Item)
 
-                    # If a match ID is present, get the original object
-                    if match_id:
-                        match = get_object_or_404(FinancialCodeMatch, id=match_id)
-                    # No match ID - create new instance
-                    else:
-                        match = FinancialCodeMatch()
+        if changed_items:
+            bulk_update_with_history(changed_items, Item, ItemForm._meta.fields)
 
-                    # Update match instance data and save
-                    match.item = Item.objects.get(id=item_id)
-                    match.financial_code = FinancialCode.objects.get(
-                        id=financial_code_form.form.cleaned_data["code"]
-                    )
-                    match.save()
+        if new_matches:
+            bulk_create_with_history(new_matches, FinancialCodeMatch)
+
+        if changed_matches:
+            bulk_update_with_history(changed_matches, FinancialCodeMatch, ["financial_code"])
+
+        # Bulk saved items and matches do not send signals
+        if totals_keys:
+            refresh_financial_code_totals(totals_keys)
 
         # Save attachment form
         for file in self.forms.new_attachment_form.cleaned_data["attachment_files"]:
-            # Save the file to an attachment instance
-            attachment_instance = Attachment.objects.create(
-                location=file
-            )
+            # Save the file to an attachment instance (or reuse a matching one)
+            attachment_instance, _ = Attachment.objects.get_or_create_from_file(file)
 
             # Create record in attachment matching model
-            attachment_match = FinancialTransactionMatch(
+            FinancialTransactionMatch.objects.get_or_create(
                 transaction=transaction_instance,
                 attachment=attachment_instance,
             )
-            attachment_match.save()
+
+        # Match the attachments uploaded in chunks
+        for upload in self.forms.new_attachment_form.cleaned_data["attachment_tokens"]:
+            FinancialTransactionMatch.objects.get_or_create(
+                transaction=transaction_instance,
+                attachment=upload.attachment,
+            )
+            upload.delete()
 
         # Delete any old attachments
         for attachment_form in self.forms.old_attachment_formset:
@@ -420,7 +507,7 @@ class CompiledForms(object):
         # Cycle through each financial code system to generate the css
         system_details = []
 
-        for system in FinancialCodeSystem.objects.all():
+        for system in self.financial_code_systems:
             # Add the widths
             width_add.extend(("2fr", "2fr"))
             width_edit.extend(("2fr", "2fr"))
@@ -454,11 +541,15 @@ class CompiledForms(object):
             "system_details": system_details,
         }
 
-    def __init__(self, transaction_type="EXPENSE", request_type="GET", data=None, files=None, **kwargs):
+    def __init__(self, transaction_type="EXPENSE", request_type="GET", data=None, files=None, user=None, **kwargs):
         self.transaction_type = "e" if transaction_type.upper() == "EXPENSE" else "r"
         self.request_type = request_type.upper()
         self.data = data
         self.files = files
+        self.user = user
+        self.financial_code_systems = list(FinancialCodeSystem.objects.order_by("id"))
+        self.financial_code_systems_by_date = {}
+        self.financial_code_matches = {}
         self.forms = self.assemble_forms(kwargs)
         self.empty_financial_code_form = self.assemble_empty_financial_code_form()
         self.css = self.compile_css()
@@ -518,47 +609,19 @@ class FinancialCodeAssignmentForm(forms.Form):
         financial_code_system = kwargs.pop("system")
         transaction_type = kwargs.pop("transaction_type")
 
-        # Retrieve all the children BudgetYears entries
-        budget_years = BudgetYear.objects.filter(
-            financial_code_system=financial_code_system
-        ).order_by('-date_start')
-
-        # Create a choice list with the budget_years
-        budget_year_choices = []
-
-        for year in budget_years:
-            budget_year_choices.append((year.id, str(year)))
-
-        # Create a choice list with the budget_years
-        groups_and_codes = []
-
-        # Retrieve all the children FinancialCodeGroup entries
-        for year in budget_years:
-            groups = year.financialcodegroup_set.filter(type=transaction_type)
-
-            for group in groups:
-                code_list = []
-
-                codes = group.financialcode_set.all().order_by("code")
-
-                for code in codes:
-                    code_list.append((code.id, str(code)))
-
-                groups_and_codes.append([group.title, code_list])
-
-        # Sort the groups by the first code in each group
-        sorted_groups_and_codes = sorted(groups_and_codes, key=lambda x: x[1][0][1])
-
-        # Create the final financial code choice list
-        financial_code_choices = [["", "---------"]] + sorted_groups_and_codes
+        # Retrieve the cached budget year and financial code choices
+        choices = get_financial_code_choices(financial_code_system, transaction_type)
 
         super(FinancialCodeAssignmentForm, self).__init__(*args, **kwargs)
 
         # Specify the choices
-        self.fields["budget_year"].choices = budget_year_choices
-        self.fields["code"].choices = financial_code_choices
+        self.fields["budget_year"].choices = choices["budget_years"]
+        self.fields["code"].choices = choices["financial_codes"]
+        self.fields["code"].widget.year_ids = {
+            str(code_id): year_id for code_id, year_id in choices["code_years"].items()
+        }
 
-class NewAttachmentForm(forms.Form):
+class NewAttachmentForm(AttachmentTokenFormMixin, forms.Form):
     """Form to handle file attachments to transaction"""
     attachment_files = MultiFileField(
         help_text="Documentation/files for this transaction",
@@ -567,6 +630,7 @@ class NewAttachmentForm(forms.Form):
         max_num=20,
         required=False,
     )
+    attachment_tokens = AttachmentTokenField()
 
     prefix = "newattachment"
 
@@ -0,0 +1,86 @@
+"""Command to export the PDFs of many transactions"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from branch_details.models import Branch
+from financial_transactions.rendering import render_transaction_pdf_book, stream_transaction_pdf_zip
+from financial_transactions.utils import get_export_transactions
+
+
+class Command(BaseCommand):
+    """Renders the transaction PDFs to a ZIP file or one merged PDF"""
+    help = "Exports the PDFs of the selected transactions as a ZIP file or one merged PDF"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output",
+            help="Path of the file to create",
+        )
+        parser.add_argument(
+            "--ids",
+            help="Comma separated list of transaction IDs",
+        )
+        parser.add_argument(
+            "--date-start",
+            help="Start of the submission date range (yyyy-mm-dd)",
+        )
+        parser.add_argument(
+            "--date-end",
+            help="End of the submission date range (yyyy-mm-dd)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["zip", "pdf"],
+            default="zip",
+            help="Export a ZIP of PDFs (default) or one merged PDF",
+        )
+        parser.add_argument(
+            "--user-name",
+            default="",
+            help="Name printed in the authorized and processed by sections",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            transaction_ids = [
+                int(transaction_id) for transaction_id in (options["ids"] or "").split(",")
+                if transaction_id.strip()
+            ]
+        except ValueError:
+            raise CommandError("Transaction IDs must be integers.")
+
+        try:
+            date_start = parse_date(options["date_start"] or "")
+            date_end = parse_date(options["date_end"] or "")
+        except ValueError:
+            raise CommandError("Dates must be in the format yyyy-mm-dd.")
+
+        if (options["date_start"] and not date_start) or (options["date_end"] and not date_end):
+            raise CommandError("Dates must be in the format yyyy-mm-dd.")
+
+        if not transaction_ids and not date_start and not date_end:
+            raise CommandError("Provide transaction IDs or a date range.")
+
+        transactions = list(get_export_transactions(
+            transaction_ids=transaction_ids or None, date_start=date_start, date_end=date_end
+        ))
+
+        if not transactions:
+            raise CommandError("No transactions match the provided IDs or dates.")
+
+        branch_details = Branch.objects.last()
+
+        with open(options["output"], "wb") as output_file:
+            if options["format"] == "pdf":
+                output_file.write(render_transaction_pdf_book(
+                    branch_details, transactions, options["user_name"]
+                ))
+            else:
+                for chunk in stream_transaction_pdf_zip(
+                        branch_details, transactions, options["user_name"]
+                ):
+                    output_file.write(chunk)
+
+        self.stdout.write(
+            "Exported {} transactions to {}.".format(len(transactions), options["output"])
+        )
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_reconciliation', '0002_alter_historicalreconciliationgroup_options_and_more'),
+        ('financial_transactions', '0007_financialtransaction_submitter_and_more'),
+        ('payee_payers', '0002_alter_historicalpayeepayer_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='financialtransaction',
+            index=models.Index(condition=models.Q(('reconciled__isnull', True)), fields=['date_submitted'], name='fin_transaction_unreconciled'),
+        ),
+        migrations.AddIndex(
+            model_name='financialtransaction',
+            index=models.Index(fields=['reconciled', 'date_submitted'], name='fin_transaction_reconciled'),
+        ),
+    ]
@@ -3,6 +3,8 @@
 from decimal import Decimal
 
 from django.db import models
+from django.db.models import F, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from simple_history.models import HistoricalRecords
@@ -12,6 +14,71 @@ from financial_codes.models import FinancialCodeSystem, FinancialCode
 from payee_payers.models import PayeePayer
 
 
+class FinancialTransactionQuerySet(models.QuerySet):
+    """Custom queryset methods for the FinancialTransaction model"""
+    def with_totals(self):
+        """Annotates the item totals onto each transaction
+
+            The annotations are used by the total, total_before_tax and
+            total_tax properties in place of querying the items.
+        """
+        output_field = models.DecimalField(max_digits=12, decimal_places=2)
+
+        return self.annotate(
+            annotated_total=Coalesce(
+                Sum(F("items__amount") + F("items__gst"), output_field=output_field),
+                Value(0),
+                output_field=output_field,
+            ),
+            annotated_total_before_tax=Coalesce(
+                Sum("items__amount", output_field=output_field),
+                Value(0),
+                output_field=output_field,
+            ),
+            annotated_total_tax=Coalesce(
+                Sum("items__gst", output_field=output_field),
+                Value(0),
+                output_field=output_field,
+            ),
+        )
+
+    def with_submission_codes(self):
+        """Prefetches the items and their submission codes
+
+            Resolves the submission codes of the items of all the
+            transactions with one query (see ItemQuerySet).
+        """
+        return self.prefetch_related(
+            Prefetch("items", queryset=Item.objects.with_submission_codes())
+        )
+
+class ItemQuerySet(models.QuerySet):
+    """Custom queryset methods for the Item model"""
+    def with_submission_codes(self):
+        """Prefetches the submission code of each item
+
+            The codes (with their group and budget year) are retrieved
+            with one query and used by the get_submission_code
+            property in place of querying each item.
+        """
+        submission_system = FinancialCodeSystem.objects.filter(
+            submission_code=True
+        ).order_by("title").values("id")[:1]
+
+        return self.prefetch_related(
+            Prefetch(
+                "financialcodematch_set",
+                queryset=FinancialCodeMatch.objects.filter(
+                    financial_code__financial_code_group__budget_year__financial_code_system=Subquery(
+                        submission_system
+                    )
+                ).select_related(
+                    "financial_code__financial_code_group__budget_year"
+                ).order_by("financial_code_id"),
+                to_attr="submission_code_matches",
+            )
+        )
+
 class FinancialTransaction(models.Model):
     # TODO: Add proper tracking of submission details
     """Holds data on the overall transaction"""
@@ -62,6 +129,22 @@ class FinancialTransaction(models.Model):
     )
     history = HistoricalRecords()
 
+    objects = FinancialTransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Supports the reconciliation queries for unreconciled transactions
+            models.Index(
+                fields=['date_submitted'],
+                condition=Q(reconciled__isnull=True),
+                name='fin_transaction_unreconciled',
+            ),
+            models.Index(
+                fields=['reconciled', 'date_submitted'],
+                name='fin_transaction_reconciled',
+            ),
+        ]
+
     def __str__(self):
         if self.transaction_type == 'e':
             return_string = '{} - Expense - {} - {}'.format(
@@ -77,6 +160,9 @@ class FinancialTransaction(models.Model):
     @property
     def total(self):
         """Calculates the total of all children items"""
+        if hasattr(self, 'annotated_total'):
+            return Decimal(self.annotated_total)
+
         items = self.items.all()
 
         total = Decimal(0)
@@ -89,6 +175,9 @@ class FinancialTransaction(models.Model):
     @property
     def total_before_tax(self):
         """Calculates the pre-tax total of all children items."""
+        if hasattr(self, 'annotated_total_before_tax'):
+            return Decimal(self.annotated_total_before_tax)
+
         items = self.items.all()
 
         total = Decimal(0)
@@ -101,6 +190,9 @@ class FinancialTransaction(models.Model):
     @property
     def total_tax(self):
         """Calculates the tax total of all children items."""
+        if hasattr(self, 'annotated_total_tax'):
+            return Decimal(self.annotated_total_tax)
+
         items = self.items.all()
 
         total = Decimal(0)
@@ -145,6 +237,8 @@ class Item(models.Model):
     )
     history = HistoricalRecords()
 
+    objects = ItemQuerySet.as_manager()
+
     def __str__(self):
         return '{} - {} - ${}'.format(
             self.date_item, self.description, self.total
@@ -161,6 +255,12 @@ class Item(models.Model):
     @property
     def get_submission_code(self):
         """Returns the proper submission code for this item."""
+        if hasattr(self, 'submission_code_matches'):
+            if self.submission_code_matches:
+                return self.submission_code_matches[0].financial_code
+
+            return None
+
         system = FinancialCodeSystem.objects.filter(submission_code=True).order_by('title').first()
         return self.financial_codes.filter(financial_code_group__budget_year__financial_code_system=system).first()
 
@@ -0,0 +1,623 @@
+"""PDF rendering of financial transactions
+
+    Imports ReportLab, so it should only be imported where a PDF is
+    rendered (keeping ReportLab out of the URLconf import).
+"""
+import atexit
+import collections
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from datetime import datetime
+from itertools import islice
+from xml.sax.saxutils import escape
+
+import django
+from django.core.files.storage import default_storage
+from pypdf import PdfReader, PdfWriter
+from reportlab import lib
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from documents.services import LOST_TASK_ERRORS, is_completed, run_with_deadline
+from treasurer_tools.pdf.styles import STYLES
+from treasurer_tools.pdf.canvases import PageNumCanvas
+from treasurer_tools.pdf.images import (
+    ReaderImage, get_content_image_reader, get_image_reader
+)
+
+
+# Maximum number of processes used to render exported PDFs
+PDF_EXPORT_MAX_WORKERS = 4
+
+# Seconds a single transaction PDF may take to render (from when it starts)
+PDF_RENDER_TIMEOUT = 120
+
+PDF_EXECUTOR = None
+PDF_EXECUTOR_LOCK = threading.Lock()
+
+# Page margins of the transaction PDFs
+PDF_MARGINS = {
+    'topMargin': 12.5 * mm,
+    'rightMargin': 12.5 * mm,
+    'bottomMargin': 12.5 * mm,
+    'leftMargin': 12.5 * mm,
+}
+
+def generate_pdf_header(transaction, logo_reader):
+    # Get and resize logo (max height = 25 mm, max width = 75 mm)
+    width, height = logo_reader.getSize()
+
+    # If aspect ratio > 1/3, need to scale by max height
+    if (height / width) > 0.333:
+        logo = ReaderImage(
+            logo_reader,
+            width=((25 * mm) / height) * width,
+            height=25 * mm,
+        )
+    # Otherwise, need to scale by max width
+    else:
+        logo = ReaderImage(
+            logo_reader,
+            width=75 * mm,
+            height=((75 * mm) / width) * height,
+        )
+
+    if transaction.transaction_type == 'e':
+        header_title = 'Branch Expense Claim Form'
+    else:
+        header_title = 'Branch Deposit Form'
+
+    header_table = Table(
+        [[logo, header_title]],
+        colWidths=[90 * mm, 90 * mm],
+    )
+
+    header_table.setStyle(TableStyle([
+        ('FONT', (0, 0), (-1, -1), 'Helvetica-Bold', 16),
+        ('ALIGNMENT', (0, 0), (0, 0), 'LEFT'),
+        ('ALIGNMENT', (1, 0), (1, 0), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+
+    return header_table
+
+def generate_pdf_transaction_details(branch_details, transaction):
+    # Get all relevant details
+    branch_name = branch_details.name_full if branch_details.name_full else ''
+    payee_payer = transaction.payee_payer
+    name = payee_payer.name if payee_payer.name else ''
+    address = payee_payer.address if payee_payer.address else ''
+    city = payee_payer.city if payee_payer.city else ''
+    province = payee_payer.province if payee_payer.province else ''
+    postal_code = payee_payer.postal_code if payee_payer.postal_code else ''
+    phone = payee_payer.phone if payee_payer.phone else ''
+
+    # Table to hold the payee/payer details
+
+    details_table = Table(
+        [
+            [
+                'Branch Name:',
+                Paragraph(branch_name, STYLES['normal'])
+            ],
+            [
+                'Payee Name:',
+                Paragraph(name, STYLES['normal'])
+            ],
+            [
+                'Payee Address:',
+                Paragraph(address, STYLES['normal_center'])
+            ],
+            ['', 'Mailing address'],
+            [
+                '',
+                Paragraph(city, STYLES['normal_center']),
+                Paragraph(province, STYLES['normal_center']),
+                Paragraph(postal_code, STYLES['normal_center']),
+                Paragraph(phone, STYLES['normal_center'])],
+            ['', 'City', 'Province', 'Postal Code', 'Telephone'],
+        ],
+        colWidths=[40 * mm, 65 * mm, 20 * mm, 25 * mm, 40 * mm]
+    )
+
+    details_table.setStyle(TableStyle([
+        # Overall table styles
+        ('FONT', (0, 0), (-1, -1), 'Helvetica', 12),
+
+
+        # Branch Name styles
+        ('FONT', (0, 0), (0, -1), 'Helvetica-Bold', 10),
+        ('LINEBELOW', (1, 0), (-1, 0), 1, lib.colors.black),
+        ('SPAN', (1, 0), (-1, 0)),
+
+        # Payee/Payer Name styles
+        ('LINEBELOW', (1, 1), (-1, 1), 1, lib.colors.black),
+        ('SPAN', (1, 1), (-1, 1)),
+
+        # Payee/Payer Address styles
+        ('FONT', (1, 3), (-1, 3), 'Helvetica-Oblique', 8),
+        ('FONT', (1, 5), (-1, 5), 'Helvetica-Oblique', 8),
+        ('LINEBELOW', (1, 2), (-1, 2), 1, lib.colors.black),
+        ('LINEBELOW', (1, 4), (-1, 4), 1, lib.colors.black),
+        ('SPAN', (1, 2), (-1, 2)),
+        ('SPAN', (1, 3), (-1, 3)),
+        ('ALIGNMENT', (1, 2), (-1, 5), 'CENTER'),
+        ('VALIGN', (1, 3), (-1, 3), 'TOP'),
+        ('VALIGN', (1, 5), (-1, 5), 'TOP'),
+    ]))
+
+    return details_table
+
+def generate_pdf_transaction_items(transaction):
+    # Header data for the items table
+    items_rows = [
+        [
+            Paragraph(
+                'Purchase Date YYYY-MMM-DD',
+                STYLES['bold_tiny_center']
+            ),
+            Paragraph('Description', STYLES['bold_tiny_center']),
+            Paragraph('Amount Before Tax', STYLES['bold_tiny_center']),
+            Paragraph('GST/HST', STYLES['bold_tiny_center']),
+            Paragraph('Total', STYLES['bold_tiny_center']),
+            Paragraph('Budget Year', STYLES['bold_tiny_center']),
+            Paragraph('Account Code', STYLES['bold_tiny_center']),
+        ],
+    ]
+
+    # Add each transaction item (uses any prefetched submission codes)
+    items = transaction.items.all()
+
+    for item in items:
+        # Get financial code details for item
+        code = item.get_submission_code
+
+        items_rows.append([
+            item.date_item.strftime('%Y-%b-%d'),
+            Paragraph(item.description, STYLES['normal_tiny']),
+            '${}'.format(item.amount),
+            '${}'.format(item.gst),
+            '${}'.format(item.total),
+            Paragraph(
+                code.financial_code_group.budget_year.short_name if code else '',
+                STYLES['normal_tiny_center']
+            ),
+            code.code if code else '',
+        ])
+
+    # Add the table footer
+    items_rows.append([
+        '',
+        'TOTAL',
+        '${}'.format(transaction.total_before_tax),
+        '${}'.format(transaction.total_tax),
+        '${}'.format(transaction.total),
+        '',
+        ''
+    ])
+
+    items_table = Table(
+        items_rows,
+        colWidths=[
+            25 * mm, 55 * mm, 20 * mm, 20 * mm, 20 * mm, 30 * mm, 20 * mm
+        ]
+    )
+
+    items_table.setStyle(TableStyle([
+        # Overall table styles
+        ('FONT', (0, 0), (-1, -1), 'Helvetica', 8),
+        ('BOX', (0, 0), (-1, -2), 1, lib.colors.black),
+        ('INNERGRID', (0, 0), (-1, -2), 1, lib.colors.black),
+        ('ALIGNMENT', (0, 0), (-1, 0), 'CENTRE'),
+
+        # Header styles
+        ('BACKGROUND', (0, 0), (-1, 0), lib.colors.lightgrey),
+
+        # Item styles
+        ('VALIGN', (0, 1), (-1, -2), 'TOP'),
+
+        # Date styles
+        ('ALIGNMENT', (0, 0), (0, -1), 'CENTRE'),
+
+        # Dollar amount styles
+        ('FONTSIZE', (2, 1), (4, -1), 8),
+        ('ALIGNMENT', (2, 1), (4, -1), 'RIGHT'),
+
+        # Account code styles
+        ('ALIGNMENT', (5, 1), (6, -1), 'CENTRE'),
+
+        # Footer style
+        ('FONT', (1, -1), (4, -1), 'Helvetica-Bold'),
+        ('BACKGROUND', (2, -1), (4, -1), lib.colors.lightgrey),
+        ('BOX', (2, -1), (4, -1), 1, lib.colors.black),
+        ('INNERGRID', (2, -1), (4, -1), 1, lib.colors.black),
+        ('ALIGNMENT', (1, -1), (4, -1), 'RIGHT'),
+        ('VALIGN', (1, -1), (4, -1), 'MIDDLE'),
+    ]))
+
+    return items_table
+
+def generate_pdf_transaction_notes(transaction):
+    # Table to hold any transation notes
+    notes_table = Table(
+        [
+            ['Notes:', Paragraph('', STYLES['normal'])],
+        ],
+        colWidths=[20 * mm, 170 * mm],
+    )
+
+    return notes_table
+
+def generate_pdf_submission_details(transaction, user_name):
+    # TODO: Use proper submission tracking details in this section
+    base_style = [
+        # Overall table styles
+        ('FONT', (0, 0), (-1, -1), 'Helvetica', 10, 9),
+        ('FONT', (0, 2), (-1, 2), 'Helvetica-Oblique', 8, 8),
+        ('FONT', (0, 4), (-1, 4), 'Helvetica-Oblique', 8, 8),
+        ('FONT', (0, 6), (-1, 6), 'Helvetica-Oblique', 8, 8),
+        ('ALIGNMENT', (0, 0), (-1, -1), 'CENTRE'),
+
+        # Header style
+        ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', 8, 10),
+        ('BACKGROUND', (0, 0), (-1, 0), lib.colors.lightgrey),
+        ('BOX', (0, 0), (-1, 0), 1, lib.colors.black),
+        ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'),
+
+        # Submitted by styles
+        ('BOX', (0, 0), (2, -1), 1, lib.colors.black),
+        ('LINEBELOW', (1, 1), (1, 1), 0.5, lib.colors.black),
+        ('LINEBELOW', (1, 5), (1, 5), 0.5, lib.colors.black),
+
+        # Authorized by or Processed by styles
+        ('BOX', (3, 0), (5, -1), 1, lib.colors.black),
+        ('LINEBELOW', (4, 1), (4, 1), 0.5, lib.colors.black),
+        ('LINEBELOW', (4, 3), (4, 3), 0.5, lib.colors.black),
+        ('LINEBELOW', (4, 5), (4, 5), 0.5, lib.colors.black),
+    ]
+
+    if transaction.transaction_type == 'e':
+        submission_table = Table(
+            [
+                ['', 'SUBMITTED BY', '', '', 'AUTHORIZED BY', '', '', 'PROCESSED BY', ''],
+                [
+                    '', transaction.submitter, '',
+                    '', user_name, '',
+                    '', user_name, ''
+                ],
+                ['', 'Name', '', '', 'Name', '', '', 'Name', ''],
+                [
+                    '', '', '',
+                    '', 'CSHP-AB Treasurer', '',
+                    '', 'CSHP-AB Treasurer', ''
+                ],
+                ['', '', '', '', 'Position', '', '', 'Position', ''],
+                [
+                    '', transaction.date_submitted.strftime('%Y-%b-%d'), '',
+                    '', datetime.today().strftime('%Y-%b-%d'), '',
+                    '', datetime.today().strftime('%Y-%b-%d'), ''
+                ],
+                ['', 'Date', '', '', 'Date', '', '', 'Date', ''],
+            ],
+            colWidths=[
+                2 * mm, 59 * mm, 2 * mm,
+                2 * mm, 60 * mm, 2 * mm,
+                2 * mm, 59 * mm, 2 * mm
+            ],
+        )
+
+        # Add the additional processed by styles
+        base_style.append(('BOX', (6, 0), (8, -1), 1, lib.colors.black))
+        base_style.append(('LINEBELOW', (7, 1), (7, 1), 0.5, lib.colors.black))
+        base_style.append(('LINEBELOW', (7, 3), (7, 3), 0.5, lib.colors.black))
+        base_style.append(('LINEBELOW', (7, 5), (7, 5), 0.5, lib.colors.black))
+    else:
+        submission_table = Table(
+            [
+                ['', 'SUBMITTED BY', '', '', 'PROCESSED BY', ''],
+                [
+                    '', transaction.submitter, '',
+                    '', user_name, '',
+                ],
+                ['', 'Name', '', '', 'Name', ''],
+                [
+                    '', '', '',
+                    '', 'CSHP-AB Treasurer', ''
+                ],
+                ['', '', '', '', 'Position', ''],
+                [
+                    '', transaction.date_submitted.strftime('%Y-%b-%d'), '',
+                    '', datetime.today().strftime('%Y-%b-%d'), ''
+                ],
+                ['', 'Date', '', '', 'Date', ''],
+            ],
+            colWidths=[
+                2 * mm, 59 * mm, 2 * mm,
+                2 * mm, 60 * mm, 2 * mm,
+                2 * mm, 59 * mm, 2 * mm
+            ],
+        )
+
+    # Apply table styles
+    submission_table.setStyle(TableStyle(base_style))
+
+    return submission_table
+
+def generate_pdf_elements(branch_details, transaction, user_name, logo_reader):
+    """Returns all the PDF flowables for one transaction"""
+    elements = []
+
+    elements.append(generate_pdf_header(transaction, logo_reader))
+    elements.append(Spacer(190 * mm, 10))
+    elements.append(generate_pdf_transaction_details(branch_details, transaction))
+    elements.append(Spacer(190 * mm, 10))
+    elements.append(generate_pdf_transaction_items(transaction))
+    elements.append(Spacer(190 * mm, 10))
+
+    if transaction.submission_notes:
+        elements.append(generate_pdf_transaction_notes(transaction))
+        elements.append(Spacer(190 * mm, 10))
+
+    elements.append(
+        generate_pdf_submission_details(transaction, user_name)
+    )
+
+    return elements
+
+def render_transaction_pdf(branch_details, transaction, user_name, logo_content=None):
+    """Renders the PDF of a transaction and returns its content
+
+        Worker processes receive the logo content from the parent
+        (logo_content), so they do not access the storage.
+    """
+    pdf_file = io.BytesIO()
+
+    # Get the decoded logo (cached between renders)
+    if logo_content is None:
+        logo_reader = get_image_reader(branch_details.logo.name)
+    else:
+        logo_reader = get_content_image_reader(logo_content)
+
+    # Generate a PDF title
+    pdf_title = '{}.pdf'.format(str(transaction))
+
+    # Create the PDF object, using the BytesIO object as its "file."
+    # Page size = 8.5" or 215.9 mm - rounded to 215 mm
+    doc = SimpleDocTemplate(
+        pdf_file,
+        pagesize=lib.pagesizes.letter,
+        title=pdf_title,
+        **PDF_MARGINS
+    )
+
+    # Assemble and return the final PDF document
+    doc.build(
+        generate_pdf_elements(branch_details, transaction, user_name, logo_reader),
+        canvasmaker=PageNumCanvas
+    )
+
+    return pdf_file.getvalue()
+
+def render_contents_pdf(entries, first_page):
+    """Renders the contents pages of a transaction book
+
+        entries are (title, page count) pairs for each transaction,
+        which start on first_page.
+    """
+    pdf_file = io.BytesIO()
+
+    doc = SimpleDocTemplate(
+        pdf_file,
+        pagesize=lib.pagesizes.letter,
+        title='Transactions.pdf',
+        **PDF_MARGINS
+    )
+
+    contents_rows = []
+    page_number = first_page
+
+    for title, page_count in entries:
+        contents_rows.append([Paragraph(escape(title), STYLES['normal']), str(page_number)])
+        page_number += page_count
+
+    contents_table = Table(contents_rows, colWidths=[170 * mm, 20 * mm])
+    contents_table.setStyle(TableStyle([
+        ('FONT', (0, 0), (-1, -1), 'Helvetica', 10),
+        ('ALIGNMENT', (1, 0), (1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+
+    doc.build([
+        Paragraph('Transactions', STYLES['title']),
+        Spacer(190 * mm, 10),
+        contents_table,
+    ])
+
+    return pdf_file.getvalue()
+
+def render_transaction_pdf_book(branch_details, transactions, user_name):
+    """Renders the transactions into one PDF with a table of contents
+
+        Each transaction PDF is rendered in the process pool and the
+        PDFs are merged after the contents pages, with an outline
+        entry for each transaction.
+    """
+    titles = []
+    contents = []
+
+    for transaction, content in render_transaction_pdfs(branch_details, transactions, user_name):
+        titles.append(str(transaction))
+        contents.append(PdfReader(io.BytesIO(content)))
+
+    entries = [(title, len(reader.pages)) for title, reader in zip(titles, contents)]
+
+    # Render the contents until its page count (which offsets the
+    # page numbers) is stable
+    contents_page_count = 1
+
+    while True:
+        contents_pdf = PdfReader(io.BytesIO(render_contents_pdf(entries, contents_page_count + 1)))
+
+        if len(contents_pdf.pages) == contents_page_count:
+            break
+
+        contents_page_count = len(contents_pdf.pages)
+
+    writer = PdfWriter()
+    writer.append(contents_pdf)
+
+    for title, reader in zip(titles, contents):
+        page_index = len(writer.pages)
+        writer.append(reader, import_outline=False)
+        writer.add_outline_item(title, page_index)
+
+    writer.add_metadata({'/Title': 'Transactions.pdf'})
+
+    pdf_file = io.BytesIO()
+    writer.write(pdf_file)
+
+    return pdf_file.getvalue()
+
+def get_pdf_executor():
+    """Returns the process pool used to render exported PDFs
+
+        The pool is created on first use and shared by all requests.
+        Workers are spawned, so they do not inherit the database
+        connections or the request's transaction, and set up Django to
+        load the transactions they receive.
+    """
+    global PDF_EXECUTOR # pylint: disable=global-statement
+
+    with PDF_EXECUTOR_LOCK:
+        if PDF_EXECUTOR is None:
+            PDF_EXECUTOR = concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(PDF_EXPORT_MAX_WORKERS, os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+            atexit.register(PDF_EXECUTOR.shutdown)
+
+        return PDF_EXECUTOR
+
+def reset_pdf_executor(executor):
+    """Discards a broken process pool so the next use creates a new one"""
+    global PDF_EXECUTOR # pylint: disable=global-statement
+
+    with PDF_EXECUTOR_LOCK:
+        if PDF_EXECUTOR is executor:
+            PDF_EXECUTOR = None
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def render_transaction_pdfs(branch_details, transactions, user_name, max_workers=PDF_EXPORT_MAX_WORKERS):
+    """Generator that renders the PDF of each transaction in parallel
+
+        Yields (transaction, content) pairs in order. The worker
+        processes do not query the database, so the transactions must
+        include all the PDF data (see get_export_transactions). Only a
+        few transactions per worker are submitted ahead of the one
+        being yielded, which limits the memory of large exports. Each
+        PDF has PDF_RENDER_TIMEOUT seconds to render once it starts;
+        renders lost when the shared pool broke are submitted once more
+        to a new pool.
+    """
+    transactions = list(transactions)
+
+    if len(transactions) <= 1 or max_workers <= 1:
+        for transaction in transactions:
+            yield transaction, render_transaction_pdf(branch_details, transaction, user_name)
+
+        return
+
+    # Read the logo once and send its content to the workers
+    with default_storage.open(branch_details.logo.name, 'rb') as logo_file:
+        logo_content = logo_file.read()
+
+    executor = get_pdf_executor()
+    transaction_iterator = iter(transactions)
+    pending = collections.deque()
+
+    def submit(transaction):
+        return executor.submit(
+            run_with_deadline, PDF_RENDER_TIMEOUT, render_transaction_pdf,
+            branch_details, transaction, user_name, logo_content
+        )
+
+    def submit_next(count):
+        for transaction in islice(transaction_iterator, count):
+            # Each entry is [transaction, future, whether it was resubmitted]
+            pending.append([transaction, submit(transaction), False])
+
+    try:
+        submit_next(2 * max_workers)
+
+        while pending:
+            transaction, future, resubmitted = pending[0]
+
+            try:
+                content = future.result()
+            except LOST_TASK_ERRORS:
+                if resubmitted:
+                    raise
+
+                # The shared pool broke (e.g. a hung render of any export
+                # stopped its worker); render the unfinished PDFs in a new pool
+                reset_pdf_executor(executor)
+                executor = get_pdf_executor()
+
+                for entry in pending:
+                    if not is_completed(entry[1]):
+                        entry[1] = submit(entry[0])
+                        entry[2] = True
+
+                continue
+
+            pending.popleft()
+            submit_next(1)
+
+            yield transaction, content
+    finally:
+        # Stop the remaining renders of an abandoned export
+        for _, future, _ in pending:
+            future.cancel()
+
+class StreamBuffer(io.RawIOBase):
+    """Write-only buffer that hands back the written bytes in chunks"""
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+
+        return len(data)
+
+    def pop(self):
+        """Returns and clears the bytes written so far"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+
+        return data
+
+def stream_transaction_pdf_zip(branch_details, transactions, user_name):
+    """Generator that yields a ZIP of the transaction PDFs in chunks"""
+    buffer = StreamBuffer()
+
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for transaction, content in render_transaction_pdfs(branch_details, transactions, user_name):
+            zip_file.writestr(get_transaction_pdf_filename(transaction), content)
+
+            yield buffer.pop()
+
+    yield buffer.pop()
+
+def get_transaction_pdf_filename(transaction):
+    """Returns the file name of a transaction PDF in an export"""
+    return '{}-{}.pdf'.format(transaction.date_submitted, transaction.id)
@@ -39,6 +39,10 @@ function toggleDateInputs() {
   }
 }
 
+// Parameters of the current transaction list (used for further pages)
+let listParameters = '';
+let loadingMore = false;
+
 function retrieveTransactions() {
   // Get the transaction type
   const transactionType = $('#transaction-type').val();
@@ -88,8 +92,51 @@ function retrieveTransactions() {
       + `&date_start=${dateStart}`
       + `&date_end=${dateEnd}`;
 
+  listParameters = parameters;
+
   $('#transactions').load(url + parameters, () => {
     // Callback function goes here (e.g. error handling)
+    filterResults();
+    loadMoreTransactions();
+  });
+}
+
+function loadMoreTransactions() {
+  const $loadMore = $('#transactions .load-more');
+
+  // Stop if there are no more pages or a page is already loading
+  if (!$loadMore.length || loadingMore) {
+    return;
+  }
+
+  // Only load once the end of the list is close to being visible
+  const windowBottom = $(window).scrollTop() + $(window).height();
+
+  if ($loadMore.offset().top > windowBottom + 500) {
+    return;
+  }
+
+  loadingMore = true;
+
+  const url = 'retrieve-transactions/';
+  const requestedParameters = listParameters;
+  const parameters = requestedParameters
+      + `&last_date=${encodeURIComponent($loadMore.attr('data-last-date'))}`
+      + `&last_id=${encodeURIComponent($loadMore.attr('data-last-id'))}`;
+
+  $.get(url + parameters).done((html) => {
+    loadingMore = false;
+
+    // Ignore the page if the filters changed while it was loading
+    if (requestedParameters === listParameters) {
+      $loadMore.replaceWith(html);
+      filterResults();
+
+      // Continue loading if the list still ends within view
+      loadMoreTransactions();
+    }
+  }).fail(() => {
+    loadingMore = false;
   });
 }
 
@@ -189,6 +236,10 @@ $(document).ready(() => {
     filterResults();
   });
 
+  $(window).on('scroll', () => {
+    loadMoreTransactions();
+  });
+
   toggleDateInputs();
   setDefaultDates();
   retrieveTransactions();
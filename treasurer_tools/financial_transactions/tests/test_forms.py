@@ -3,14 +3,17 @@
 import tempfile
 
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import connection
 from django.http import QueryDict
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.datastructures import MultiValueDict
 
 from documents.models import Attachment, FinancialTransactionMatch
 from financial_codes.models import FinancialCode
 from financial_transactions.forms import FinancialCodeAssignmentForm, CompiledForms
 from financial_transactions.models import FinancialTransaction, Item, FinancialCodeMatch
+from reports.models import FinancialCodeTotal
 from .utils import create_financial_codes, create_demographics
 
 
@@ -277,6 +280,147 @@ class CompiledFormsTest(TestCase):
         # Check that items have descreased
         self.assertEqual(Item.objects.count(), item_total - 1)
 
+    def save_items(self, number):
+        """Saves a transaction with the number of items
+
+            Returns the POST data to edit the saved transaction.
+        """
+        data = dict(self.valid_data)
+
+        for i in range(1, number):
+            for field in ["date_item", "description", "amount", "gst", "id", "transaction"]:
+                data["items-{}-{}".format(i, field)] = data["items-0-{}".format(field)]
+
+            for j in range(2):
+                for field in ["financial_code_match_id", "budget_year", "code"]:
+                    data["items-{}-coding_set-{}-{}".format(i, j, field)] = data[
+                        "items-0-coding_set-{}-{}".format(j, field)
+                    ]
+
+        data["items-TOTAL_FORMS"] = str(number)
+
+        forms = CompiledForms("expense", "POST", data)
+        self.assertTrue(forms.is_valid())
+        forms.save()
+
+        # Update the data with the saved IDs
+        transaction = FinancialTransaction.objects.last()
+
+        for i, item in enumerate(transaction.items.all().order_by("id")):
+            data["items-{}-id".format(i)] = item.id
+            data["items-{}-transaction".format(i)] = transaction.id
+            data["initial-items-{}-date_item".format(i)] = data["items-{}-date_item".format(i)]
+
+            for j, match in enumerate(item.financialcodematch_set.all().order_by("id")):
+                data["items-{}-coding_set-{}-financial_code_match_id".format(i, j)] = match.id
+
+        data["items-INITIAL_FORMS"] = str(number)
+
+        # Callable defaults are compared against a hidden initial value
+        data["initial-date_submitted"] = data["date_submitted"]
+
+        return transaction, data
+
+    def save_edit(self, transaction, data):
+        """Validates and saves the edited transaction data"""
+        forms = CompiledForms("expense", "POST", data, transaction_id=transaction.id)
+        self.assertTrue(forms.is_valid())
+        forms.save()
+
+    def test_save_skips_untouched_forms(self):
+        """Tests that unchanged transactions, items and matches are not saved"""
+        transaction, data = self.save_items(2)
+
+        transaction_history = FinancialTransaction.history.count()
+        item_history = Item.history.count()
+        match_history = FinancialCodeMatch.history.count()
+
+        self.save_edit(transaction, data)
+
+        self.assertEqual(FinancialTransaction.history.count(), transaction_history)
+        self.assertEqual(Item.history.count(), item_history)
+        self.assertEqual(FinancialCodeMatch.history.count(), match_history)
+
+    def test_save_of_edited_items_and_codes(self):
+        """Tests that bulk saved edits keep history and report totals"""
+        transaction, data = self.save_items(2)
+        new_code = FinancialCode.objects.create(
+            financial_code_group=self.codes[0].financial_code_group,
+            code="1100",
+            description="Conference Grant",
+        )
+
+        item_history = Item.history.count()
+        match_history = FinancialCodeMatch.history.count()
+
+        data["items-0-amount"] = "150.0"
+        data["items-1-coding_set-0-code"] = new_code.id
+        self.save_edit(transaction, data)
+
+        self.assertEqual(Item.history.count(), item_history + 1)
+        self.assertEqual(FinancialCodeMatch.history.count(), match_history + 1)
+
+        # Check that the totals moved to the new code
+        self.assertEqual(
+            FinancialCodeTotal.objects.get(financial_code=self.codes[0]).total, 155
+        )
+        self.assertEqual(FinancialCodeTotal.objects.get(financial_code=new_code).total, 105)
+        self.assertEqual(
+            FinancialCodeTotal.objects.get(financial_code=self.codes[2]).total, 260
+        )
+
+    def test_save_query_count_does_not_scale_with_items(self):
+        """Tests that editing one item of a large claim uses the same queries"""
+        def count_queries(number):
+            transaction, data = self.save_items(number)
+            data["items-0-description"] = "Edited"
+            forms = CompiledForms("expense", "POST", data, transaction_id=transaction.id)
+            self.assertTrue(forms.is_valid())
+
+            with CaptureQueriesContext(connection) as queries:
+                forms.save()
+
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(20))
+
+    def test_edit_forms_query_count_does_not_scale_with_items(self):
+        """Tests that building the edit forms uses the same queries for any item count"""
+        def count_queries(number, request_type):
+            transaction, data = self.save_items(number)
+
+            with CaptureQueriesContext(connection) as queries:
+                if request_type == "GET":
+                    CompiledForms("expense", "GET", None, transaction_id=transaction.id)
+                else:
+                    CompiledForms("expense", "POST", data, transaction_id=transaction.id)
+
+            return len(queries)
+
+        self.assertEqual(count_queries(2, "GET"), count_queries(20, "GET"))
+        self.assertEqual(count_queries(2, "POST"), count_queries(20, "POST"))
+
+    def test_edit_forms_populate_financial_codes(self):
+        """Tests that each item form gets the matches for its own systems"""
+        transaction, data = self.save_items(3)
+
+        forms = CompiledForms("expense", "GET", None, transaction_id=transaction.id)
+
+        for i, item_formset_group in enumerate(forms.forms.item_formsets):
+            codes = [
+                code_form.form["code"].value() for code_form in item_formset_group.financial_code_forms
+            ]
+            match_ids = [
+                code_form.form["financial_code_match_id"].value()
+                for code_form in item_formset_group.financial_code_forms
+            ]
+
+            self.assertEqual(codes, [self.codes[0].id, self.codes[2].id])
+            self.assertEqual(match_ids, [
+                data["items-{}-coding_set-0-financial_code_match_id".format(i)],
+                data["items-{}-coding_set-1-financial_code_match_id".format(i)],
+            ])
+
     @override_settings(MEDIA_ROOT=MEDIA_ROOT)
     def test_valid_attachment_file(self):
         """Confirms is_valid() returns false with file > 10 mb"""
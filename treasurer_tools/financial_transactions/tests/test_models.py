@@ -2,10 +2,12 @@
 
 from decimal import Decimal
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from financial_codes.models import FinancialCodeSystem
-from financial_transactions.models import FinancialCodeMatch
+from financial_transactions.models import FinancialTransaction, Item, FinancialCodeMatch
 
 from .utils import create_financial_transactions, create_financial_codes
 
@@ -83,6 +85,33 @@ class TransactionModelTest(TestCase):
 
         self.assertEqual(self.transactions[0].total, Decimal(210.00))
 
+    def test_with_totals_matches_properties(self):
+        """Tests that the annotated totals match the calculated totals"""
+        for transaction in FinancialTransaction.objects.with_totals():
+            calculated = FinancialTransaction.objects.get(id=transaction.id)
+
+            self.assertEqual(transaction.total, calculated.total)
+            self.assertEqual(transaction.total_before_tax, calculated.total_before_tax)
+            self.assertEqual(transaction.total_tax, calculated.total_tax)
+
+    def test_with_totals_uses_single_query(self):
+        """Tests that annotated totals do not query the items"""
+        with self.assertNumQueries(1):
+            for transaction in FinancialTransaction.objects.with_totals():
+                _ = transaction.total
+                _ = transaction.total_before_tax
+                _ = transaction.total_tax
+
+    def test_with_totals_without_items(self):
+        """Tests that transactions without items have a zero total"""
+        self.transactions[0].items.all().delete()
+
+        transaction = FinancialTransaction.objects.with_totals().get(id=self.transactions[0].id)
+
+        self.assertEqual(transaction.total, Decimal(0))
+        self.assertEqual(transaction.total_before_tax, Decimal(0))
+        self.assertEqual(transaction.total_tax, Decimal(0))
+
 class ItemModelTest(TestCase):
     """Test functions for the Item model"""
 
@@ -187,6 +216,67 @@ class ItemModelTest(TestCase):
             system_1
         )
 
+    def test_with_submission_codes(self):
+        """Tests that prefetched submission codes match the property queries"""
+        system = FinancialCodeSystem.objects.all().order_by('title')[1]
+        system.submission_code = True
+        system.save()
+
+        expected = {item.id: item.get_submission_code for item in Item.objects.all()}
+
+        with self.assertNumQueries(2):
+            items = list(Item.objects.with_submission_codes())
+
+            # Retrieve the group and budget year without further queries
+            codes = {
+                item.id: (
+                    item.get_submission_code,
+                    item.get_submission_code.financial_code_group.budget_year.short_name
+                ) for item in items
+            }
+
+        self.assertEqual({item_id: code[0] for item_id, code in codes.items()}, expected)
+
+    def test_with_submission_codes_without_system(self):
+        """Tests that no code is returned without a submission system"""
+        FinancialCodeSystem.objects.update(submission_code=False)
+
+        for item in Item.objects.with_submission_codes():
+            self.assertIsNone(item.get_submission_code)
+
+    def test_transaction_submission_codes_query_count(self):
+        """Tests that the codes of many transactions use the same queries"""
+        FinancialCodeSystem.objects.filter(
+            id=FinancialCodeSystem.objects.order_by('title')[0].id
+        ).update(submission_code=True)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                for transaction in FinancialTransaction.objects.with_submission_codes():
+                    for item in transaction.items.all():
+                        _ = item.get_submission_code
+
+            return len(queries)
+
+        small_count = count_queries()
+
+        # Add more transactions with coded items
+        for item in Item.objects.all():
+            transaction = FinancialTransaction.objects.create(
+                payee_payer=item.transaction.payee_payer,
+                memo="Copy",
+                date_submitted="2017-06-01",
+            )
+            new_item = Item.objects.create(transaction=transaction, description="Copy")
+
+            for code in item.financial_codes.all():
+                FinancialCodeMatch.objects.create(item=new_item, financial_code=code)
+
+        large_count = count_queries()
+
+        self.assertEqual(small_count, 3)
+        self.assertEqual(small_count, large_count)
+
 class FinancialCodeMatchModelTest(TestCase):
     """Tests for the FinancialCodeMatch model"""
 
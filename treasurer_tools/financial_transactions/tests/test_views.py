@@ -1,10 +1,34 @@
 """Test cases for other transactions app views"""
 
+import concurrent.futures
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+from unittest import mock
+
+from PIL import Image as PILImage
+from pypdf import PdfReader
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from branch_details.models import Branch
+from documents.models import Attachment, FinancialTransactionMatch
+from financial_codes.models import FinancialCodeSystem
 
 from financial_transactions.forms import FinancialCodeAssignmentForm
 from financial_transactions.models import FinancialTransaction, Item, FinancialCodeMatch
+from financial_transactions.utils import PDF_CACHE_FOLDER
+from treasurer_tools.pdf.images import IMAGE_CACHE
 
 from .utils import create_user, create_financial_codes, create_demographics, create_financial_transactions
 
@@ -231,6 +255,89 @@ class RetrieveTransactionsTest(TestCase):
             transaction_total
         )
 
+    def test_page_size_limits_results(self):
+        """Checks that the number of transactions is limited to the page size"""
+        new_args = self.valid_args
+        new_args["page_size"] = 2
+
+        # Make request
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(self.url, new_args)
+
+        # Check that the newest transactions were returned
+        self.assertEqual(
+            [transaction.memo for transaction in response.context["transactions"]],
+            ["Test Expense Transaction 2", "Test Expense Transaction 1"]
+        )
+        self.assertTrue(response.context["has_more"])
+
+    def test_next_page_continues_from_last_transaction(self):
+        """Checks that the next page starts after the provided transaction"""
+        last_transaction = FinancialTransaction.objects.get(memo="Test Expense Transaction 1")
+
+        new_args = self.valid_args
+        new_args["page_size"] = 2
+        new_args["last_date"] = "2017-06-01"
+        new_args["last_id"] = last_transaction.id
+
+        # Make request
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(self.url, new_args)
+
+        # Check that the remaining transactions were returned
+        self.assertEqual(
+            [transaction.memo for transaction in response.context["transactions"]],
+            ["Test Revenue Transaction 2", "Test Revenue Transaction 1"]
+        )
+        self.assertFalse(response.context["has_more"])
+
+    def test_invalid_last_id_ignored(self):
+        """Checks that an invalid page reference returns the first page"""
+        new_args = self.valid_args
+        new_args["last_date"] = "2017-06-01"
+        new_args["last_id"] = "a"
+
+        # Make request
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(self.url, new_args)
+
+        self.assertEqual(
+            len(response.context["transactions"]),
+            FinancialTransaction.objects.count()
+        )
+
+    def test_query_count_independent_of_page_size(self):
+        """Checks that related data is not queried per transaction"""
+        self.client.login(username="user", password="abcd123456")
+
+        # Count the queries for a single transaction
+        single_args = dict(self.valid_args, page_size=1)
+
+        with CaptureQueriesContext(connection) as single_queries:
+            self.client.get(self.url, single_args)
+
+        # Count the queries for all the transactions
+        multiple_args = dict(self.valid_args, page_size=4)
+
+        with CaptureQueriesContext(connection) as multiple_queries:
+            self.client.get(self.url, multiple_args)
+
+        self.assertEqual(len(single_queries), len(multiple_queries))
+
+    def test_attachment_previews(self):
+        """Checks attachments are shown with a thumbnail preview"""
+        attachment = Attachment.objects.create(location="attachments/receipt.png", sha256="a" * 64)
+        FinancialTransactionMatch.objects.create(
+            transaction=FinancialTransaction.objects.first(), attachment=attachment
+        )
+
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(self.url, self.valid_args)
+
+        self.assertContains(
+            response, reverse("documents:thumbnail", kwargs={"sha256": attachment.sha256})
+        )
+
 class FinancialTransactionAddTest(TestCase):
     """Tests for the financial transaction add view"""
 
@@ -559,3 +666,373 @@ class FinancialTransactionDeleteTest(TestCase):
 
         # Check that redirection was successful
         self.assertRedirects(response, reverse("financial_transactions:dashboard"))
+
+class TransactionPdfTest(TestCase):
+    """Tests for the cached transaction PDF view"""
+    def setUp(self):
+        # Use a new media_root folder so cached PDFs are not shared
+        media_settings = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        create_user()
+
+        transactions = create_financial_transactions()
+        self.transaction = transactions[0]
+
+        FinancialCodeSystem.objects.filter(
+            id=FinancialCodeSystem.objects.order_by("title")[0].id
+        ).update(submission_code=True)
+
+        self.valid_url = reverse(
+            "financial_transactions:pdf", kwargs={"transaction_id": self.transaction.id}
+        )
+
+        self.client.login(username="user", password="abcd123456")
+
+    def create_branch(self):
+        """Creates a branch with a logo in the temporary media root"""
+        logo_file = io.BytesIO()
+        PILImage.new("RGB", (300, 100), "blue").save(logo_file, format="PNG")
+
+        return Branch.objects.create(
+            name_full="Test Branch",
+            name_short="TB",
+            logo=default_storage.save("logo.png", ContentFile(logo_file.getvalue())),
+        )
+
+    def test_pdf_redirect_if_not_logged_in(self):
+        """Checks user is redirected if not logged in"""
+        self.client.logout()
+        response = self.client.get(self.valid_url)
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_pdf_is_rendered_and_cached(self):
+        """Checks that the PDF is returned with an ETag and saved to storage"""
+        self.create_branch()
+
+        response = self.client.get(self.valid_url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+        self.assertIn("ETag", response)
+
+        # Check that one PDF was cached for the transaction
+        folder = "{}/{}".format(PDF_CACHE_FOLDER, self.transaction.id)
+        self.assertEqual(len(default_storage.listdir(folder)[1]), 1)
+
+        # Check that the repeat request returns the same content
+        repeat_response = self.client.get(self.valid_url)
+
+        self.assertEqual(repeat_response["ETag"], response["ETag"])
+        self.assertEqual(repeat_response.content, response.content)
+
+    def test_pdf_not_modified_with_matching_etag(self):
+        """Checks that a matching If-None-Match returns 304"""
+        self.create_branch()
+
+        response = self.client.get(self.valid_url)
+
+        not_modified_response = self.client.get(
+            self.valid_url, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+
+        self.assertEqual(not_modified_response.status_code, 304)
+        self.assertEqual(not_modified_response["ETag"], response["ETag"])
+
+    def test_pdf_etag_changes_with_items(self):
+        """Checks that editing an item replaces the cached PDF"""
+        self.create_branch()
+
+        response = self.client.get(self.valid_url)
+
+        item = self.transaction.items.all().order_by("id")[0]
+        item.description = "Edited description"
+        item.save()
+
+        edited_response = self.client.get(self.valid_url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(edited_response.status_code, 200)
+        self.assertNotEqual(edited_response["ETag"], response["ETag"])
+
+        # Check that the older PDF was removed
+        folder = "{}/{}".format(PDF_CACHE_FOLDER, self.transaction.id)
+        self.assertEqual(len(default_storage.listdir(folder)[1]), 1)
+
+    def test_pdf_logo_is_decoded_once(self):
+        """Checks that the decoded logo is reused between renders"""
+        branch = self.create_branch()
+
+        self.client.get(self.valid_url)
+
+        cached_logos = [
+            reader for key, reader in IMAGE_CACHE.items() if key[0] == branch.logo.name
+        ]
+        self.assertEqual(len(cached_logos), 1)
+
+        # Render a new version of the PDF with the same logo
+        item = self.transaction.items.all().order_by("id")[0]
+        item.amount = 1
+        item.save()
+
+        self.client.get(self.valid_url)
+
+        self.assertIs(
+            [reader for key, reader in IMAGE_CACHE.items() if key[0] == branch.logo.name][0],
+            cached_logos[0]
+        )
+
+class TransactionPdfExportTest(TestCase):
+    """Tests for the batch transaction PDF export"""
+
+    def setUp(self):
+        # Use a new media_root folder for the branch logo
+        media_settings = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        create_user()
+
+        self.transactions = create_financial_transactions()
+
+        FinancialCodeSystem.objects.filter(
+            id=FinancialCodeSystem.objects.order_by("title")[0].id
+        ).update(submission_code=True)
+
+        logo_file = io.BytesIO()
+        PILImage.new("RGB", (100, 100), "red").save(logo_file, format="PNG")
+
+        Branch.objects.create(
+            name_full="Test Branch",
+            name_short="TB",
+            logo=default_storage.save("logo.png", ContentFile(logo_file.getvalue())),
+        )
+
+        self.valid_url = reverse("financial_transactions:pdf_export")
+
+        self.client.login(username="user", password="abcd123456")
+
+    def test_export_redirect_if_not_logged_in(self):
+        """Checks user is redirected if not logged in"""
+        self.client.logout()
+        response = self.client.get(self.valid_url, {"ids": self.transactions[0].id})
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_zip_by_ids(self):
+        """Checks that the selected transactions are returned in a ZIP"""
+        ids = [self.transactions[0].id, self.transactions[1].id]
+
+        response = self.client.get(
+            self.valid_url, {"ids": ",".join(str(transaction_id) for transaction_id in ids)}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+
+        zip_file = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        names = zip_file.namelist()
+
+        self.assertEqual(len(names), 2)
+
+        for name in names:
+            self.assertTrue(zip_file.read(name).startswith(b"%PDF"))
+
+    def test_export_resubmits_cancelled_renders(self):
+        """Checks renders cancelled with a broken pool are rendered again"""
+        submit = concurrent.futures.ProcessPoolExecutor.submit
+        cancelled = []
+
+        def submit_once_cancelled(executor, *args):
+            if cancelled:
+                return submit(executor, *args)
+
+            future = concurrent.futures.Future()
+            future.cancel()
+            cancelled.append(future)
+
+            return future
+
+        with mock.patch.object(
+            concurrent.futures.ProcessPoolExecutor, "submit", autospec=True,
+            side_effect=submit_once_cancelled
+        ):
+            response = self.client.get(
+                self.valid_url,
+                {"ids": ",".join(str(transaction.id) for transaction in self.transactions)},
+            )
+            zip_file = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+        self.assertEqual(len(cancelled), 1)
+        self.assertEqual(len(zip_file.namelist()), len(self.transactions))
+
+    def test_export_merged_pdf_by_dates(self):
+        """Checks that a date range is merged into one PDF"""
+        response = self.client.get(
+            self.valid_url, {"date_start": "2017-01-01", "date_end": "2017-12-31", "format": "pdf"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+
+        # Check the contents page and an outline entry for each transaction
+        reader = PdfReader(io.BytesIO(response.content))
+
+        self.assertIn("Transactions", reader.pages[0].extract_text())
+        self.assertEqual(
+            sorted(entry.title for entry in reader.outline),
+            sorted(str(transaction) for transaction in self.transactions)
+        )
+        self.assertEqual(
+            [reader.get_destination_page_number(entry) for entry in reader.outline][0], 1
+        )
+
+    def test_export_query_count_does_not_scale(self):
+        """Checks that the export data is retrieved in a fixed number of queries"""
+        def count_queries(transaction_ids):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    self.valid_url,
+                    {"ids": ",".join(str(transaction_id) for transaction_id in transaction_ids)},
+                )
+                b"".join(response.streaming_content)
+
+            return len(queries)
+
+        self.assertEqual(
+            count_queries([self.transactions[0].id]),
+            count_queries([transaction.id for transaction in self.transactions]),
+        )
+
+    def test_export_requires_a_selection(self):
+        """Checks that a selection is required and must be valid"""
+        self.assertEqual(self.client.get(self.valid_url).status_code, 400)
+        self.assertEqual(self.client.get(self.valid_url, {"ids": "a,b"}).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.valid_url, {"date_start": "2000-01-01", "date_end": "2000-12-31"}).status_code,
+            404
+        )
+
+    def test_export_command(self):
+        """Checks that the command writes the ZIP and merged PDF"""
+        output_folder = tempfile.mkdtemp()
+        zip_path = os.path.join(output_folder, "transactions.zip")
+        pdf_path = os.path.join(output_folder, "transactions.pdf")
+
+        output = io.StringIO()
+        call_command(
+            "export_transaction_pdfs", zip_path, "--date-start", "2017-01-01", stdout=output
+        )
+
+        self.assertIn("Exported {} transactions".format(len(self.transactions)), output.getvalue())
+
+        with zipfile.ZipFile(zip_path) as zip_file:
+            self.assertEqual(len(zip_file.namelist()), len(self.transactions))
+
+        call_command(
+            "export_transaction_pdfs", pdf_path, "--ids", str(self.transactions[0].id),
+            "--format", "pdf", stdout=io.StringIO()
+        )
+
+        with open(pdf_path, "rb") as pdf_file:
+            self.assertTrue(pdf_file.read().startswith(b"%PDF"))
+
+class TransactionAttachmentsPdfTest(TestCase):
+    """Tests for the attachment review PDF view"""
+    def setUp(self):
+        # Use a new media_root folder for the attachments
+        media_settings = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        create_user()
+
+        self.transaction = create_financial_transactions()[0]
+        self.valid_url = reverse(
+            "financial_transactions:attachments_pdf",
+            kwargs={"transaction_id": self.transaction.id}
+        )
+
+        self.client.login(username="user", password="abcd123456")
+
+    def add_attachment(self, name, content):
+        """Adds an attachment to the transaction"""
+        attachment = Attachment.objects.create(
+            location=default_storage.save(name, ContentFile(content))
+        )
+        FinancialTransactionMatch.objects.create(
+            transaction=self.transaction, attachment=attachment
+        )
+
+    def test_attachments_pdf_redirect_if_not_logged_in(self):
+        """Checks user is redirected if not logged in"""
+        self.client.logout()
+        response = self.client.get(self.valid_url)
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_attachments_pdf_404_without_attachments(self):
+        """Checks a 404 is returned when there is nothing to convert"""
+        response = self.client.get(self.valid_url)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_attachments_are_merged(self):
+        """Checks the attachments and any issues are merged into one PDF"""
+        image_file = io.BytesIO()
+        PILImage.new("RGB", (300, 100), "blue").save(image_file, format="PNG")
+
+        self.add_attachment("receipt.png", image_file.getvalue())
+        self.add_attachment("notes.txt", b"Some plain text notes")
+
+        response = self.client.get(self.valid_url)
+        reader = PdfReader(io.BytesIO(response.content))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(len(reader.pages), 2)
+        self.assertIn("text/plain", reader.pages[1].extract_text())
+
+class UrlConfImportTest(TestCase):
+    """Tests for the cold import of the WSGI application and URLconf"""
+    # Maximum total import time (in seconds) of a cold URLconf import
+    IMPORT_TIME_BUDGET = 3.0
+
+    def test_urlconf_import_time(self):
+        """Checks the URLconf imports within budget and without ReportLab"""
+        environment = os.environ.copy()
+        environment.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.development")
+
+        result = subprocess.run(
+            [
+                sys.executable, "-X", "importtime", "-c",
+                (
+                    "import sys, config.wsgi;"
+                    "from django.urls import get_resolver;"
+                    "get_resolver().url_patterns;"
+                    "print(','.join(sorted(sys.modules)))"
+                ),
+            ],
+            capture_output=True,
+            check=True,
+            cwd=str(settings.ROOT_DIR),
+            env=environment,
+            text=True,
+        )
+
+        # Check that the PDF libraries are only imported when needed
+        modules = result.stdout.strip().split(",")
+        self.assertNotIn("reportlab", modules)
+        self.assertNotIn("financial_transactions.rendering", modules)
+
+        # Sum the self import time (in microseconds) of each module
+        import_time = 0
+
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "self [us]" not in line:
+                import_time += int(line.split(":", 1)[1].split("|")[0])
+
+        self.assertLess(import_time / 1000000, self.IMPORT_TIME_BUDGET)
@@ -57,3 +57,8 @@ class FinancialCodeWithYearIDTest(TestCase):
             str(self.form["code"]),
             select_html
         )
+
+    def test_render_without_queries(self):
+        """Checks that rendering the options does not query the database"""
+        with self.assertNumQueries(0):
+            str(self.form["code"])
@@ -3,7 +3,8 @@ from django.urls import path, re_path
 
 from .views import (
     dashboard, request_transactions_list, transaction_add,
-    transaction_edit, transaction_delete, transaction_pdf,
+    transaction_edit, transaction_delete, transaction_pdf, transaction_pdf_export,
+    transaction_attachments_pdf,
 )
 
 app_name = "financial_transactions"
@@ -13,6 +14,8 @@ urlpatterns = [
     re_path(r'^(?P<t_type>(expense|revenue))/edit/(?P<transaction_id>\d+)/$', transaction_edit, name="edit",),
     re_path(r'^(?P<t_type>(expense|revenue))/delete/(?P<transaction_id>\d+)/$', transaction_delete, name="delete",),
     path('pdf/<int:transaction_id>/', transaction_pdf, name="pdf",),
+    path('pdf/export/', transaction_pdf_export, name="pdf_export",),
+    path('pdf/<int:transaction_id>/attachments/', transaction_attachments_pdf, name="attachments_pdf",),
     path('retrieve-transactions/', request_transactions_list),
     path('', dashboard, name="dashboard"),
 ]
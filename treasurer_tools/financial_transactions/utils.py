@@ -0,0 +1,110 @@
+"""Objects and functions supporting the financial_transactions app"""
+import hashlib
+import json
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import FinancialTransaction
+
+
+# Storage folder for the rendered transaction PDFs
+PDF_CACHE_FOLDER = "pdf_cache/transactions"
+
+def get_latest_history_id(instance):
+    """Returns the ID of the latest history record of an instance"""
+    if instance is None:
+        return None
+
+    return instance.history.order_by("-history_id").values_list("history_id", flat=True).first()
+
+def get_transaction_pdf_key(transaction, branch_details, user):
+    """Returns a hash of the content rendered in a transaction PDF
+
+        Combines the history versions of the transaction, payee/payer
+        and branch, the items and their submission codes, the
+        rendering user and the date (printed on the PDF). The
+        transaction should be retrieved with with_submission_codes().
+    """
+    items = []
+
+    for item in transaction.items.all():
+        code = item.get_submission_code
+
+        items.append([
+            item.id,
+            item.date_item,
+            item.description,
+            item.amount,
+            item.gst,
+            code.code if code else None,
+            code.financial_code_group.budget_year.short_name if code else None,
+        ])
+
+    content = {
+        "transaction": get_latest_history_id(transaction),
+        "payee_payer": get_latest_history_id(transaction.payee_payer),
+        "branch": get_latest_history_id(branch_details),
+        "user": [user.id, user.name],
+        "date": timezone.localdate(),
+        "items": items,
+    }
+
+    return hashlib.sha256(
+        json.dumps(content, default=str, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+def get_transaction_pdf_name(transaction_id, user_id, key):
+    """Returns the storage name of a cached transaction PDF"""
+    return posixpath.join(
+        PDF_CACHE_FOLDER, str(transaction_id), "{}-{}.pdf".format(user_id, key)
+    )
+
+def get_cached_transaction_pdf(transaction_id, user_id, key):
+    """Returns the cached PDF content (or None if not cached)"""
+    name = get_transaction_pdf_name(transaction_id, user_id, key)
+
+    if not default_storage.exists(name):
+        return None
+
+    with default_storage.open(name, "rb") as pdf_file:
+        return pdf_file.read()
+
+def save_cached_transaction_pdf(transaction_id, user_id, key, content):
+    """Saves rendered PDF content and removes the user's older versions"""
+    name = get_transaction_pdf_name(transaction_id, user_id, key)
+    folder, file_name = posixpath.split(name)
+
+    if default_storage.exists(folder):
+        prefix = "{}-".format(user_id)
+
+        for old_name in default_storage.listdir(folder)[1]:
+            if old_name.startswith(prefix) and old_name != file_name:
+                default_storage.delete(posixpath.join(folder, old_name))
+
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+
+def get_export_transactions(transaction_ids=None, date_start=None, date_end=None):
+    """Returns the transactions to export with all their PDF data
+
+        Transactions are selected by ID and/or submission date and
+        retrieved with their totals, payee/payer, items and
+        submission codes in a few queries.
+    """
+    transactions = FinancialTransaction.objects.with_totals().with_submission_codes().select_related(
+        "payee_payer"
+    ).order_by("date_submitted", "id")
+
+    if transaction_ids is not None:
+        transactions = transactions.filter(id__in=transaction_ids)
+
+    if date_start:
+        transactions = transactions.filter(date_submitted__gte=date_start)
+
+    if date_end:
+        transactions = transactions.filter(date_submitted__lte=date_end)
+
+    return transactions
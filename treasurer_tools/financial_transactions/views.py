@@ -1,336 +1,30 @@
 """Views for the transactions app"""
 
-from datetime import datetime
-from reportlab import lib
-from reportlab.lib.units import mm
-from reportlab.platypus import (
-    Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
-)
-
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.files.storage import default_storage
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db.models import Prefetch, Q
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse,
+)
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import quote_etag
 
 from branch_details.models import Branch
-
-from treasurer_tools.pdf.styles import STYLES
-from treasurer_tools.pdf.canvases import PageNumCanvas
+from documents.models import Attachment, FinancialTransactionMatch
 
 from .forms import CompiledForms
-from .models import FinancialTransaction
-
-def generate_pdf_header(branch_details, transaction):
-    # Access image from the storage module (in case not saved locally)
-    logo_storage = default_storage.open(branch_details.logo.name, 'rb')
-
-    # Get and resize logo (max height = 25 mm, max width = 75 mm)
-    logo_details = lib.utils.ImageReader(logo_storage)
-    width, height = logo_details.getSize()
-
-    # Ensure logo file is open for next steps
-    logo_storage.open()
-
-    # If aspect ratio > 1/3, need to scale by max height
-    if (height / width) > 0.333:
-        logo = Image(
-            logo_storage,
-            width=((25 * mm) / height) * width,
-            height=25 * mm,
-        )
-    # Otherwise, need to scale by max width
-    else:
-        logo = Image(
-            logo_storage,
-            width=75 * mm,
-            height=((75 * mm) / width) * height,
-        )
-
-    if transaction.transaction_type == 'e':
-        header_title = 'Branch Expense Claim Form'
-    else:
-        header_title = 'Branch Deposit Form'
-
-    header_table = Table(
-        [[logo, header_title]],
-        colWidths=[90 * mm, 90 * mm],
-    )
-
-    header_table.setStyle(TableStyle([
-        ('FONT', (0, 0), (-1, -1), 'Helvetica-Bold', 16),
-        ('ALIGNMENT', (0, 0), (0, 0), 'LEFT'),
-        ('ALIGNMENT', (1, 0), (1, 0), 'RIGHT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
-
-    # Close logo file
-    logo_storage.close()
-
-    return header_table
-
-def generate_pdf_transaction_details(branch_details, transaction):
-    # Get all relevant details
-    branch_name = branch_details.name_full if branch_details.name_full else ''
-    payee_payer = transaction.payee_payer
-    name = payee_payer.name if payee_payer.name else ''
-    address = payee_payer.address if payee_payer.address else ''
-    city = payee_payer.city if payee_payer.city else ''
-    province = payee_payer.province if payee_payer.province else ''
-    postal_code = payee_payer.postal_code if payee_payer.postal_code else ''
-    phone = payee_payer.phone if payee_payer.phone else ''
-
-    # Table to hold the payee/payer details
-
-    details_table = Table(
-        [
-            [
-                'Branch Name:',
-                Paragraph(branch_name, STYLES['normal'])
-            ],
-            [
-                'Payee Name:',
-                Paragraph(name, STYLES['normal'])
-            ],
-            [
-                'Payee Address:',
-                Paragraph(address, STYLES['normal_center'])
-            ],
-            ['', 'Mailing address'],
-            [
-                '',
-                Paragraph(city, STYLES['normal_center']),
-                Paragraph(province, STYLES['normal_center']),
-                Paragraph(postal_code, STYLES['normal_center']),
-                Paragraph(phone, STYLES['normal_center'])],
-            ['', 'City', 'Province', 'Postal Code', 'Telephone'],
-        ],
-        colWidths=[40 * mm, 65 * mm, 20 * mm, 25 * mm, 40 * mm]
-    )
-
-    details_table.setStyle(TableStyle([
-        # Overall table styles
-        ('FONT', (0, 0), (-1, -1), 'Helvetica', 12),
-
-
-        # Branch Name styles
-        ('FONT', (0, 0), (0, -1), 'Helvetica-Bold', 10),
-        ('LINEBELOW', (1, 0), (-1, 0), 1, lib.colors.black),
-        ('SPAN', (1, 0), (-1, 0)),
-
-        # Payee/Payer Name styles
-        ('LINEBELOW', (1, 1), (-1, 1), 1, lib.colors.black),
-        ('SPAN', (1, 1), (-1, 1)),
-
-        # Payee/Payer Address styles
-        ('FONT', (1, 3), (-1, 3), 'Helvetica-Oblique', 8),
-        ('FONT', (1, 5), (-1, 5), 'Helvetica-Oblique', 8),
-        ('LINEBELOW', (1, 2), (-1, 2), 1, lib.colors.black),
-        ('LINEBELOW', (1, 4), (-1, 4), 1, lib.colors.black),
-        ('SPAN', (1, 2), (-1, 2)),
-        ('SPAN', (1, 3), (-1, 3)),
-        ('ALIGNMENT', (1, 2), (-1, 5), 'CENTER'),
-        ('VALIGN', (1, 3), (-1, 3), 'TOP'),
-        ('VALIGN', (1, 5), (-1, 5), 'TOP'),
-    ]))
-
-    return details_table
-
-def generate_pdf_transaction_items(transaction):
-    # Header data for the items table
-    items_rows = [
-        [
-            Paragraph(
-                'Purchase Date YYYY-MMM-DD',
-                STYLES['bold_tiny_center']
-            ),
-            Paragraph('Description', STYLES['bold_tiny_center']),
-            Paragraph('Amount Before Tax', STYLES['bold_tiny_center']),
-            Paragraph('GST/HST', STYLES['bold_tiny_center']),
-            Paragraph('Total', STYLES['bold_tiny_center']),
-            Paragraph('Budget Year', STYLES['bold_tiny_center']),
-            Paragraph('Account Code', STYLES['bold_tiny_center']),
-        ],
-    ]
-
-    # Add each transaction item
-    items = transaction.items.all()
-
-    for item in items:
-        # Get financial code details for item
-        code = item.get_submission_code
-
-        items_rows.append([
-            item.date_item.strftime('%Y-%b-%d'),
-            Paragraph(item.description, STYLES['normal_tiny']),
-            '${}'.format(item.amount),
-            '${}'.format(item.gst),
-            '${}'.format(item.total),
-            Paragraph(
-                code.financial_code_group.budget_year.short_name,
-                STYLES['normal_tiny_center']
-            ),
-            code.code,
-        ])
-
-    # Add the table footer
-    items_rows.append([
-        '',
-        'TOTAL',
-        '${}'.format(transaction.total_before_tax),
-        '${}'.format(transaction.total_tax),
-        '${}'.format(transaction.total),
-        '',
-        ''
-    ])
-
-    items_table = Table(
-        items_rows,
-        colWidths=[
-            25 * mm, 55 * mm, 20 * mm, 20 * mm, 20 * mm, 30 * mm, 20 * mm
-        ]
-    )
-
-    items_table.setStyle(TableStyle([
-        # Overall table styles
-        ('FONT', (0, 0), (-1, -1), 'Helvetica', 8),
-        ('BOX', (0, 0), (-1, -2), 1, lib.colors.black),
-        ('INNERGRID', (0, 0), (-1, -2), 1, lib.colors.black),
-        ('ALIGNMENT', (0, 0), (-1, 0), 'CENTRE'),
-
-        # Header styles
-        ('BACKGROUND', (0, 0), (-1, 0), lib.colors.lightgrey),
-
-        # Item styles
-        ('VALIGN', (0, 1), (-1, -2), 'TOP'),
-
-        # Date styles
-        ('ALIGNMENT', (0, 0), (0, -1), 'CENTRE'),
-
-        # Dollar amount styles
-        ('FONTSIZE', (2, 1), (4, -1), 8),
-        ('ALIGNMENT', (2, 1), (4, -1), 'RIGHT'),
-
-        # Account code styles
-        ('ALIGNMENT', (5, 1), (6, -1), 'CENTRE'),
-
-        # Footer style
-        ('FONT', (1, -1), (4, -1), 'Helvetica-Bold'),
-        ('BACKGROUND', (2, -1), (4, -1), lib.colors.lightgrey),
-        ('BOX', (2, -1), (4, -1), 1, lib.colors.black),
-        ('INNERGRID', (2, -1), (4, -1), 1, lib.colors.black),
-        ('ALIGNMENT', (1, -1), (4, -1), 'RIGHT'),
-        ('VALIGN', (1, -1), (4, -1), 'MIDDLE'),
-    ]))
-
-    return items_table
-
-def generate_pdf_transaction_notes(transaction):
-    # Table to hold any transation notes
-    notes_table = Table(
-        [
-            ['Notes:', Paragraph('', STYLES['normal'])],
-        ],
-        colWidths=[20 * mm, 170 * mm],
-    )
-
-    return notes_table
-
-def generate_pdf_submission_details(transaction, user_name):
-    # TODO: Use proper submission tracking details in this section
-    base_style = [
-        # Overall table styles
-        ('FONT', (0, 0), (-1, -1), 'Helvetica', 10, 9),
-        ('FONT', (0, 2), (-1, 2), 'Helvetica-Oblique', 8, 8),
-        ('FONT', (0, 4), (-1, 4), 'Helvetica-Oblique', 8, 8),
-        ('FONT', (0, 6), (-1, 6), 'Helvetica-Oblique', 8, 8),
-        ('ALIGNMENT', (0, 0), (-1, -1), 'CENTRE'),
-
-        # Header style
-        ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', 8, 10),
-        ('BACKGROUND', (0, 0), (-1, 0), lib.colors.lightgrey),
-        ('BOX', (0, 0), (-1, 0), 1, lib.colors.black),
-        ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'),
-
-        # Submitted by styles
-        ('BOX', (0, 0), (2, -1), 1, lib.colors.black),
-        ('LINEBELOW', (1, 1), (1, 1), 0.5, lib.colors.black),
-        ('LINEBELOW', (1, 5), (1, 5), 0.5, lib.colors.black),
-
-        # Authorized by or Processed by styles
-        ('BOX', (3, 0), (5, -1), 1, lib.colors.black),
-        ('LINEBELOW', (4, 1), (4, 1), 0.5, lib.colors.black),
-        ('LINEBELOW', (4, 3), (4, 3), 0.5, lib.colors.black),
-        ('LINEBELOW', (4, 5), (4, 5), 0.5, lib.colors.black),
-    ]
-
-    if transaction.transaction_type == 'e':
-        submission_table = Table(
-            [
-                ['', 'SUBMITTED BY', '', '', 'AUTHORIZED BY', '', '', 'PROCESSED BY', ''],
-                [
-                    '', transaction.submitter, '',
-                    '', user_name, '',
-                    '', user_name, ''
-                ],
-                ['', 'Name', '', '', 'Name', '', '', 'Name', ''],
-                [
-                    '', '', '',
-                    '', 'CSHP-AB Treasurer', '',
-                    '', 'CSHP-AB Treasurer', ''
-                ],
-                ['', '', '', '', 'Position', '', '', 'Position', ''],
-                [
-                    '', transaction.date_submitted.strftime('%Y-%b-%d'), '',
-                    '', datetime.today().strftime('%Y-%b-%d'), '',
-                    '', datetime.today().strftime('%Y-%b-%d'), ''
-                ],
-                ['', 'Date', '', '', 'Date', '', '', 'Date', ''],
-            ],
-            colWidths=[
-                2 * mm, 59 * mm, 2 * mm,
-                2 * mm, 60 * mm, 2 * mm,
-                2 * mm, 59 * mm, 2 * mm
-            ],
-        )
-
-        # Add the additional processed by styles
-        base_style.append(('BOX', (6, 0), (8, -1), 1, lib.colors.black))
-        base_style.append(('LINEBELOW', (7, 1), (7, 1), 0.5, lib.colors.black))
-        base_style.append(('LINEBELOW', (7, 3), (7, 3), 0.5, lib.colors.black))
-        base_style.append(('LINEBELOW', (7, 5), (7, 5), 0.5, lib.colors.black))
-    else:
-        submission_table = Table(
-            [
-                ['', 'SUBMITTED BY', '', '', 'PROCESSED BY', ''],
-                [
-                    '', transaction.submitter, '',
-                    '', user_name, '',
-                ],
-                ['', 'Name', '', '', 'Name', ''],
-                [
-                    '', '', '',
-                    '', 'CSHP-AB Treasurer', ''
-                ],
-                ['', '', '', '', 'Position', ''],
-                [
-                    '', transaction.date_submitted.strftime('%Y-%b-%d'), '',
-                    '', datetime.today().strftime('%Y-%b-%d'), ''
-                ],
-                ['', 'Date', '', '', 'Date', ''],
-            ],
-            colWidths=[
-                2 * mm, 59 * mm, 2 * mm,
-                2 * mm, 60 * mm, 2 * mm,
-                2 * mm, 59 * mm, 2 * mm
-            ],
-        )
-
-    # Apply table styles
-    submission_table.setStyle(TableStyle(base_style))
+from .models import FinancialTransaction, FinancialCodeMatch
+from .utils import (
+    get_cached_transaction_pdf, get_export_transactions, get_transaction_pdf_key,
+    save_cached_transaction_pdf,
+)
 
-    return submission_table
+# Number of transactions returned per request_transactions_list page
+TRANSACTIONS_PAGE_SIZE = 25
+TRANSACTIONS_PAGE_SIZE_MAX = 100
 
 @login_required
 def dashboard(request):
@@ -339,10 +33,27 @@ def dashboard(request):
 
 @login_required
 def request_transactions_list(request):
-    """Retrieves list of transactions"""
-
-    # Get all transactions
-    transactions = FinancialTransaction.objects.all().order_by("-date_submitted")
+    """Retrieves a page of transactions (newest first)
+
+        Pages are retrieved with a keyset on (date_submitted, id). The
+        last_date and last_id parameters are the values of the final
+        transaction of the previous page.
+    """
+    # Get all transactions with the related data the template uses
+    transactions = FinancialTransaction.objects.with_totals().select_related(
+        "payee_payer"
+    ).prefetch_related(
+        Prefetch(
+            "items__financialcodematch_set",
+            queryset=FinancialCodeMatch.objects.select_related(
+                "financial_code__financial_code_group__budget_year__financial_code_system"
+            ),
+        ),
+        Prefetch(
+            "financialtransactionmatch_set",
+            queryset=FinancialTransactionMatch.objects.select_related("attachment").order_by("id"),
+        ),
+    ).order_by("-date_submitted", "-id")
 
     # Filter by type
     transaction_type = request.GET.get("transaction_type", "a")
@@ -362,11 +73,41 @@ def request_transactions_list(request):
     if date_end:
         transactions = transactions.filter(date_submitted__lte=date_end)
 
+    # Continue from the end of the previous page (if provided)
+    try:
+        last_date = parse_date(request.GET.get("last_date", ""))
+        last_id = int(request.GET.get("last_id", ""))
+    except ValueError:
+        last_date = None
+        last_id = None
+
+    if last_date and last_id:
+        transactions = transactions.filter(
+            Q(date_submitted__lt=last_date)
+            | (Q(date_submitted=last_date) & Q(id__lt=last_id))
+        )
+
+    # Determine the page size
+    try:
+        page_size = min(int(request.GET.get("page_size", "")), TRANSACTIONS_PAGE_SIZE_MAX)
+    except ValueError:
+        page_size = TRANSACTIONS_PAGE_SIZE
+
+    if page_size < 1:
+        page_size = TRANSACTIONS_PAGE_SIZE
+
+    # Retrieve one extra transaction to check for another page
+    page = list(transactions[:page_size + 1])
+    has_more = len(page) > page_size
+    page = page[:page_size]
+
     return render(
         request,
         "transactions/transactions.html",
         context={
-            "transactions": transactions
+            "transactions": page,
+            "has_more": has_more,
+            "last_transaction": page[-1] if page else None,
         }
     )
 
@@ -375,7 +116,9 @@ def transaction_add(request, t_type):
     """Generates and processes form to add a transaction"""
     # POST request - try and save data
     if request.method == "POST":
-        compiled_forms = CompiledForms(t_type, "POST", request.POST, request.FILES)
+        compiled_forms = CompiledForms(
+            t_type, "POST", request.POST, request.FILES, user=request.user
+        )
 
         if compiled_forms.is_valid():
             compiled_forms.save()
@@ -406,7 +149,8 @@ def transaction_edit(request, t_type, transaction_id):
     # POST request - try and save data
     if request.method == "POST":
         compiled_forms = CompiledForms(
-            t_type, "POST", request.POST, request.FILES, transaction_id=transaction_id
+            t_type, "POST", request.POST, request.FILES, user=request.user,
+            transaction_id=transaction_id
         )
 
         if compiled_forms.is_valid():
@@ -460,53 +204,132 @@ def transaction_delete(request, t_type, transaction_id):
 
 @login_required
 def transaction_pdf(request, transaction_id):
-    """Generates a PDF version of the provided transaction"""
+    """Generates a PDF version of the provided transaction
 
-    # Set the PDF metadata
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'filename="somefilename.pdf"'
-    response['title'] = 'Test'
+        Rendered PDFs are cached in storage under a hash of their
+        content, which is also used as the response ETag.
+    """
+    # Import ReportLab only when a PDF is requested
+    # pylint: disable=import-outside-toplevel
+    from .rendering import render_transaction_pdf
 
     # Get the branch details for the header (currently uses last entry)
     # TODO: Allow for multiple branches with different details
     branch_details = Branch.objects.last()
 
     # Get the transaction instance
-    transaction = get_object_or_404(FinancialTransaction, id=transaction_id)
-
-    # Generate a PDF title
-    pdf_title = '{}.pdf'.format(str(transaction))
-
-    # Create the PDF object, using the response object as its "file."
-    # Page size = 8.5" or 215.9 mm - rounded to 215 mm
-    doc = SimpleDocTemplate(
-        response,
-        pagesize=lib.pagesizes.letter,
-        title=pdf_title,
-        topMargin=12.5 * mm,
-        rightMargin=12.5 * mm,
-        bottomMargin=12.5 * mm,
-        leftMargin=12.5 * mm,
+    transaction = get_object_or_404(
+        FinancialTransaction.objects.with_totals().with_submission_codes().select_related(
+            'payee_payer'
+        ),
+        id=transaction_id
     )
 
-    elements = []
+    # Return early if the client has the current version
+    pdf_key = get_transaction_pdf_key(transaction, branch_details, request.user)
+    etag = quote_etag(pdf_key)
 
-    elements.append(generate_pdf_header(branch_details, transaction))
-    elements.append(Spacer(190 * mm, 10))
-    elements.append(generate_pdf_transaction_details(branch_details, transaction))
-    elements.append(Spacer(190 * mm, 10))
-    elements.append(generate_pdf_transaction_items(transaction))
-    elements.append(Spacer(190 * mm, 10))
+    response = get_conditional_response(request, etag=etag)
 
-    if transaction.submission_notes:
-        elements.append(generate_pdf_transaction_notes(transaction))
-        elements.append(Spacer(190 * mm, 10))
+    if response is None:
+        pdf_content = get_cached_transaction_pdf(transaction.id, request.user.id, pdf_key)
 
-    elements.append(
-        generate_pdf_submission_details(transaction, request.user.name)
-    )
+        if pdf_content is None:
+            pdf_content = render_transaction_pdf(branch_details, transaction, request.user.name)
+            save_cached_transaction_pdf(transaction.id, request.user.id, pdf_key, pdf_content)
+
+        # Set the PDF metadata
+        response = HttpResponse(pdf_content, content_type='application/pdf')
+        response['Content-Disposition'] = 'filename="somefilename.pdf"'
+        response['title'] = 'Test'
+
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+
+    return response
+
+@login_required
+def transaction_pdf_export(request):
+    """Exports the PDFs of many transactions
+
+        Transactions are selected with a comma separated list of IDs
+        (ids) and/or a date range (date_start and date_end). The PDFs
+        are streamed as a ZIP file or, with format=pdf, merged into
+        one PDF with a table of contents.
+    """
+    # Import ReportLab only when a PDF is requested
+    # pylint: disable=import-outside-toplevel
+    from .rendering import render_transaction_pdf_book, stream_transaction_pdf_zip
+
+    # Get the transaction IDs
+    try:
+        transaction_ids = [
+            int(transaction_id) for transaction_id in request.GET.get('ids', '').split(',')
+            if transaction_id.strip()
+        ]
+    except ValueError:
+        return HttpResponseBadRequest('Transaction IDs must be integers.')
+
+    # Get the date range
+    try:
+        date_start = parse_date(request.GET.get('date_start', ''))
+        date_end = parse_date(request.GET.get('date_end', ''))
+    except ValueError:
+        return HttpResponseBadRequest('Dates must be in the format yyyy-mm-dd.')
+
+    if not transaction_ids and not date_start and not date_end:
+        return HttpResponseBadRequest('Provide transaction IDs or a date range.')
+
+    transactions = list(get_export_transactions(
+        transaction_ids=transaction_ids or None, date_start=date_start, date_end=date_end
+    ))
+
+    if not transactions:
+        raise Http404('No transactions match the provided IDs or dates.')
 
-    # Assemble and return the final PDF document
-    doc.build(elements, canvasmaker=PageNumCanvas)
+    # Get the branch details for the header (currently uses last entry)
+    branch_details = Branch.objects.last()
+
+    if request.GET.get('format') == 'pdf':
+        response = HttpResponse(
+            render_transaction_pdf_book(branch_details, transactions, request.user.name),
+            content_type='application/pdf',
+        )
+        response['Content-Disposition'] = 'attachment; filename="transactions.pdf"'
+    else:
+        response = StreamingHttpResponse(
+            stream_transaction_pdf_zip(branch_details, transactions, request.user.name),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = 'attachment; filename="transactions.zip"'
+
+    return response
+
+@login_required
+def transaction_attachments_pdf(request, transaction_id):
+    """Converts the attachments of a transaction into one PDF for review
+
+        Any attachments that could not be converted are listed on the
+        final page of the PDF.
+    """
+    # Import the conversion libraries only when a PDF is requested
+    # pylint: disable=import-outside-toplevel
+    from documents.services import create_review_pdf
+
+    transaction = get_object_or_404(FinancialTransaction, id=transaction_id)
+
+    attachments = Attachment.objects.filter(
+        financialtransactionmatch__transaction=transaction
+    ).order_by('date_uploaded', 'id')
+
+    if not attachments:
+        raise Http404('This transaction has no attachments.')
+
+    pdf_content, _ = create_review_pdf(attachments)
+
+    response = HttpResponse(pdf_content, content_type='application/pdf')
+    response['Content-Disposition'] = 'filename="transaction-{}-attachments.pdf"'.format(
+        transaction.id
+    )
 
     return response
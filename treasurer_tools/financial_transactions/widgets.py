@@ -2,11 +2,19 @@
 
 from django.forms.widgets import Select
 
-from financial_codes.models import FinancialCode
-
 
 class FinancialCodeWithYearID(Select):
-    """Select widget that allows data-attribute addition to options"""
+    """Select widget that allows data-attribute addition to options
+
+        The budget year IDs are taken from the year_ids dictionary
+        (financial code ID to budget year ID), which is supplied by
+        the form when the choices are built.
+    """
+    def __init__(self, attrs=None, choices=(), year_ids=None):
+        super(FinancialCodeWithYearID, self).__init__(attrs, choices)
+
+        self.year_ids = year_ids or {}
+
     # pylint: disable=too-many-arguments
     def create_option(self, name, value, label, selected, index, subindex=None, attrs=None):
         """Modifies function to include the financial code system ID"""
@@ -14,9 +22,9 @@ class FinancialCodeWithYearID(Select):
             name, value, label, selected, index, subindex, attrs
         )
 
-        # Use the option value (i.e. the model ID) to retrieve budget year ID
+        # Use the option value (i.e. the model ID) to look up budget year ID
         if option["value"]:
-            year_id = FinancialCode.objects.get(id=option["value"]).financial_code_group.budget_year.id
+            year_id = self.year_ids.get(str(option["value"]), "")
         else:
             year_id = ""
 
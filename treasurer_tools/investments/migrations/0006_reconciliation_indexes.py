@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_reconciliation', '0002_alter_historicalreconciliationgroup_options_and_more'),
+        ('investments', '0005_alter_historicalinvestment_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='investmentdetail',
+            index=models.Index(condition=models.Q(('reconciled__isnull', True)), fields=['date_investment'], name='investment_detail_unreconciled'),
+        ),
+        migrations.AddIndex(
+            model_name='investmentdetail',
+            index=models.Index(fields=['reconciled', 'date_investment'], name='investment_detail_reconciled'),
+        ),
+    ]
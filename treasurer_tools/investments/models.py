@@ -54,5 +54,19 @@ class InvestmentDetail(models.Model):
         related_name="investmentdetails",
     )
 
+    class Meta:
+        indexes = [
+            # Supports the reconciliation queries for unreconciled details
+            models.Index(
+                fields=["date_investment"],
+                condition=models.Q(reconciled__isnull=True),
+                name="investment_detail_unreconciled",
+            ),
+            models.Index(
+                fields=["reconciled", "date_investment"],
+                name="investment_detail_reconciled",
+            ),
+        ]
+
     def __str__(self):
         return "{} ({} ${})".format(self.investment, self.detail_status, self.amount)
@@ -3,40 +3,51 @@ from reportlab.lib.units import mm
 from reportlab.pdfgen import canvas
 
 class PageNumCanvas(canvas.Canvas):
-    """
-    http://code.activestate.com/recipes/546511-page-x-of-y-with-reportlab/
-    http://code.activestate.com/recipes/576832/
+    """Canvas that adds "Page x of y" to each page
+
+        Each page references a form for its page number that is only
+        defined once the page count is known at save. Pages are written
+        out as they finish (rather than kept until save), so memory
+        does not grow with the page state of long documents.
     """
     # pylint: disable=abstract-method
 
     def __init__(self, *args, **kwargs):
         """Constructor"""
         canvas.Canvas.__init__(self, *args, **kwargs)
-        self.pages = []
+        self.page_count = 0
 
     def showPage(self):
-        """On a page break, add information to the list"""
-        self.pages.append(dict(self.__dict__))
-        self._startPage()
+        """On a page break, reference the page number form"""
+        self.page_count += 1
+        self.doForm(self.get_page_number_form_name(self.page_count))
+        canvas.Canvas.showPage(self)
 
     def save(self):
-        """Add the page number to each page (page x of y)"""
-        page_count = len(self.pages)
+        """Define the page number form of each page (page x of y)"""
+        # Include any final page that was not shown
+        if self._code:
+            self.showPage()
 
-        for page in self.pages:
-            self.__dict__.update(page)
-            self.draw_page_number(page_count)
-            canvas.Canvas.showPage(self)
+        for page_number in range(1, self.page_count + 1):
+            self.beginForm(self.get_page_number_form_name(page_number))
+            self.draw_page_number(page_number, self.page_count)
+            self.endForm()
 
         canvas.Canvas.save(self)
 
-    def draw_page_number(self, page_count):
+    @staticmethod
+    def get_page_number_form_name(page_number):
+        """Returns the form name for a page number"""
+        return "page_number_{}".format(page_number)
+
+    def draw_page_number(self, page_number, page_count):
         """Add the page number"""
         # Add a line to mark the footer
         # self.setLineWidth(1)
         # self.line(12.5 * mm, 20 * mm, 203.5 * mm, 20 * mm)
 
         # Add the page number
-        page = "Page {} of {}".format(self._pageNumber, page_count)
+        page = "Page {} of {}".format(page_number, page_count)
         self.setFont("Helvetica", 9)
         self.drawRightString(200 * mm, 15 * mm, page)
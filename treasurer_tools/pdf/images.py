@@ -0,0 +1,72 @@
+"""The image helpers used for PDF generation."""
+import hashlib
+import io
+
+from django.core.files.storage import default_storage
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Image
+
+
+# Decoded images keyed by (file name, modified time)
+IMAGE_CACHE = {}
+
+# Decoded images keyed by the digest of their content
+CONTENT_IMAGE_CACHE = {}
+
+def get_image_reader(name):
+    """Returns a decoded ImageReader for a file in storage
+
+        Decoded images are kept for the life of the process and are
+        reloaded when the file's modified time changes. Storages that
+        cannot report a modified time are read on every call.
+    """
+    try:
+        modified_time = default_storage.get_modified_time(name)
+    except (NotImplementedError, OSError):
+        modified_time = None
+
+    key = (name, modified_time)
+
+    if modified_time is None or key not in IMAGE_CACHE:
+        with default_storage.open(name, 'rb') as image_file:
+            image_reader = ImageReader(io.BytesIO(image_file.read()))
+
+        # Decode the image now so the cached reader can be shared
+        image_reader.getRGBData()
+
+        if modified_time is None:
+            return image_reader
+
+        # Remove any older versions of this file
+        for cached_key in [cached_key for cached_key in IMAGE_CACHE if cached_key[0] == name]:
+            IMAGE_CACHE.pop(cached_key, None)
+
+        IMAGE_CACHE[key] = image_reader
+
+    return IMAGE_CACHE[key]
+
+def get_content_image_reader(content):
+    """Returns a decoded ImageReader for image content
+
+        Used by the PDF worker processes, which receive the image
+        content instead of reading the storage. Only the latest image
+        is kept, as the workers render one branch logo.
+    """
+    key = hashlib.sha256(content).hexdigest()
+
+    if key not in CONTENT_IMAGE_CACHE:
+        image_reader = ImageReader(io.BytesIO(content))
+        image_reader.getRGBData()
+
+        CONTENT_IMAGE_CACHE.clear()
+        CONTENT_IMAGE_CACHE[key] = image_reader
+
+    return CONTENT_IMAGE_CACHE[key]
+
+class ReaderImage(Image):
+    """A platypus Image drawn from an already decoded ImageReader"""
+    def __init__(self, image_reader, width=None, height=None, **kwargs):
+        # Set the image first so it is not read from the file again
+        self._img = image_reader
+
+        super().__init__(io.BytesIO(), width=width, height=height, **kwargs)
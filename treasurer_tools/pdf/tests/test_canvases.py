@@ -0,0 +1,50 @@
+"""Test cases for the PDF canvases"""
+
+import io
+
+from django.test import SimpleTestCase
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate
+
+from treasurer_tools.pdf.canvases import PageNumCanvas
+from treasurer_tools.pdf.styles import STYLES
+
+
+class PageNumCanvasTest(SimpleTestCase):
+    """Tests for the page numbering canvas"""
+
+    def build_pdf(self, page_count):
+        """Builds an uncompressed PDF with the number of pages"""
+        pdf_file = io.BytesIO()
+        doc = SimpleDocTemplate(pdf_file, pageCompression=0)
+
+        elements = []
+
+        for page_number in range(page_count):
+            if page_number:
+                elements.append(PageBreak())
+
+            elements.append(Paragraph("Page content {}".format(page_number), STYLES["normal"]))
+
+        doc.build(elements, canvasmaker=PageNumCanvas)
+
+        return pdf_file.getvalue()
+
+    def test_page_numbers(self):
+        """Tests that each page is numbered with the final page count"""
+        content = self.build_pdf(3)
+
+        for page_number in range(1, 4):
+            self.assertIn("(Page {} of 3)".format(page_number).encode(), content)
+
+        self.assertNotIn(b"(Page 4 of", content)
+
+    def test_single_page(self):
+        """Tests that a single page document is numbered"""
+        self.assertIn(b"(Page 1 of 1)", self.build_pdf(1))
+
+    def test_many_pages(self):
+        """Tests that long documents number every page"""
+        content = self.build_pdf(300)
+
+        self.assertIn(b"(Page 1 of 300)", content)
+        self.assertIn(b"(Page 300 of 300)", content)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     """Configuration for reports app"""
     name = "reports"
+
+    def ready(self):
+        """Registers the financial code total signals"""
+        # pylint: disable=import-outside-toplevel, unused-import
+        from reports import signals
@@ -0,0 +1,19 @@
+"""Command to rebuild the financial code totals used by reports"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from reports.models import FinancialCodeTotal
+from reports.utils import rebuild_financial_code_totals
+
+
+class Command(BaseCommand):
+    """Rebuilds all the FinancialCodeTotal entries from the code matches"""
+    help = "Rebuilds the monthly financial code totals used by the income statement"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_financial_code_totals()
+
+        self.stdout.write(
+            "Rebuilt {} financial code totals.".format(FinancialCodeTotal.objects.count())
+        )
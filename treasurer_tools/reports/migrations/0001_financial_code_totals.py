@@ -0,0 +1,59 @@
+"""Migrations to add the monthly financial code totals."""
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DateField, DecimalField, F, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_financial_code_totals(apps, schema_editor):
+    """Calculates the totals for all existing financial code matches."""
+    # pylint: disable=unused-argument
+    FinancialCodeMatch = apps.get_model('financial_transactions', 'FinancialCodeMatch')
+    FinancialCodeTotal = apps.get_model('reports', 'FinancialCodeTotal')
+
+    summaries = FinancialCodeMatch.objects.annotate(
+        month=TruncMonth('item__transaction__date_submitted', output_field=DateField()),
+    ).values('financial_code_id', 'month').annotate(
+        total=Sum(
+            F('item__amount') + F('item__gst'),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        ),
+    ).order_by()
+
+    FinancialCodeTotal.objects.bulk_create(
+        [
+            FinancialCodeTotal(
+                financial_code_id=summary['financial_code_id'],
+                month=summary['month'],
+                total=summary['total'],
+            )
+            for summary in summaries
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    """Migrations for the FinancialCodeTotal model."""
+    initial = True
+
+    dependencies = [
+        ('financial_codes', '0004_alter_historicalbudgetyear_options_and_more'),
+        ('financial_transactions', '0007_financialtransaction_submitter_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinancialCodeTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='The first day of the month these totals apply to')),
+                ('total', models.DecimalField(decimal_places=2, default=0, help_text='The total (including tax) of all items in this month', max_digits=15)),
+                ('financial_code', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_totals', to='financial_codes.financialcode')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('financial_code', 'month'), name='unique_financial_code_month')],
+            },
+        ),
+        migrations.RunPython(populate_financial_code_totals, migrations.RunPython.noop),
+    ]
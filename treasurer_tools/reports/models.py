@@ -0,0 +1,39 @@
+"""Models for the reports app"""
+
+from django.db import models
+
+from financial_codes.models import FinancialCode
+
+
+class FinancialCodeTotal(models.Model):
+    """Total of all items assigned to a financial code in one month
+
+        These totals are derived from the FinancialCodeMatch entries and
+        are kept up to date by the signals in reports.signals. They can
+        be rebuilt with the rebuild_financial_code_totals command.
+    """
+    financial_code = models.ForeignKey(
+        FinancialCode,
+        on_delete=models.CASCADE,
+        related_name="period_totals",
+    )
+    month = models.DateField(
+        help_text="The first day of the month these totals apply to",
+    )
+    total = models.DecimalField(
+        decimal_places=2,
+        default=0,
+        help_text="The total (including tax) of all items in this month",
+        max_digits=15,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["financial_code", "month"],
+                name="unique_financial_code_month",
+            ),
+        ]
+
+    def __str__(self):
+        return "{} - {:%Y-%m} - ${}".format(self.financial_code, self.month, self.total)
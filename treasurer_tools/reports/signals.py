@@ -0,0 +1,100 @@
+"""Signals to maintain the financial code totals of the reports app"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from financial_transactions.models import FinancialCodeMatch, FinancialTransaction, Item
+
+from .utils import refresh_financial_code_totals
+
+
+def get_transaction_date(item_id):
+    """Returns the submission date of the transaction for an item ID"""
+    return FinancialTransaction.objects.filter(
+        items__id=item_id
+    ).values_list("date_submitted", flat=True).first()
+
+@receiver(pre_save, sender=FinancialCodeMatch)
+def store_original_code_match(sender, instance, raw, **kwargs):
+    """Records the original code and item of an edited code match"""
+    # pylint: disable=unused-argument
+    instance.original_totals_key = None
+
+    if instance.pk and not raw:
+        original = FinancialCodeMatch.objects.filter(id=instance.pk).values(
+            "financial_code_id", "item_id"
+        ).first()
+
+        if original:
+            instance.original_totals_key = (
+                original["financial_code_id"],
+                get_transaction_date(original["item_id"]),
+            )
+
+@receiver(post_save, sender=FinancialCodeMatch)
+@receiver(post_delete, sender=FinancialCodeMatch)
+def update_code_match_totals(sender, instance, **kwargs):
+    """Updates the totals affected by a code match change"""
+    # pylint: disable=unused-argument
+    if kwargs.get("raw", False):
+        return
+
+    keys = [(instance.financial_code_id, get_transaction_date(instance.item_id))]
+
+    if getattr(instance, "original_totals_key", None):
+        keys.append(instance.original_totals_key)
+
+    refresh_financial_code_totals(keys)
+
+@receiver(post_save, sender=Item)
+def update_item_totals(sender, instance, raw, **kwargs):
+    """Updates the totals affected by an item amount change"""
+    # pylint: disable=unused-argument
+    if raw:
+        return
+
+    code_ids = FinancialCodeMatch.objects.filter(item=instance).values_list(
+        "financial_code_id", flat=True
+    )
+
+    if code_ids:
+        date_submitted = get_transaction_date(instance.id)
+        refresh_financial_code_totals([(code_id, date_submitted) for code_id in code_ids])
+
+@receiver(pre_save, sender=FinancialTransaction)
+def store_original_transaction_date(sender, instance, raw, **kwargs):
+    """Records the original submission date of an edited transaction"""
+    # pylint: disable=unused-argument
+    instance.original_date_submitted = None
+
+    if instance.pk and not raw:
+        instance.original_date_submitted = FinancialTransaction.objects.filter(
+            id=instance.pk
+        ).values_list("date_submitted", flat=True).first()
+
+@receiver(post_save, sender=FinancialTransaction)
+def update_transaction_totals(sender, instance, raw, created, **kwargs):
+    """Moves the totals of a transaction when its date changes months"""
+    # pylint: disable=unused-argument
+    original_date = getattr(instance, "original_date_submitted", None)
+
+    if raw or created or not original_date:
+        return
+
+    # Saved dates may still be strings until the instance is reloaded
+    date_submitted = FinancialTransaction._meta.get_field("date_submitted").to_python(
+        instance.date_submitted
+    )
+
+    if original_date.replace(day=1) == date_submitted.replace(day=1):
+        return
+
+    code_ids = set(
+        FinancialCodeMatch.objects.filter(item__transaction=instance).values_list(
+            "financial_code_id", flat=True
+        )
+    )
+
+    refresh_financial_code_totals(
+        [(code_id, original_date) for code_id in code_ids]
+        + [(code_id, date_submitted) for code_id in code_ids]
+    )
@@ -0,0 +1,136 @@
+"""Test cases for the reports app utilities and signals"""
+from datetime import date
+from io import StringIO
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from financial_codes.models import FinancialCode
+from financial_transactions.models import FinancialCodeMatch, Item
+from reports.models import FinancialCodeTotal
+from reports.utils import get_date_range_code_totals, rebuild_financial_code_totals
+
+from .utils import create_financial_transactions
+
+
+class FinancialCodeTotalSignalTest(TestCase):
+    """Tests that the financial code totals follow transaction changes"""
+
+    def setUp(self):
+        self.transactions = create_financial_transactions()
+        self.expense_code = FinancialCode.objects.get(code="1000")
+        self.revenue_code = FinancialCode.objects.get(code="6000")
+
+    def get_total(self, code, month):
+        """Returns the stored total for a code and month"""
+        return FinancialCodeTotal.objects.get(financial_code=code, month=month).total
+
+    def test_totals_created_with_code_matches(self):
+        """Checks that totals are created as matches are added"""
+        self.assertEqual(self.get_total(self.expense_code, date(2017, 6, 1)), Decimal("347.29"))
+        self.assertEqual(self.get_total(self.revenue_code, date(2017, 1, 1)), Decimal("1500.00"))
+
+    def test_item_amount_change(self):
+        """Checks that totals are updated when an item amount changes"""
+        item = Item.objects.get(description="Hotel")
+        item.amount = Decimal("200.00")
+        item.save()
+
+        self.assertEqual(self.get_total(self.expense_code, date(2017, 6, 1)), Decimal("417.30"))
+
+    def test_code_match_change(self):
+        """Checks that both codes are updated when a match changes code"""
+        other_code = FinancialCode.objects.get(code="2000")
+        item = Item.objects.get(description="Hotel")
+        match = FinancialCodeMatch.objects.get(item=item, financial_code=self.expense_code)
+
+        match.financial_code = FinancialCode.objects.get(code="6000")
+        match.save()
+
+        self.assertEqual(self.get_total(self.expense_code, date(2017, 6, 1)), Decimal("210.00"))
+        self.assertEqual(self.get_total(self.revenue_code, date(2017, 6, 1)), Decimal("137.29"))
+        self.assertEqual(self.get_total(other_code, date(2017, 6, 1)), Decimal("347.29"))
+
+    def test_transaction_date_change(self):
+        """Checks that totals move when a transaction changes month"""
+        transaction = self.transactions[3]
+        transaction.date_submitted = "2017-07-15"
+        transaction.save()
+
+        self.assertEqual(self.get_total(self.expense_code, date(2017, 6, 1)), Decimal("210.00"))
+        self.assertEqual(self.get_total(self.expense_code, date(2017, 7, 1)), Decimal("137.29"))
+
+    def test_transaction_delete(self):
+        """Checks that totals are removed when transactions are deleted"""
+        self.transactions[1].delete()
+        self.transactions[2].delete()
+
+        self.assertFalse(
+            FinancialCodeTotal.objects.filter(financial_code=self.revenue_code).exists()
+        )
+
+    def test_rebuild_totals(self):
+        """Checks that rebuilding the totals gives the same results"""
+        original_totals = list(
+            FinancialCodeTotal.objects.order_by("financial_code", "month").values_list(
+                "financial_code", "month", "total"
+            )
+        )
+
+        FinancialCodeTotal.objects.all().delete()
+        rebuild_financial_code_totals()
+
+        rebuilt_totals = list(
+            FinancialCodeTotal.objects.order_by("financial_code", "month").values_list(
+                "financial_code", "month", "total"
+            )
+        )
+
+        self.assertEqual(original_totals, rebuilt_totals)
+
+    def test_rebuild_command(self):
+        """Checks that the management command rebuilds the totals"""
+        FinancialCodeTotal.objects.all().delete()
+
+        call_command("rebuild_financial_code_totals", stdout=StringIO())
+
+        self.assertEqual(self.get_total(self.expense_code, date(2017, 6, 1)), Decimal("347.29"))
+
+class DateRangeCodeTotalsTest(TestCase):
+    """Tests the combination of whole and partial month totals"""
+
+    def setUp(self):
+        create_financial_transactions()
+        self.system = FinancialCode.objects.get(
+            code="1000"
+        ).financial_code_group.budget_year.financial_code_system
+
+    def test_partial_month_range(self):
+        """Checks that partial months only include dates in range"""
+        revenue_codes, expense_codes = get_date_range_code_totals(
+            self.system.id, date(2017, 1, 2), date(2017, 6, 3)
+        )
+
+        self.assertEqual(revenue_codes[0]["total"], Decimal("500.00"))
+        self.assertEqual(expense_codes[0]["total"], Decimal("210.00"))
+
+    def test_whole_month_range(self):
+        """Checks that whole months are read from the stored totals"""
+        # Change the stored totals to confirm they are used
+        FinancialCodeTotal.objects.filter(month=date(2017, 1, 1)).update(total=Decimal("1.00"))
+
+        revenue_codes, _ = get_date_range_code_totals(
+            self.system.id, date(2017, 1, 1), date(2017, 1, 31)
+        )
+
+        self.assertEqual(revenue_codes[0]["total"], Decimal("1.00"))
+
+    def test_single_partial_month(self):
+        """Checks a range within a single month"""
+        revenue_codes, expense_codes = get_date_range_code_totals(
+            self.system.id, date(2017, 1, 4), date(2017, 1, 10)
+        )
+
+        self.assertEqual(revenue_codes[0]["total"], Decimal("500.00"))
+        self.assertEqual(expense_codes, [])
@@ -2,10 +2,17 @@
 
 from decimal import Decimal
 
+from django.db import connection
 from django.urls import reverse
 from django.test import TestCase
-
-from financial_codes.models import FinancialCodeSystem
+from django.test.utils import CaptureQueriesContext
+
+from bank_institutions.models import Institution, Account
+from bank_reconciliation.models import ReconciliationGroup
+from bank_transactions.models import Statement, BankTransaction
+from financial_codes.models import FinancialCodeSystem, BudgetYear
+from financial_transactions.models import FinancialTransaction, Item
+from investments.models import Investment, InvestmentDetail
 from .utils import create_user, create_financial_transactions
 
 class ReportsDashboard(TestCase):
@@ -250,3 +257,128 @@ class RetrieveTransactionsTest(TestCase):
 
         # Check number of expense codes received
         self.assertIsNone(response.context["expense_codes"])
+
+class RetrieveBalanceSheetTest(TestCase):
+    """Checks that the balance sheet is calculated properly"""
+
+    def setUp(self):
+        create_user()
+        self.transactions = create_financial_transactions()
+
+        # Create bank transactions
+        institution = Institution.objects.create(name="Test Institution")
+        account = Account.objects.create(institution=institution, name="Chequing")
+        statement = Statement.objects.create(
+            account=account, date_start="2017-01-01", date_end="2018-12-31"
+        )
+        BankTransaction.objects.create(
+            statement=statement, date_transaction="2017-01-10",
+            description_bank="DEP", amount_credit=2000.00,
+        )
+        BankTransaction.objects.create(
+            statement=statement, date_transaction="2017-02-10",
+            description_bank="CHQ", amount_debit=250.00,
+        )
+        BankTransaction.objects.create(
+            statement=statement, date_transaction="2018-01-10",
+            description_bank="DEP", amount_credit=5000.00,
+        )
+
+        # Create investment details
+        investment = Investment.objects.create(name="GIC", rate="1%")
+        InvestmentDetail.objects.create(
+            investment=investment, date_investment="2017-03-01",
+            detail_status="v", amount=1000.00,
+        )
+        InvestmentDetail.objects.create(
+            investment=investment, date_investment="2017-09-01",
+            detail_status="m", amount=400.00,
+        )
+        InvestmentDetail.objects.create(
+            investment=investment, date_investment="2018-03-01",
+            detail_status="m", amount=600.00,
+        )
+
+        # Create a transaction after the end of the budget year
+        late_transaction = FinancialTransaction.objects.create(
+            payee_payer=self.transactions[0].payee_payer,
+            transaction_type="e",
+            memo="Test Expense Transaction 3",
+            date_submitted="2018-02-01",
+        )
+        Item.objects.create(
+            transaction=late_transaction,
+            date_item="2018-02-01",
+            description="Hotel",
+            amount=300.00,
+            gst=15.00,
+        )
+
+        self.url = "/reports/balance-sheet/retrieve-report/"
+        self.valid_args = {
+            "budget_year": BudgetYear.objects.first().id,
+        }
+
+    def test_balance_sheet_totals(self):
+        """Checks the balance sheet totals up to the budget year end"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(self.url, self.valid_args)
+        json_response = response.json()
+
+        self.assertEqual(Decimal(json_response["cash"]), Decimal("1750.00"))
+        self.assertEqual(Decimal(json_response["investments"]), Decimal("600.00"))
+        self.assertEqual(Decimal(json_response["accounts_receivable"]), Decimal("1500.00"))
+        self.assertEqual(Decimal(json_response["accounts_payable"]), Decimal("347.29"))
+        self.assertEqual(Decimal(json_response["assets_total"]), Decimal("3850.00"))
+        self.assertEqual(Decimal(json_response["liabilities_total"]), Decimal("347.29"))
+
+    def test_reconciled_transactions_excluded(self):
+        """Checks that reconciled transactions are not receivable or payable"""
+        group = ReconciliationGroup.objects.create()
+        self.transactions[1].reconciled = group
+        self.transactions[1].save()
+        self.transactions[3].reconciled = group
+        self.transactions[3].save()
+
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(self.url, self.valid_args)
+        json_response = response.json()
+
+        self.assertEqual(Decimal(json_response["accounts_receivable"]), Decimal("500.00"))
+        self.assertEqual(Decimal(json_response["accounts_payable"]), Decimal("210.00"))
+
+    def test_query_count_independent_of_transactions(self):
+        """Checks that the totals do not query each transaction"""
+        self.client.login(username="user", password="abcd123456")
+
+        with CaptureQueriesContext(connection) as initial_queries:
+            self.client.get(self.url, self.valid_args)
+
+        # Add additional unreconciled transactions
+        for transaction_type in ["e", "r", "e"]:
+            transaction = FinancialTransaction.objects.create(
+                payee_payer=self.transactions[0].payee_payer,
+                transaction_type=transaction_type,
+                memo="Additional transaction",
+                date_submitted="2017-08-01",
+            )
+            Item.objects.create(
+                transaction=transaction,
+                date_item="2017-08-01",
+                description="Additional item",
+                amount=10.00,
+                gst=0.50,
+            )
+
+        with CaptureQueriesContext(connection) as additional_queries:
+            self.client.get(self.url, self.valid_args)
+
+        self.assertEqual(len(initial_queries), len(additional_queries))
+
+    def test_empty_response_without_budget_year(self):
+        """Checks that zero values are returned without a budget year"""
+        self.client.login(username="user", password="abcd123456")
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.json()["assets_total"], 0)
+        self.assertEqual(response.json()["liabilities_total"], 0)
@@ -0,0 +1,175 @@
+"""Objects and functions supporting the reports app"""
+from datetime import timedelta
+
+from django.db.models import DateField, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from financial_codes.models import FinancialCode
+from financial_transactions.models import FinancialCodeMatch
+
+from .models import FinancialCodeTotal
+
+
+def get_month(date_value):
+    """Returns the first day of the month for the provided date"""
+    return date_value.replace(day=1)
+
+def get_next_month(date_value):
+    """Returns the first day of the month after the provided date"""
+    return (date_value.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def summarize_code_matches(matches):
+    """Groups code matches into (financial code, month) totals"""
+    return matches.annotate(
+        month=TruncMonth("item__transaction__date_submitted", output_field=DateField()),
+    ).values("financial_code_id", "month").annotate(
+        total=Sum(
+            F("item__amount") + F("item__gst"),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        ),
+    ).order_by()
+
+def refresh_financial_code_totals(keys):
+    """Recalculates the totals for the provided (code ID, month) keys"""
+    keys = {(code_id, get_month(month)) for code_id, month in keys if code_id and month}
+
+    if not keys:
+        return
+
+    # Calculate the current totals for all the keys in a single query
+    months = [month for _, month in keys]
+    summaries = summarize_code_matches(
+        FinancialCodeMatch.objects.filter(
+            financial_code_id__in={code_id for code_id, _ in keys},
+            item__transaction__date_submitted__gte=min(months),
+            item__transaction__date_submitted__lt=get_next_month(max(months)),
+        )
+    )
+    totals = {
+        (summary["financial_code_id"], summary["month"]): summary["total"]
+        for summary in summaries
+    }
+
+    # Update the totals and remove any without matches
+    for code_id, month in keys:
+        if (code_id, month) in totals:
+            FinancialCodeTotal.objects.update_or_create(
+                financial_code_id=code_id,
+                month=month,
+                defaults={"total": totals[(code_id, month)]},
+            )
+        else:
+            FinancialCodeTotal.objects.filter(financial_code_id=code_id, month=month).delete()
+
+def rebuild_financial_code_totals():
+    """Replaces all the financial code totals from the code matches"""
+    FinancialCodeTotal.objects.all().delete()
+
+    summaries = summarize_code_matches(FinancialCodeMatch.objects.all())
+
+    FinancialCodeTotal.objects.bulk_create(
+        [
+            FinancialCodeTotal(
+                financial_code_id=summary["financial_code_id"],
+                month=summary["month"],
+                total=summary["total"],
+            )
+            for summary in summaries
+        ],
+        batch_size=1000,
+    )
+
+def split_code_totals_by_type(codes, totals=None):
+    """Splits code dictionaries into revenue and expense lists"""
+    revenue_codes = []
+    expense_codes = []
+
+    for code in codes:
+        code_details = {
+            "code": code["code"],
+            "description": code["description"],
+            "total": totals[code["id"]] if totals is not None else code["total"],
+        }
+
+        if code["financial_code_group__type"] == "r":
+            revenue_codes.append(code_details)
+        else:
+            expense_codes.append(code_details)
+
+    return revenue_codes, expense_codes
+
+def get_date_range_code_totals(financial_code_system, date_start, date_end):
+    """Returns revenue and expense code totals between two dates
+
+        Whole months are read from the FinancialCodeTotal entries. Any
+        partial month at either end of the range is totalled from the
+        code matches directly.
+    """
+    # Determine the whole months covered by the range
+    first_month = get_month(date_start)
+
+    if date_start != first_month:
+        first_month = get_next_month(date_start)
+
+    end_month = get_month(date_end)
+
+    if get_next_month(date_end) - timedelta(days=1) == date_end:
+        end_month = get_next_month(date_end)
+
+    totals = {}
+
+    # Retrieve the whole month totals
+    if first_month < end_month:
+        month_totals = FinancialCodeTotal.objects.filter(
+            Q(financial_code__financial_code_group__budget_year__financial_code_system__id=financial_code_system)
+            & Q(month__gte=first_month)
+            & Q(month__lt=end_month)
+        ).values("financial_code_id").annotate(total=Sum("total")).order_by()
+
+        for month_total in month_totals:
+            totals[month_total["financial_code_id"]] = month_total["total"]
+
+        partial_dates = (
+            Q(item__transaction__date_submitted__gte=date_start)
+            & Q(item__transaction__date_submitted__lt=first_month)
+        ) | (
+            Q(item__transaction__date_submitted__gte=end_month)
+            & Q(item__transaction__date_submitted__lte=date_end)
+        )
+    else:
+        partial_dates = (
+            Q(item__transaction__date_submitted__gte=date_start)
+            & Q(item__transaction__date_submitted__lte=date_end)
+        )
+
+    # Retrieve the partial month totals
+    partial_totals = FinancialCodeMatch.objects.filter(
+        Q(financial_code__financial_code_group__budget_year__financial_code_system__id=financial_code_system)
+        & partial_dates
+    ).values("financial_code_id").annotate(
+        total=Sum(
+            F("item__amount") + F("item__gst"),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        ),
+    ).order_by()
+
+    for partial_total in partial_totals:
+        code_id = partial_total["financial_code_id"]
+        totals[code_id] = totals.get(code_id, 0) + partial_total["total"]
+
+    # Retrieve the code details
+    codes = FinancialCode.objects.filter(id__in=totals.keys()).values(
+        "id", "code", "description", "financial_code_group__type"
+    ).order_by("code")
+
+    return split_code_totals_by_type(codes, totals)
+
+def get_budget_year_code_totals(budget_year):
+    """Returns revenue and expense code totals for a budget year"""
+    codes = FinancialCode.objects.filter(
+        financial_code_group__budget_year__id=budget_year
+    ).values(
+        "id", "code", "description", "financial_code_group__type"
+    ).order_by("code").annotate(total=Sum("period_totals__total"))
+
+    return split_code_totals_by_type(codes)
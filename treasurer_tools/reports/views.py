@@ -1,16 +1,20 @@
 """Views for the reports app"""
 
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Sum
+from django.db.models import DecimalField, F, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils.dateparse import parse_date
 
-from bank_reconciliation.models import ReconciliationGroup
-from bank_transactions.models import BankTransaction
-from financial_codes.models import FinancialCodeSystem, BudgetYear, FinancialCode
-from financial_transactions.models import FinancialTransaction
+from bank_institutions.models import Account
+from bank_transactions.utils import get_balance_subquery
+from financial_codes.models import FinancialCodeSystem, BudgetYear
+from financial_transactions.models import Item
 from investments.models import InvestmentDetail
 
+from .utils import get_budget_year_code_totals, get_date_range_code_totals
+
 
 @login_required
 def dashboard(request):
@@ -43,40 +47,22 @@ def retrieve_income_statement(request):
     date_end = request.GET.get("date_end", None)
     budget_year = request.GET.get("budget_year", None)
 
+    # Convert the dates (invalid dates are treated as missing)
+    try:
+        date_start = parse_date(date_start) if date_start else None
+        date_end = parse_date(date_end) if date_end else None
+    except ValueError:
+        date_start = None
+        date_end = None
+
     # If all values available for a date search
     if all([financial_code_system, date_start, date_end]):
-        revenue_code_totals = FinancialCode.objects.values("code", "description").filter(
-            Q(financial_code_group__budget_year__financial_code_system__id=financial_code_system)
-            & Q(financial_code_group__type="r")
-            & Q(financialcodematch__item__transaction__date_submitted__gte=date_start)
-            & Q(financialcodematch__item__transaction__date_submitted__lte=date_end)
-        ).order_by("code").annotate(
-            total=Sum("financialcodematch__item__amount") + Sum("financialcodematch__item__gst")
-        )
-
-        expense_code_totals = FinancialCode.objects.values("code", "description").filter(
-            Q(financial_code_group__budget_year__financial_code_system__id=financial_code_system)
-            & Q(financial_code_group__type="e")
-            & Q(financialcodematch__item__transaction__date_submitted__gte=date_start)
-            & Q(financialcodematch__item__transaction__date_submitted__lte=date_end)
-        ).order_by("code").annotate(
-            total=Sum("financialcodematch__item__amount") + Sum("financialcodematch__item__gst")
+        revenue_code_totals, expense_code_totals = get_date_range_code_totals(
+            financial_code_system, date_start, date_end
         )
     # If all values available for a budget year search
     elif all([financial_code_system, budget_year]):
-        revenue_code_totals = FinancialCode.objects.values("code", "description").filter(
-            Q(financial_code_group__budget_year__id=budget_year)
-            & Q(financial_code_group__type="r")
-        ).order_by("code").annotate(
-            total=Sum("financialcodematch__item__amount") + Sum("financialcodematch__item__gst")
-        )
-
-        expense_code_totals = FinancialCode.objects.values("code", "description").filter(
-            Q(financial_code_group__budget_year__id=budget_year)
-            & Q(financial_code_group__type="e")
-        ).order_by("code").annotate(
-            total=Sum("financialcodematch__item__amount") + Sum("financialcodematch__item__gst")
-        )
+        revenue_code_totals, expense_code_totals = get_budget_year_code_totals(budget_year)
     else:
         revenue_code_totals = None
         expense_code_totals = None
@@ -102,56 +88,57 @@ def retrieve_balance_sheet(request):
     if budget_year_id:
         budget_year = get_object_or_404(BudgetYear, id=budget_year_id)
         date_end = budget_year.date_end
+        output_field = DecimalField(max_digits=12, decimal_places=2)
 
         # CALCULATE CASH
-        # Get all the bank transactions between start and end date
-        bank_transaction_totals = BankTransaction.objects.filter(
-            date_transaction__lte=date_end
+        # Total the account balances (from the daily ledger) at the end date
+        cash = Account.objects.annotate(
+            balance=get_balance_subquery(OuterRef("pk"), date_end)
         ).aggregate(
-            debit=Sum("amount_debit"), credit=Sum("amount_credit")
-        )
-        debit = bank_transaction_totals["debit"] if bank_transaction_totals["debit"] else 0
-        credit = bank_transaction_totals["credit"] if bank_transaction_totals["credit"] else 0
-        cash = credit - debit
+            total=Coalesce(Sum("balance"), Value(0), output_field=output_field)
+        )["total"]
 
         # CALCULATE INVESTMENTS
-        # Get all investments that started before/during this budget year
-        investment_details = InvestmentDetail.objects.filter(
+        # Total the difference between invested and matured/cancelled
+        investment_totals = InvestmentDetail.objects.filter(
             date_investment__lte=date_end
+        ).aggregate(
+            invested=Coalesce(
+                Sum("amount", filter=Q(detail_status="v")),
+                Value(0),
+                output_field=output_field,
+            ),
+            withdrawn=Coalesce(
+                Sum("amount", filter=Q(detail_status__in=["m", "c"])),
+                Value(0),
+                output_field=output_field,
+            ),
         )
-
-        # Calculate the difference between invested and matured
-        investments = 0
-
-        for investment_detail in investment_details:
-            if investment_detail.detail_status == "v":
-                investments = investments + investment_detail.amount
-            elif investment_detail.detail_status == "m":
-                investments = investments - investment_detail.amount
-            elif investment_detail.detail_status == "c":
-                investments = investments - investment_detail.amount
+        investments = investment_totals["invested"] - investment_totals["withdrawn"]
 
         if investments < 0:
             investments = 0
 
-        # CALCULATE ACCOUNTS RECEIVABLE
-        # Get all the reconciled transactions
-        reconciled_transactions = list(ReconciliationGroup.objects.values_list(
-            "financialtransactions__id", flat=True
-        ))
-
-        # Get all the revenue transactions that have not been reconciled
-        revenue_transactions = FinancialTransaction.objects.filter(
-            transaction_type="r"
-        ).exclude(
-            id__in=reconciled_transactions
+        # CALCULATE ACCOUNTS RECEIVABLE & PAYABLE
+        # Total the items of all unreconciled transactions up to the end date
+        item_total = F("amount") + F("gst")
+        unreconciled_totals = Item.objects.filter(
+            transaction__reconciled__isnull=True,
+            transaction__date_submitted__lte=date_end,
+        ).aggregate(
+            receivable=Coalesce(
+                Sum(item_total, filter=Q(transaction__transaction_type="r")),
+                Value(0),
+                output_field=output_field,
+            ),
+            payable=Coalesce(
+                Sum(item_total, filter=Q(transaction__transaction_type="e")),
+                Value(0),
+                output_field=output_field,
+            ),
         )
-
-        # Cycle through each transaction and total the amount
-        accounts_receivable = 0
-
-        for transaction in revenue_transactions:
-            accounts_receivable += transaction.total
+        accounts_receivable = unreconciled_totals["receivable"]
+        accounts_payable = unreconciled_totals["payable"]
 
         # TOTAL ASSETS
         assets_total = cash + investments + accounts_receivable
@@ -160,20 +147,6 @@ def retrieve_balance_sheet(request):
         # Not currently being tracked in application
         debt = 0
 
-        # CALCULATE ACCOUNTS PAYABLE
-        # Get all the expense transactions that have not been reconciled
-        expense_transactions = FinancialTransaction.objects.filter(
-            transaction_type="e"
-        ).exclude(
-            id__in=reconciled_transactions
-        )
-
-        # Cycle through each transaction and total the amount
-        accounts_payable = 0
-
-        for transaction in expense_transactions:
-            accounts_payable += transaction.total
-
         # TOTAL LIABILITIES
         liabilities_total = debt + accounts_payable
     else: